@@ -0,0 +1,320 @@
+"""
+Hot-path microbenchmarks for the WugaBot backend
+
+Suites:
+    relay    Recorded Venice SSE dumps (attached_assets/Pasted-data-id-chatcmpl-*.txt)
+             plus synthetic long and citation-heavy streams, run through
+             relay_upstream_lines() and through the full /chat/stream route
+             with the upstream response replayed from memory
+    extract  extract_text_from_file() on generated PDF/DOCX/XLSX documents of
+             increasing size
+    chart    The matplotlib chart path of /generate_visualization
+    codec    json_codec against the stdlib json module (as the app used it
+             before) on the payload shapes of the hot paths: SSE frames,
+             upstream chunks, chat histories, extracted document text, base64
+             images and deep research responses
+
+Each case reports the best wall time over several rounds, per-item cost,
+throughput and peak traced allocation. Results can be saved as a baseline
+and later runs compared against it; a case slower than the baseline by more
+than the threshold is reported as a regression and the script exits with 1.
+
+Usage:
+    python benchmarks/hotpath_benchmark.py [--suite relay,extract,chart]
+        [--rounds N] [--save-baseline] [--compare] [--baseline PATH] [--threshold 0.2]
+
+    JSON_CODEC=stdlib runs the codec suite without orjson.
+"""
+
+import argparse
+import base64
+import glob
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+
+os.environ.setdefault('LOG_LEVEL', 'ERROR')
+os.environ.setdefault('PREWARM_IMPORTS', '0')
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+import text_extraction  # noqa: E402
+import json_codec  # noqa: E402
+
+
+def load_fixture_lines():
+    """Returns the recorded upstream streams as lists of raw lines"""
+    streams = {}
+    pattern = os.path.join(ROOT, 'attached_assets', 'Pasted-data-id-chatcmpl-*.txt')
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'rb') as f:
+            streams[f"fixture-{len(streams) + 1}"] = f.read().split(b'\n')
+    return streams
+
+
+def synthetic_long_stream(chunks=20000):
+    """Builds a long stream of small content deltas ending with usage and [DONE]"""
+    lines = []
+    for i in range(chunks):
+        chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "model": "bench",
+                 "choices": [{"index": 0, "delta": {"content": f" token{i}"}}]}
+        lines.append(b'data: ' + json.dumps(chunk).encode())
+        lines.append(b'')
+    usage = {"choices": [], "usage": {"prompt_tokens": 100, "completion_tokens": chunks}}
+    lines.append(b'data: ' + json.dumps(usage).encode())
+    lines.append(b'data: [DONE]')
+    return lines
+
+
+def synthetic_citation_stream(chunks=500, citations_per_chunk=20):
+    """Builds a stream where every chunk carries web search citations"""
+    lines = []
+    for i in range(chunks):
+        citations = [{"title": f"Result {i}-{j}", "url": f"https://example.com/{i}/{j}",
+                      "content": "Snippet text " * 20, "date": "2025-01-01"}
+                     for j in range(citations_per_chunk)]
+        chunk = {"venice_parameters": {"web_search_citations": citations, "enable_web_search": "on"},
+                 "choices": [{"index": 0, "delta": {
+                     "content": f" part{i}",
+                     "venice_parameters": {"web_search_citations": citations[:5]}}}]}
+        lines.append(b'data: ' + json.dumps(chunk).encode())
+    lines.append(b'data: [DONE]')
+    return lines
+
+
+def measure(func, rounds, items, item_bytes=0):
+    """
+    Times func() over several rounds and traces allocations on one extra run
+
+    Returns:
+        dict: best seconds, per-item microseconds, throughput and peak KB
+    """
+    func()  # warm up
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'seconds': best,
+        'items': items,
+        'per_item_us': best / items * 1e6 if items else 0.0,
+        'items_per_s': items / best if best else 0.0,
+        'peak_kb': peak / 1024,
+    }
+    if item_bytes:
+        result['mb_per_s'] = item_bytes / best / 1e6 if best else 0.0
+    return result
+
+
+class ReplayResponse:
+    """Upstream response stand-in that replays recorded lines"""
+    ok = True
+    status_code = 200
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.headers = {}
+
+    def iter_lines(self):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+
+def bench_relay(rounds):
+    streams = load_fixture_lines()
+    streams['synthetic-long'] = synthetic_long_stream()
+    streams['synthetic-citations'] = synthetic_citation_stream()
+    client = main.app.test_client()
+
+    results = {}
+    for name, lines in streams.items():
+        chunk_count = sum(1 for line in lines if line.startswith(b'data: '))
+        total_bytes = sum(len(line) for line in lines)
+
+        results[f"relay/{name}"] = measure(
+            lambda: list(main.relay_upstream_lines(lines, {})), rounds, chunk_count, total_bytes)
+
+        def route():
+            with mock.patch.object(main.venice.session, 'post', lambda *a, **k: ReplayResponse(lines)):
+                client.post('/chat/stream', json={'model': 'bench', 'messages': []}).get_data()
+
+        results[f"chat_stream/{name}"] = measure(route, rounds, chunk_count, total_bytes)
+    return results
+
+
+def build_pdf(pages):
+    doc = text_extraction.fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for line in range(40):
+            page.insert_text((50, 50 + line * 18), f"Page {i + 1} line {line + 1}: benchmark text for extraction")
+    return doc.tobytes()
+
+
+def build_docx(paragraphs):
+    document = text_extraction.docx.Document()
+    for i in range(paragraphs):
+        document.add_paragraph(f"Paragraph {i + 1}: benchmark text for extraction " * 3)
+    buf = io.BytesIO()
+    document.save(buf)
+    return buf.getvalue()
+
+
+def build_xlsx(rows):
+    buf = io.BytesIO()
+    frame = text_extraction.pd.DataFrame({'id': range(rows), 'name': [f"row {i}" for i in range(rows)],
+                               'value': [i * 1.5 for i in range(rows)]})
+    frame.to_excel(buf, index=False)
+    return buf.getvalue()
+
+
+def bench_extract(rounds):
+    corpora = [
+        ('pdf', build_pdf, (1, 10, 50)),
+        ('docx', build_docx, (100, 1000, 5000)),
+        ('xlsx', build_xlsx, (100, 1000, 10000)),
+    ]
+    results = {}
+    for file_type, builder, sizes in corpora:
+        for size in sizes:
+            data = builder(size)
+            results[f"extract/{file_type}-{size}"] = measure(
+                lambda: main.extract_text_from_file(data, file_type), rounds, size, len(data))
+    return results
+
+
+def bench_chart(rounds):
+    client = main.app.test_client()
+    results = {}
+    for chart_type in ('bar', 'line', 'pie'):
+        for points in (10, 100):
+            payload = {'visualization_type': 'chart', 'data': {
+                'chart_type': chart_type, 'title': 'Benchmark',
+                'labels': [f"L{i}" for i in range(points)], 'values': list(range(1, points + 1))}}
+            results[f"chart/{chart_type}-{points}"] = measure(
+                lambda: client.post('/generate_visualization', json=payload).get_data(), rounds, 1)
+    return results
+
+
+def codec_payloads():
+    """Returns (name, value, repetitions) for the JSON shapes the app encodes and decodes"""
+    citations = [{"title": f"Result {j}", "url": f"https://example.com/{j}"} for j in range(20)]
+    history = {'model': 'bench', 'temperature': 0.7, 'messages': [
+        {'role': 'user' if i % 2 == 0 else 'assistant',
+         'content': f"Message {i}: " + "a fairly ordinary sentence about the topic, with ünïcödé. " * 40}
+        for i in range(40)]}
+    text = ''.join(f"Line {i} of an extracted document – naïve café text\n" for i in range(100000))
+    image = {'images': ['data:image/png;base64,' + base64.b64encode(os.urandom(1500000)).decode('ascii')]}
+    expert = {'synthesized_response': 'Answer text. ' * 2000, 'synthesis_model': 'bench', 'candidate_count': 5,
+              'candidates': [{'model': f"model-{i}", 'content': 'Candidate text. ' * 1500} for i in range(5)]}
+    return [
+        ('sse-content', {'content': ' token'}, 10000),
+        ('sse-citations', {'venice_parameters': {'web_search_citations': citations}}, 1000),
+        ('chat-history', history, 20),
+        ('extracted-text', {'text': text}, 1),
+        ('image-base64', image, 1),
+        ('expert-response', expert, 20),
+    ]
+
+
+def bench_codec(rounds):
+    results = {}
+    for name, value, repeat in codec_payloads():
+        encoded = json.dumps(value).encode('utf-8')
+        size = len(encoded) * repeat
+        results[f"codec/{name}-dumps"] = measure(
+            lambda: [json_codec.dumps(value) for _ in range(repeat)], rounds, repeat, size)
+        results[f"stdlib/{name}-dumps"] = measure(
+            lambda: [json.dumps(value) for _ in range(repeat)], rounds, repeat, size)
+        results[f"codec/{name}-loads"] = measure(
+            lambda: [json_codec.loads(encoded) for _ in range(repeat)], rounds, repeat, size)
+        results[f"stdlib/{name}-loads"] = measure(
+            lambda: [json.loads(encoded) for _ in range(repeat)], rounds, repeat, size)
+    return results
+
+
+SUITES = {'relay': bench_relay, 'extract': bench_extract, 'chart': bench_chart, 'codec': bench_codec}
+
+
+def compare(results, baseline, threshold):
+    """Prints the change against the baseline and returns the regressed cases"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        change = result['seconds'] / base['seconds'] - 1
+        flag = 'REGRESSION' if change > threshold else ''
+        print(f"  {name:<40}{base['seconds'] * 1000:>10.2f} -> {result['seconds'] * 1000:>10.2f} ms "
+              f"({change:+.1%}) {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--suite', default=','.join(SUITES), help='comma-separated suites to run')
+    parser.add_argument('--rounds', type=int, default=5, help='timed rounds per case (best is kept)')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--compare', action='store_true', help='compare against the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before failing (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = {}
+    for suite in args.suite.split(','):
+        results.update(SUITES[suite](args.rounds))
+
+    print(f"{'case':<42}{'best ms':>10}{'us/item':>12}{'items/s':>12}{'MB/s':>8}{'peak KB':>10}")
+    for name, r in results.items():
+        mb = f"{r['mb_per_s']:.1f}" if 'mb_per_s' in r else '-'
+        print(f"{name:<42}{r['seconds'] * 1000:>10.2f}{r['per_item_us']:>12.1f}{r['items_per_s']:>12.0f}"
+              f"{mb:>8}{r['peak_kb']:>10.0f}")
+
+    exit_code = 0
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            exit_code = 2
+        else:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            print(f"\nCompared with {args.baseline} (threshold {args.threshold:.0%}):")
+            regressions = compare(results, baseline, args.threshold)
+            if regressions:
+                print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+                exit_code = 1
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+
+    sys.exit(exit_code)
+
+
+if __name__ == '__main__':
+    main_cli()
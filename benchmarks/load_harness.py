@@ -0,0 +1,354 @@
+"""
+End-to-end concurrency load test against a local mock Venice server
+
+Starts benchmarks/mock_venice.py and the app (Flask dev server or serve.py
+under gunicorn) pointed at it via VENICE_API_BASE, then ramps through
+concurrency levels. At each level N clients keep /chat/stream (and, with
+--expert-ratio, /chat/expert) requests open for --duration seconds while the
+server process tree is sampled.
+
+Per level it reports request counts and errors, TTFB and total latency
+percentiles, peak threads, memory (PSS summed over the server's processes)
+and memory added per active stream over the idle baseline. The highest level
+that stays within --max-error-rate and --ttfb-slo is reported as the maximum
+sustainable concurrency.
+
+Usage:
+    python benchmarks/load_harness.py [--server flask|gunicorn] [--levels 1,10,50,100]
+        [--duration 20] [--expert-ratio 0.1] [--ttfb 0.5] [--tokens-per-second 50]
+        [--tokens 200] [--error-rate 0] [--rate-limit 0] [--json results.json]
+
+    # Against an app that is already running (and already pointed at a mock):
+    python benchmarks/load_harness.py --url http://127.0.0.1:5000 --pid <server pid>
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=2)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def process_tree(pid):
+    """Returns pid and all of its descendants"""
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+def sample_resources(pid):
+    """
+    Reads thread count and memory of a process tree from /proc
+
+    PSS splits shared pages between the processes mapping them, so preforked
+    workers are not double counted; VmRSS is used where smaps_rollup is missing.
+
+    Returns:
+        tuple: (threads, memory in bytes)
+    """
+    threads = memory = 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status") as f:
+                status = dict(line.split(':', 1) for line in f if ':' in line)
+            threads += int(status['Threads'])
+            rss = int(status['VmRSS'].split()[0]) * 1024
+            try:
+                with open(f"/proc/{current}/smaps_rollup") as f:
+                    pss = next(int(line.split()[1]) * 1024 for line in f if line.startswith('Pss:'))
+                memory += pss
+            except (OSError, StopIteration):
+                memory += rss
+        except (OSError, KeyError):
+            continue
+    return threads, memory
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_stream(base_url, model, tokens):
+    """
+    Sends one /chat/stream request and reads it to the end
+
+    Returns:
+        dict: ok flag, TTFB (first content frame) and total seconds
+    """
+    start = time.perf_counter()
+    ttfb = None
+    try:
+        with requests.post(f"{base_url}/chat/stream", json={
+            'model': model,
+            'messages': [{'role': 'user', 'content': 'Load test prompt'}],
+            'max_completion_tokens': tokens,
+        }, stream=True, timeout=(10, 300)) as response:
+            if not response.ok:
+                return {'ok': False, 'error': f"http_{response.status_code}", 'total': time.perf_counter() - start}
+            done = False
+            for line in response.iter_lines():
+                if not line.startswith(b'data: '):
+                    continue
+                if line == b'data: [DONE]':
+                    done = True
+                    break
+                if ttfb is None:
+                    frame = json.loads(line[6:])
+                    if frame.get('error'):
+                        return {'ok': False, 'error': 'stream_error', 'total': time.perf_counter() - start}
+                    if frame.get('content') or frame.get('reasoning_content'):
+                        ttfb = time.perf_counter() - start
+            return {'ok': done, 'error': None if done else 'truncated', 'ttfb': ttfb,
+                    'total': time.perf_counter() - start}
+    except requests.exceptions.RequestException as e:
+        return {'ok': False, 'error': type(e).__name__, 'total': time.perf_counter() - start}
+
+
+def run_expert(base_url, model, tokens):
+    """Sends one /chat/expert request with three candidates"""
+    start = time.perf_counter()
+    try:
+        response = requests.post(f"{base_url}/chat/expert", json={
+            'messages': [{'role': 'user', 'content': 'Load test prompt'}],
+            'candidate_models': [model, 'llama-3.3-70b', 'qwen3-235b'],
+            'synthesis_model': model,
+            'max_completion_tokens': tokens,
+        }, timeout=(10, 400))
+        elapsed = time.perf_counter() - start
+        ok = response.ok and 'synthesized_response' in response.json()
+        return {'ok': ok, 'error': None if ok else f"http_{response.status_code}", 'ttfb': elapsed, 'total': elapsed}
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return {'ok': False, 'error': type(e).__name__, 'total': time.perf_counter() - start}
+
+
+def run_level(base_url, pid, concurrency, args):
+    """
+    Keeps `concurrency` clients busy for args.duration seconds
+
+    Returns:
+        dict: Aggregated latency, error and resource figures for the level
+    """
+    results = {'stream': [], 'expert': []}
+    results_lock = threading.Lock()
+    active = [0]
+    stop_at = time.monotonic() + args.duration
+    expert_clients = int(round(concurrency * args.expert_ratio))
+
+    def client(kind):
+        call = run_expert if kind == 'expert' else run_stream
+        while time.monotonic() < stop_at:
+            with results_lock:
+                active[0] += 1
+            result = call(base_url, args.model, args.tokens)
+            with results_lock:
+                active[0] -= 1
+                results[kind].append(result)
+
+    idle_threads, idle_memory = sample_resources(pid) if pid else (0, 0)
+    threads = [threading.Thread(target=client, args=('expert' if i < expert_clients else 'stream',), daemon=True)
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+
+    samples = []
+    while any(thread.is_alive() for thread in threads):
+        if pid:
+            server_threads, memory = sample_resources(pid)
+            samples.append((active[0], server_threads, memory))
+        time.sleep(args.sample_interval)
+
+    level = {'concurrency': concurrency, 'expert_clients': expert_clients}
+    errors = {}
+    for kind, kind_results in results.items():
+        if not kind_results:
+            continue
+        ok = [r for r in kind_results if r['ok']]
+        for r in kind_results:
+            if not r['ok']:
+                errors[r['error']] = errors.get(r['error'], 0) + 1
+        ttfbs = [r['ttfb'] for r in ok if r.get('ttfb') is not None]
+        totals = [r['total'] for r in ok]
+        level[kind] = {
+            'requests': len(kind_results),
+            'errors': len(kind_results) - len(ok),
+            'ttfb_p50': percentile(ttfbs, 50), 'ttfb_p95': percentile(ttfbs, 95), 'ttfb_p99': percentile(ttfbs, 99),
+            'total_p50': percentile(totals, 50), 'total_p99': percentile(totals, 99),
+        }
+    total_requests = sum(len(r) for r in results.values())
+    level['error_rate'] = sum(errors.values()) / total_requests if total_requests else 1.0
+    level['errors'] = errors
+
+    if samples:
+        busy = [s for s in samples if s[0] > 0] or samples
+        level['peak_threads'] = max(s[1] for s in samples)
+        level['idle_threads'] = idle_threads
+        level['peak_memory_mb'] = max(s[2] for s in samples) / 2**20
+        level['idle_memory_mb'] = idle_memory / 2**20
+        per_stream = [(s[2] - idle_memory) / s[0] for s in busy if s[0] > 0]
+        level['memory_per_stream_kb'] = statistics.mean(per_stream) / 1024 if per_stream else None
+        level['threads_per_stream'] = statistics.mean(
+            (s[1] - idle_threads) / s[0] for s in busy if s[0] > 0) if per_stream else None
+    return level
+
+
+def within_slo(level, args):
+    ttfb_p99 = level.get('stream', {}).get('ttfb_p99')
+    return level['error_rate'] <= args.max_error_rate and ttfb_p99 is not None and ttfb_p99 <= args.ttfb_slo
+
+
+def fmt(value, scale=1.0, digits=2):
+    return '-' if value is None else f"{value * scale:.{digits}f}"
+
+
+def print_level(level):
+    stream = level.get('stream', {})
+    print(f"{level['concurrency']:>6}{stream.get('requests', 0):>7}{level['error_rate']:>8.1%}"
+          f"{fmt(stream.get('ttfb_p50')):>9}{fmt(stream.get('ttfb_p95')):>9}{fmt(stream.get('ttfb_p99')):>9}"
+          f"{fmt(stream.get('total_p99')):>10}{level.get('peak_threads', '-'):>9}"
+          f"{fmt(level.get('peak_memory_mb'), digits=0):>9}{fmt(level.get('memory_per_stream_kb'), digits=0):>11}")
+    if level['errors']:
+        print(f"{'':>6}errors: {level['errors']}")
+    if 'expert' in level:
+        expert = level['expert']
+        print(f"{'':>6}expert: {expert['requests']} requests, {expert['errors']} errors, "
+              f"p50 {fmt(expert['total_p50'])}s, p99 {fmt(expert['total_p99'])}s")
+
+
+def start_processes(args):
+    """Starts the mock upstream and the app; returns (base_url, server pid, processes)"""
+    mock_port, app_port = free_port(), free_port()
+    mock_cmd = [sys.executable, os.path.join(ROOT, 'benchmarks', 'mock_venice.py'), '--port', str(mock_port),
+                '--ttfb', str(args.ttfb), '--tokens-per-second', str(args.tokens_per_second),
+                '--tokens', str(args.tokens), '--error-rate', str(args.error_rate),
+                '--rate-limit', str(args.rate_limit), '--slow-rate', str(args.slow_rate),
+                '--slow-ttfb', str(args.slow_ttfb)]
+    mock = subprocess.Popen(mock_cmd, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_until_up(f"http://127.0.0.1:{mock_port}/mock/stats")
+
+    env = dict(os.environ, VENICE_API_BASE=f"http://127.0.0.1:{mock_port}/api/v1", VENICE_API_KEY='mock',
+               LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'), PORT=str(app_port))
+    if args.server == 'gunicorn':
+        app_cmd = [sys.executable, 'serve.py']
+    else:
+        app_cmd = [sys.executable, '-c',
+                   f"import logging, main; logging.getLogger('werkzeug').setLevel(logging.WARNING); "
+                   f"main.app.run(host='127.0.0.1', port={app_port}, threaded=True)"]
+    server = subprocess.Popen(app_cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                              stderr=None if args.verbose else subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{app_port}"
+    wait_until_up(f"{base_url}/healthz")
+    return base_url, server.pid, [server, mock], f"http://127.0.0.1:{mock_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask',
+                        help="app server to start ('gunicorn' runs serve.py; WORKER_CLASS etc. are passed through)")
+    parser.add_argument('--url', help='target an already running app instead of starting one')
+    parser.add_argument('--pid', type=int, help='server pid to sample when using --url')
+    parser.add_argument('--levels', default='1,10,50,100', help='comma-separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=20, help='seconds each level runs')
+    parser.add_argument('--expert-ratio', type=float, default=0.0, help='fraction of clients using /chat/expert')
+    parser.add_argument('--model', default='mistral-31-24b')
+    parser.add_argument('--sample-interval', type=float, default=0.25)
+    parser.add_argument('--warmup', type=float, default=3.0, help='seconds to wait after the warm-up request')
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help='SLO: allowed error fraction')
+    parser.add_argument('--ttfb-slo', type=float, default=None, help='SLO: p99 TTFB seconds (default: 2x --ttfb + 1)')
+    parser.add_argument('--ttfb', type=float, default=0.5, help='mock upstream TTFB seconds')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='share of mock upstream calls with --slow-ttfb')
+    parser.add_argument('--slow-ttfb', type=float, default=5.0, help='mock upstream TTFB of the slow tail')
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='mock upstream 503 rate')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='mock upstream requests/min before 429')
+    parser.add_argument('--keep-going', action='store_true', help='run every level even after the SLO is missed')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--verbose', action='store_true', help="show the app's stderr")
+    args = parser.parse_args()
+    if args.ttfb_slo is None:
+        args.ttfb_slo = args.ttfb * 2 + 1
+
+    processes, mock_url = [], None
+    if args.url:
+        base_url, pid = args.url.rstrip('/'), args.pid
+    else:
+        base_url, pid, processes, mock_url = start_processes(args)
+
+    levels = []
+    try:
+        # One request plus a pause lets lazy imports and the background prewarm settle before the idle baseline
+        run_stream(base_url, args.model, args.tokens)
+        time.sleep(args.warmup)
+        print(f"Target {base_url} ({args.server if not args.url else 'external'}), "
+              f"SLO: error rate <= {args.max_error_rate:.0%}, p99 TTFB <= {args.ttfb_slo:.2f}s")
+        print(f"{'conc':>6}{'reqs':>7}{'errors':>8}{'ttfb50':>9}{'ttfb95':>9}{'ttfb99':>9}"
+              f"{'total99':>10}{'threads':>9}{'mem MB':>9}{'KB/stream':>11}")
+        for concurrency in (int(level) for level in args.levels.split(',')):
+            level = run_level(base_url, pid, concurrency, args)
+            level['within_slo'] = within_slo(level, args)
+            levels.append(level)
+            print_level(level)
+            if not level['within_slo'] and not args.keep_going:
+                break
+    finally:
+        upstream_stats = None
+        if mock_url:
+            try:
+                upstream_stats = requests.get(f"{mock_url}/mock/stats", timeout=2).json()
+            except requests.exceptions.RequestException:
+                pass
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    sustainable = max((level['concurrency'] for level in levels if level['within_slo']), default=0)
+    print(f"\nMax sustainable concurrency: {sustainable}")
+    if upstream_stats:
+        print(f"Mock upstream: {upstream_stats}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'levels': levels, 'max_sustainable_concurrency': sustainable,
+                       'upstream': upstream_stats, 'args': vars(args)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
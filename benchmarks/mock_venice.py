@@ -0,0 +1,262 @@
+"""
+Local mock of the Venice API endpoints used by main.py
+
+Serves /api/v1/models, /api/v1/chat/completions (streaming and non-streaming),
+/api/v1/image/generate and /api/v1/image/styles with configurable latency,
+token rate, error rate and rate limiting, so the app can be load tested
+without touching the real API. Point the app at it with:
+
+    VENICE_API_BASE=http://127.0.0.1:8100/api/v1
+
+Rate limiting mimics the upstream: requests beyond --rate-limit per minute or
+--max-concurrent in flight get a 429 with Retry-After and x-ratelimit-*
+headers. GET /mock/stats returns request, error and concurrency counters.
+
+Usage:
+    python benchmarks/mock_venice.py [--port 8100] [--ttfb 0.5] [--tokens-per-second 50]
+        [--tokens 200] [--error-rate 0.0] [--rate-limit 0] [--max-concurrent 0]
+"""
+
+import argparse
+import base64
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, Response, request
+
+app = Flask(__name__)
+
+config = {
+    'ttfb': 0.5,
+    'jitter': 0.3,
+    'slow_rate': 0.0,
+    'slow_ttfb': 10.0,
+    'tokens_per_second': 50.0,
+    'tokens': 200,
+    'error_rate': 0.0,
+    'stream_error_rate': 0.0,
+    'rate_limit': 0.0,
+    'max_concurrent': 0,
+    'retry_after': 1,
+    'image_latency': 2.0,
+    'offline_models': [],
+    'failing_models': [],
+}
+
+TEXT_MODELS = [
+    ('mistral-31-24b', {'supportsWebSearch': True, 'supportsVision': True}),
+    ('llama-3.3-70b', {'supportsWebSearch': True}),
+    ('qwen3-235b', {'supportsWebSearch': True, 'supportsReasoning': True}),
+    ('venice-uncensored', {}),
+]
+IMAGE_MODELS = ['venice-sd35', 'hidream', 'flux-dev']
+
+# 1x1 transparent PNG
+TINY_PNG = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082'
+)).decode('ascii')
+
+_lock = threading.Lock()
+_stats = {'requests': 0, 'rate_limited': 0, 'errors': 0, 'stream_errors': 0,
+          'in_flight': 0, 'peak_in_flight': 0}
+_bucket = {'tokens': 0.0, 'updated': time.monotonic()}
+
+
+def _bump(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+        if key == 'in_flight':
+            _stats['peak_in_flight'] = max(_stats['peak_in_flight'], _stats['in_flight'])
+
+
+def _rate_limit_headers(remaining):
+    return {
+        'x-ratelimit-limit-requests': str(int(config['rate_limit'])),
+        'x-ratelimit-remaining-requests': str(max(0, int(remaining))),
+        'x-ratelimit-reset-requests': str(int(time.time() + 60 / config['rate_limit'])),
+    }
+
+
+def _admit():
+    """
+    Applies the configured request rate and concurrency limits
+
+    Returns:
+        tuple: (limited, headers) where limited is True if the request gets a 429
+    """
+    with _lock:
+        if config['max_concurrent'] and _stats['in_flight'] >= config['max_concurrent']:
+            return True, {'Retry-After': str(config['retry_after'])}
+        if not config['rate_limit']:
+            return False, {}
+        now = time.monotonic()
+        _bucket['tokens'] = min(config['rate_limit'],
+                                _bucket['tokens'] + (now - _bucket['updated']) * config['rate_limit'] / 60)
+        _bucket['updated'] = now
+        if _bucket['tokens'] < 1:
+            headers = _rate_limit_headers(0)
+            headers['Retry-After'] = str(config['retry_after'])
+            return True, headers
+        _bucket['tokens'] -= 1
+        return False, _rate_limit_headers(_bucket['tokens'])
+
+
+def _guarded(handler, model=None):
+    """Counts the request and applies rate limits and random errors before handler()"""
+    _bump('requests')
+    limited, headers = _admit()
+    if limited:
+        _bump('rate_limited')
+        body = json.dumps({'error': 'Rate limit exceeded'})
+        return Response(body, status=429, headers=headers, mimetype='application/json')
+    if model in config['failing_models'] or random.random() < config['error_rate']:
+        _bump('errors')
+        return Response(json.dumps({'error': 'Mock upstream error'}), status=503,
+                        mimetype='application/json')
+    return handler(headers)
+
+
+def _sleep_ttfb():
+    base = config['slow_ttfb'] if random.random() < config['slow_rate'] else config['ttfb']
+    delay = base * random.uniform(1 - config['jitter'], 1 + config['jitter'])
+    time.sleep(max(0.0, delay))
+
+
+def _token_delay():
+    return 1.0 / config['tokens_per_second'] if config['tokens_per_second'] > 0 else 0.0
+
+
+@app.route('/api/v1/models')
+def models():
+    def handler(headers):
+        if request.args.get('type') == 'image':
+            data = [{'id': model, 'type': 'image', 'model_spec': {
+                'offline': model in config['offline_models'],
+                'constraints': {'steps': {'default': 20, 'max': 50}}}} for model in IMAGE_MODELS]
+        else:
+            data = [{'id': model, 'type': 'text', 'model_spec': {
+                'offline': model in config['offline_models'],
+                'availableContextTokens': 32768,
+                'capabilities': capabilities}} for model, capabilities in TEXT_MODELS]
+        return Response(json.dumps({'object': 'list', 'data': data}), headers=headers,
+                        mimetype='application/json')
+    return _guarded(handler)
+
+
+@app.route('/api/v1/image/styles')
+def image_styles():
+    return _guarded(lambda headers: Response(
+        json.dumps({'object': 'list', 'data': ['3D Model', 'Analog Film', 'Anime', 'Cinematic']}),
+        headers=headers, mimetype='application/json'))
+
+
+@app.route('/api/v1/image/generate', methods=['POST'])
+def image_generate():
+    def handler(headers):
+        _bump('in_flight')
+        try:
+            time.sleep(config['image_latency'] * random.uniform(1 - config['jitter'], 1 + config['jitter']))
+            body = {'id': f"img-{uuid.uuid4().hex[:12]}", 'images': [TINY_PNG] * int(request.json.get('n', 1) or 1),
+                    'timing': {'inferenceDuration': config['image_latency'] * 1000}}
+        finally:
+            _bump('in_flight', -1)
+        return Response(json.dumps(body), headers=headers, mimetype='application/json')
+    return _guarded(handler)
+
+
+@app.route('/api/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    payload = request.get_json(force=True)
+    model = payload.get('model', 'mistral-31-24b')
+    tokens = int(config['tokens'])
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:16]}"
+
+    def chunk(delta, usage=None):
+        body = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}] if delta else []}
+        if usage:
+            body['usage'] = usage
+        return f"data: {json.dumps(body)}\n\n"
+
+    def stream():
+        _bump('in_flight')
+        try:
+            _sleep_ttfb()
+            yield chunk({'role': 'assistant', 'content': ''})
+            fail_at = random.randrange(tokens) if random.random() < config['stream_error_rate'] else None
+            delay = _token_delay()
+            for i in range(tokens):
+                if i == fail_at:
+                    _bump('stream_errors')
+                    return
+                yield chunk({'content': f" token{i}"})
+                if delay:
+                    time.sleep(delay)
+            yield chunk(None, {'prompt_tokens': 50, 'completion_tokens': tokens, 'total_tokens': tokens + 50})
+            yield "data: [DONE]\n\n"
+        finally:
+            _bump('in_flight', -1)
+
+    def handler(headers):
+        if payload.get('stream'):
+            return Response(stream(), headers=headers, mimetype='text/event-stream')
+        _bump('in_flight')
+        try:
+            _sleep_ttfb()
+            time.sleep(tokens * _token_delay())
+        finally:
+            _bump('in_flight', -1)
+        body = {'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {
+                    'role': 'assistant', 'content': ' '.join(f"token{i}" for i in range(tokens))}}],
+                'usage': {'prompt_tokens': 50, 'completion_tokens': tokens, 'total_tokens': tokens + 50}}
+        return Response(json.dumps(body), headers=headers, mimetype='application/json')
+
+    return _guarded(handler, model)
+
+
+@app.route('/mock/stats')
+def stats():
+    with _lock:
+        return Response(json.dumps(_stats), mimetype='application/json')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--ttfb', type=float, default=config['ttfb'], help='seconds before the first byte')
+    parser.add_argument('--jitter', type=float, default=config['jitter'], help='relative latency jitter (0.3 = +/-30%%)')
+    parser.add_argument('--slow-rate', type=float, default=config['slow_rate'],
+                        help='fraction of requests that get --slow-ttfb instead (latency tail)')
+    parser.add_argument('--slow-ttfb', type=float, default=config['slow_ttfb'])
+    parser.add_argument('--tokens-per-second', type=float, default=config['tokens_per_second'])
+    parser.add_argument('--tokens', type=int, default=config['tokens'], help='completion tokens per response')
+    parser.add_argument('--error-rate', type=float, default=config['error_rate'], help='fraction answered with 503')
+    parser.add_argument('--stream-error-rate', type=float, default=config['stream_error_rate'],
+                        help='fraction of streams cut off mid-response')
+    parser.add_argument('--rate-limit', type=float, default=config['rate_limit'],
+                        help='requests per minute before 429 (0 = unlimited)')
+    parser.add_argument('--max-concurrent', type=int, default=config['max_concurrent'],
+                        help='in-flight requests before 429 (0 = unlimited)')
+    parser.add_argument('--retry-after', type=int, default=config['retry_after'], help='Retry-After seconds on 429')
+    parser.add_argument('--image-latency', type=float, default=config['image_latency'])
+    parser.add_argument('--offline-models', default='', help='comma-separated models reported as offline')
+    parser.add_argument('--failing-models', default='', help='comma-separated models that always answer 503')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    config.update({key: value for key, value in vars(args).items() if key in config})
+    config['offline_models'] = [m for m in args.offline_models.split(',') if m]
+    config['failing_models'] = [m for m in args.failing_models.split(',') if m]
+    _bucket['tokens'] = config['rate_limit']
+    # Per-request access logs would dominate the mock's own CPU time under load
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,158 @@
+"""
+Cold-start benchmark for the WugaBot backend
+
+Reports, each measured in a fresh interpreter so nothing is already cached:
+    - import time of every dependency registered in lazy_imports
+    - import time of main.py itself
+    - time-to-first-byte of the first and second request to each local route
+
+Routes that only proxy to Venice are left out; their latency is dominated by
+the upstream and is covered by the load harness.
+
+Usage:
+    python benchmarks/startup_benchmark.py [--prewarm] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_PROBE = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import lazy_imports
+lazy_imports.lazy_module({name!r}).load()
+print(time.perf_counter() - start)
+"""
+
+ROUTE_PROBE = """
+import io, json, os, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import main
+import_time = time.perf_counter() - start
+if {prewarm!r}:
+    main.start_prewarm().join()
+sys.path.insert(0, os.path.join({root!r}, 'benchmarks'))
+from startup_benchmark import build_request
+client = main.app.test_client()
+timings = []
+for _ in range(2):
+    kwargs = build_request({route!r}, {sample_dir!r})
+    t0 = time.perf_counter()
+    response = client.open(buffered=False, **kwargs)
+    next(iter(response.response), b'')
+    timings.append(time.perf_counter() - t0)
+    response.close()
+print(json.dumps({{'import': import_time, 'first': timings[0], 'second': timings[1]}}))
+"""
+
+ROUTES = [
+    'GET /',
+    'POST /process_file pdf',
+    'POST /process_file docx',
+    'POST /process_file xlsx',
+    'POST /generate_visualization chart',
+    'POST /generate_visualization diagram',
+    'POST /generate_visualization drawing',
+]
+
+
+def sample_file(file_type):
+    """Builds a small document of the given type in memory"""
+    import io
+    if file_type == 'pdf':
+        import fitz
+        doc = fitz.open()
+        for i in range(3):
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Benchmark page {i + 1}")
+        return doc.tobytes()
+    if file_type == 'docx':
+        import docx
+        document = docx.Document()
+        for i in range(20):
+            document.add_paragraph(f"Benchmark paragraph {i + 1}")
+        buf = io.BytesIO()
+        document.save(buf)
+        return buf.getvalue()
+    if file_type == 'xlsx':
+        import pandas as pd
+        buf = io.BytesIO()
+        pd.DataFrame({'a': range(50), 'b': range(50)}).to_excel(buf, index=False)
+        return buf.getvalue()
+    raise ValueError(file_type)
+
+
+def build_request(route, sample_dir):
+    """Returns test client keyword arguments for a benchmark route"""
+    import io
+    method, path, *variant = route.split()
+    if path == '/process_file':
+        # Samples are generated by the parent process so the probe has not imported the parsers yet
+        with open(os.path.join(sample_dir, f"sample.{variant[0]}"), 'rb') as f:
+            data = {'file': (io.BytesIO(f.read()), f"sample.{variant[0]}")}
+        return {'method': method, 'path': path, 'data': data, 'content_type': 'multipart/form-data'}
+    if path == '/generate_visualization':
+        payloads = {
+            'chart': {'chart_type': 'bar', 'title': 'Bench', 'labels': ['a', 'b'], 'values': [1, 2]},
+            'diagram': {'diagram_type': 'flowchart', 'elements': [{'text': t} for t in 'ABCDEF']},
+            'drawing': {'description': 'a cat'},
+        }
+        return {'method': method, 'path': path,
+                'json': {'visualization_type': variant[0], 'data': payloads[variant[0]]}}
+    return {'method': method, 'path': path}
+
+
+def run_probe(code):
+    env = dict(os.environ, PREWARM_IMPORTS='0', LOG_LEVEL='WARNING')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else 'probe failed')
+    return result.stdout.strip().splitlines()[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prewarm', action='store_true', help='pre-warm lazy imports before the first request')
+    parser.add_argument('--repeat', type=int, default=3, help='fresh interpreters per measurement (median is reported)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    import lazy_imports
+
+    sample_dir = tempfile.mkdtemp(prefix='wugabot-bench-')
+    for file_type in ('pdf', 'docx', 'xlsx'):
+        with open(os.path.join(sample_dir, f"sample.{file_type}"), 'wb') as f:
+            f.write(sample_file(file_type))
+
+    print(f"{'dependency':<28}{'import (ms)':>12}")
+    for name in lazy_imports.registered_modules():
+        try:
+            samples = [float(run_probe(IMPORT_PROBE.format(root=ROOT, name=name))) for _ in range(args.repeat)]
+            print(f"{name:<28}{statistics.median(samples) * 1000:>12.1f}")
+        except RuntimeError as e:
+            print(f"{name:<28}{'error':>12}  {e}")
+
+    print()
+    print(f"{'route':<40}{'main import':>12}{'1st TTFB':>12}{'2nd TTFB':>12}  (ms, prewarm={args.prewarm})")
+    for route in ROUTES:
+        try:
+            probe = ROUTE_PROBE.format(root=ROOT, route=route, prewarm=args.prewarm, sample_dir=sample_dir)
+            samples = [json.loads(run_probe(probe)) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{route:<40}{'error':>12}  {e}")
+            continue
+        row = {k: statistics.median(s[k] for s in samples) * 1000 for k in ('import', 'first', 'second')}
+        print(f"{route:<40}{row['import']:>12.1f}{row['first']:>12.1f}{row['second']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
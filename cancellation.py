@@ -0,0 +1,157 @@
+"""
+Cancellation of upstream work whose client has gone
+
+A CancelToken travels with a chat stream, a deep research run or a job. When
+the client disconnects, presses stop or cancels the job, the token is
+cancelled: every upstream response registered with it is shut down at once,
+which wakes a thread blocked reading it, and the code reading it raises
+Cancelled instead of waiting for the model to finish. The aborted connection
+is closed and its slot handed back to the pool, so no tokens, rate limit
+budget or threads are spent on an answer nobody reads.
+"""
+
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Cancelled(Exception):
+    """
+    Raised by work that stopped because its CancelToken was cancelled
+
+    Args:
+        reason (str): Why the work was cancelled (e.g. 'client_gone', 'stopped')
+    """
+
+    def __init__(self, reason):
+        self.reason = reason
+        super().__init__(f"Cancelled: {reason}")
+
+
+class CancelToken:
+    """
+    Signals cancellation to the threads working for one request
+
+    Callbacks registered with on_cancel() run once, on the thread that calls
+    cancel(); they should only close things, never block.
+    """
+
+    def __init__(self):
+        self.reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.reason is not None
+
+    def cancel(self, reason='cancelled'):
+        """
+        Cancels the token and runs its callbacks
+
+        Returns:
+            bool: False if the token was already cancelled
+        """
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug("Cancel callback failed: %s", e)
+        return True
+
+    def on_cancel(self, callback):
+        """
+        Registers a callback to run on cancellation, or runs it now if already cancelled
+
+        Returns:
+            callable: Unregisters the callback once it is no longer needed
+        """
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def check(self):
+        """Raises Cancelled if the token was cancelled"""
+        if self.reason is not None:
+            raise Cancelled(self.reason)
+
+    def child(self):
+        """Returns a token cancelled with this one that can also be cancelled on its own"""
+        child = CancelToken()
+        unregister = self.on_cancel(lambda: child.cancel(self.reason))
+        child.on_cancel(unregister)
+        return child
+
+
+def abort_response(response):
+    """
+    Closes a streaming requests.Response, waking a thread blocked reading it
+
+    Closing alone does not interrupt a read already waiting on the socket, so
+    the socket is shut down first (urllib3 2.3+); the connection is then
+    closed and released to its pool.
+    """
+    raw = getattr(response, 'raw', None)
+    shutdown = getattr(raw, 'shutdown', None)
+    if shutdown is not None:
+        try:
+            shutdown()
+        except (OSError, ValueError, RuntimeError):
+            pass  # Not connected any more, or already released
+    response.close()
+
+
+def guarded(token, response, items):
+    """
+    Iterates over the body of a streaming response until it ends or the token is cancelled
+
+    The abort is registered right away, so a cancel reaches the response even
+    before iteration starts. The response is closed when iteration stops for
+    any reason, including the consumer closing the returned generator.
+
+    Args:
+        token (CancelToken): Token of the request, or None
+        response (requests.Response): Response the items are read from
+        items (iterable): The response body, e.g. response.iter_lines()
+
+    Returns:
+        generator: The items; raises Cancelled if the token was cancelled
+            before the body ended
+    """
+    unregister = token.on_cancel(lambda: abort_response(response)) if token is not None else None
+    return _guarded(token, response, items, unregister)
+
+
+def _guarded(token, response, items, unregister):
+    try:
+        for item in items:
+            if token is not None and token.reason is not None:
+                raise Cancelled(token.reason)
+            yield item
+        if token is not None:
+            token.check()
+    except Cancelled:
+        raise
+    except Exception as e:
+        # An aborted read fails with whatever the socket layer raises; report it as the cancel it is
+        if token is not None and token.cancelled:
+            raise Cancelled(token.reason) from e
+        raise
+    finally:
+        if unregister is not None:
+            unregister()
+        response.close()
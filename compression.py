@@ -0,0 +1,146 @@
+"""
+Response compression negotiated through Accept-Encoding
+
+Regular responses (deep research JSON, extracted document text, base64
+visualizations) are compressed whole once they reach COMPRESSION_MIN_SIZE.
+Event streams are compressed incrementally: every chunk the stream yields is
+compressed and sync-flushed, so the client can decode each SSE event as soon
+as it arrives. Resumable chat streams yield every frame that is already
+buffered as one chunk, which makes that the coalescing window: a burst of
+tokens shares one flush, a lone token is never held back.
+
+Brotli is used when the client accepts it and the brotli package is installed
+(pip install .[brotli]); gzip otherwise.
+"""
+
+import gzip
+import logging
+import os
+import zlib
+
+from flask import g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION', '1') == '1'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+
+# Whole bodies can afford a better ratio than chunks that must go out immediately
+GZIP_LEVEL = 6
+GZIP_STREAM_LEVEL = 5
+BROTLI_QUALITY = 5
+BROTLI_STREAM_QUALITY = 4
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+
+
+def negotiate(accept_encoding):
+    """
+    Picks the encoding for a response
+
+    Args:
+        accept_encoding (str): The request's Accept-Encoding header
+
+    Returns:
+        str: 'br', 'gzip' or None
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', accepted.get('*', 0)) > 0:
+        return 'gzip'
+    return None
+
+
+def compress_body(data, encoding):
+    """Compresses a complete response body"""
+    if encoding == 'br':
+        return brotli.compress(data, mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compresses a streamed body, flushing after every chunk
+
+    Args:
+        chunks (iterable): str or bytes chunks as yielded by the stream
+        encoding (str): 'br' or 'gzip'
+
+    Yields:
+        bytes: Compressed data that decodes to everything yielded so far
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=BROTLI_STREAM_QUALITY)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_STREAM_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+        compress, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            yield compress(chunk) + flush()
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _compressible(response):
+    if response.status_code < 200 or response.status_code in (204, 206, 304):
+        return False
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return False
+    return (response.mimetype or '').startswith(COMPRESSIBLE_TYPES)
+
+
+def init_app(app):
+    """Compresses responses for clients that accept it"""
+
+    @app.after_request
+    def _compress(response):
+        if not COMPRESSION_ENABLED or not _compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            if response.mimetype != 'text/event-stream':
+                return response
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_SIZE:
+                return response
+            trace = g.get('trace')
+            if trace is not None:
+                with trace.span('compress'):
+                    data = compress_body(data, encoding)
+            else:
+                data = compress_body(data, encoding)
+            response.set_data(data)
+        response.headers['Content-Encoding'] = encoding
+        return response
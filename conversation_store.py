@@ -0,0 +1,325 @@
+"""
+Server-side conversation store on SQLite
+
+Conversations, their messages and the attachments those messages refer to
+(image-store references, uploaded file names) are kept in one SQLite database
+in WAL mode, so every worker process can write while others read. History is
+read in cursor-paginated pages, newest first: opening a long conversation
+costs one page, and neither the browser tab nor the server ever holds the
+whole history in memory.
+
+Cursors are opaque strings. For messages they are the id of the oldest
+message returned; for the conversation list, the last conversation's update
+time and id. Both stay valid while new messages are appended.
+"""
+
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated, id);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    model TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversation_id, id);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_id INTEGER NOT NULL REFERENCES messages (id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    ref TEXT NOT NULL,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS attachments_message ON attachments (message_id);
+"""
+
+ROLES = ('system', 'user', 'assistant')
+ATTACHMENT_KINDS = ('image', 'file')
+
+TITLE_LENGTH = 80
+
+
+class ConversationStoreError(Exception):
+    """Raised for malformed messages, attachments or cursors"""
+
+
+class ConversationNotFound(ConversationStoreError):
+    """Raised when a conversation id does not exist"""
+
+
+def _title_from(content):
+    text = content if isinstance(content, str) else \
+        ' '.join(p.get('text', '') for p in content if isinstance(p, dict) and p.get('type') == 'text')
+    text = ' '.join(text.split())
+    return text[:TITLE_LENGTH] or None
+
+
+class ConversationStore:
+    """
+    Conversations with cursor-paginated message history
+
+    Args:
+        path (str): SQLite database file
+        max_page_size (int): Largest page a caller may ask for
+        max_message_bytes (int): Largest encoded message content accepted
+    """
+
+    def __init__(self, path, max_page_size=200, max_message_bytes=4 * 1024 * 1024):
+        self.path = path
+        self.max_page_size = max_page_size
+        self.max_message_bytes = max_message_bytes
+        with closing(sqlite3.connect(path, timeout=10)) as conn:
+            # WAL is a property of the database file, so setting it once covers every later connection
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, data_dir):
+        """Builds the store from CONVERSATION_STORE* variables, or returns None if it is disabled"""
+        if os.getenv('CONVERSATION_STORE', '1') != '1':
+            return None
+        os.makedirs(data_dir, exist_ok=True)
+        return cls(
+            os.getenv('CONVERSATION_STORE_PATH', os.path.join(data_dir, 'conversations.sqlite3')),
+            max_message_bytes=int(os.getenv('CONVERSATION_MAX_MESSAGE_BYTES', str(4 * 1024 * 1024)))
+        )
+
+    @contextmanager
+    def _connect(self):
+        # A connection per operation: cheap for SQLite, and safe under threads, greenlets and forks alike
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _page_size(self, limit):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            raise ConversationStoreError("limit must be an integer")
+        return max(1, min(limit, self.max_page_size))
+
+    @staticmethod
+    def _conversation(row):
+        conversation_id, title, created, updated, message_count = row
+        return {
+            'id': conversation_id,
+            'title': title,
+            'created': created,
+            'updated': updated,
+            'message_count': message_count
+        }
+
+    def create(self, title=None):
+        """
+        Starts an empty conversation
+
+        Returns:
+            dict: The conversation's id, title, timestamps and message count
+        """
+        now = time.time()
+        conversation_id = secrets.token_hex(16)
+        title = title.strip()[:TITLE_LENGTH] if isinstance(title, str) and title.strip() else None
+        with self._connect() as conn:
+            conn.execute('INSERT INTO conversations VALUES (?, ?, ?, ?, 0)', (conversation_id, title, now, now))
+        return self._conversation((conversation_id, title, now, now, 0))
+
+    def get(self, conversation_id):
+        """
+        Returns a conversation's metadata
+
+        Raises:
+            ConversationNotFound: If the conversation does not exist
+        """
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+        if row is None:
+            raise ConversationNotFound(f"Conversation not found: {conversation_id}")
+        return self._conversation(row)
+
+    def delete(self, conversation_id):
+        """
+        Deletes a conversation with its messages and attachment references
+
+        Raises:
+            ConversationNotFound: If the conversation does not exist
+        """
+        with self._connect() as conn:
+            deleted = conn.execute('DELETE FROM conversations WHERE id = ?', (conversation_id,)).rowcount
+        if not deleted:
+            raise ConversationNotFound(f"Conversation not found: {conversation_id}")
+
+    def list(self, limit=50, cursor=None):
+        """
+        Lists conversations, most recently updated first
+
+        Args:
+            limit (int): Conversations per page
+            cursor (str, optional): next_cursor of the previous page
+
+        Returns:
+            dict: {'conversations': [...], 'next_cursor': str or None}
+        """
+        limit = self._page_size(limit)
+        sql = 'SELECT * FROM conversations'
+        params = []
+        if cursor:
+            try:
+                updated, _, conversation_id = cursor.partition(':')
+                params = [float(updated), conversation_id]
+            except ValueError:
+                raise ConversationStoreError(f"Invalid cursor: {cursor}")
+            sql += ' WHERE (updated, id) < (?, ?)'
+        sql += ' ORDER BY updated DESC, id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        with self._connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        conversations = [self._conversation(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = conversations[-1]
+            next_cursor = f"{last['updated']!r}:{last['id']}"
+        return {'conversations': conversations, 'next_cursor': next_cursor}
+
+    def _validate(self, message):
+        if not isinstance(message, dict):
+            raise ConversationStoreError("Each message must be an object")
+        role = message.get('role')
+        if role not in ROLES:
+            raise ConversationStoreError(f"Message role must be one of {', '.join(ROLES)}")
+        content = message.get('content')
+        if not isinstance(content, (str, list)):
+            raise ConversationStoreError("Message content must be a string or a list of parts")
+        encoded = json_codec.dumps(content)
+        if len(encoded) > self.max_message_bytes:
+            raise ConversationStoreError(f"Message exceeds {self.max_message_bytes} bytes")
+
+        attachments = []
+        for attachment in message.get('attachments') or []:
+            if not isinstance(attachment, dict) or attachment.get('kind') not in ATTACHMENT_KINDS \
+                    or not isinstance(attachment.get('ref'), str):
+                raise ConversationStoreError(
+                    f"Attachments need a kind ({', '.join(ATTACHMENT_KINDS)}) and a ref")
+            attachments.append((attachment['kind'], attachment['ref'], attachment.get('name')))
+        return role, content, encoded, message.get('model'), attachments
+
+    def append(self, conversation_id, messages):
+        """
+        Appends messages to a conversation in one transaction
+
+        The first user message also becomes the title of an untitled conversation.
+
+        Args:
+            conversation_id (str): Conversation id
+            messages (list): Dicts with 'role', 'content' (string or parts),
+                optional 'model' and optional 'attachments'
+                ([{'kind': 'image'|'file', 'ref': str, 'name': str}])
+
+        Returns:
+            list: Ids of the stored messages, in order
+
+        Raises:
+            ConversationNotFound: If the conversation does not exist
+            ConversationStoreError: If a message is malformed
+        """
+        if not isinstance(messages, list) or not messages:
+            raise ConversationStoreError("messages must be a non-empty list")
+        validated = [self._validate(message) for message in messages]
+        title = next((_title_from(content) for role, content, _, _, _ in validated if role == 'user'), None)
+
+        now = time.time()
+        ids = []
+        with self._connect() as conn:
+            updated = conn.execute(
+                'UPDATE conversations SET updated = ?, message_count = message_count + ?, '
+                'title = COALESCE(title, ?) WHERE id = ?',
+                (now, len(validated), title, conversation_id)).rowcount
+            if not updated:
+                raise ConversationNotFound(f"Conversation not found: {conversation_id}")
+            for role, _, encoded, model, attachments in validated:
+                message_id = conn.execute(
+                    'INSERT INTO messages (conversation_id, role, content, model, created) VALUES (?, ?, ?, ?, ?)',
+                    (conversation_id, role, encoded, model, now)).lastrowid
+                if attachments:
+                    conn.executemany('INSERT INTO attachments VALUES (?, ?, ?, ?)',
+                                     [(message_id, *attachment) for attachment in attachments])
+                ids.append(message_id)
+        return ids
+
+    def messages(self, conversation_id, limit=50, before=None):
+        """
+        Returns one page of a conversation's history
+
+        Args:
+            conversation_id (str): Conversation id
+            limit (int): Messages per page
+            before (str, optional): next_cursor of the previous page; omitted
+                for the most recent messages
+
+        Returns:
+            dict: {'messages': [...] oldest first, 'next_cursor': str or None
+                when there are no older messages}
+
+        Raises:
+            ConversationNotFound: If the conversation does not exist
+        """
+        limit = self._page_size(limit)
+        params = [conversation_id]
+        sql = 'SELECT id, role, content, model, created FROM messages WHERE conversation_id = ?'
+        if before:
+            try:
+                params.append(int(before))
+            except ValueError:
+                raise ConversationStoreError(f"Invalid cursor: {before}")
+            sql += ' AND id < ?'
+        sql += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit + 1)
+
+        with self._connect() as conn:
+            if conn.execute('SELECT 1 FROM conversations WHERE id = ?', (conversation_id,)).fetchone() is None:
+                raise ConversationNotFound(f"Conversation not found: {conversation_id}")
+            rows = conn.execute(sql, params).fetchall()
+            page = rows[:limit]
+            attachments = {}
+            if page:
+                placeholders = ','.join('?' * len(page))
+                for message_id, kind, ref, name in conn.execute(
+                        f'SELECT message_id, kind, ref, name FROM attachments WHERE message_id IN ({placeholders})',
+                        [row[0] for row in page]):
+                    attachments.setdefault(message_id, []).append({'kind': kind, 'ref': ref, 'name': name})
+
+        messages = [{
+            'id': message_id,
+            'role': role,
+            'content': json_codec.loads(content),
+            'model': model,
+            'created': created,
+            'attachments': attachments.get(message_id, [])
+        } for message_id, role, content, model, created in reversed(page)]
+        return {
+            'messages': messages,
+            'next_cursor': str(page[-1][0]) if len(rows) > limit else None
+        }
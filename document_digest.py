@@ -0,0 +1,480 @@
+"""
+Map-reduce digests of documents larger than a model's context window
+
+Text extracted by /process_file is stored once per file hash, split into
+pages (the "--- Page N ---" and "--- Sheet: X ---" markers the extractor
+writes) or, for unpaginated text, into sections on paragraph and heading
+boundaries. A digest summarizes groups of consecutive pages concurrently
+(map), then summarizes the partial summaries in batches until one summary is
+left (reduce). Every summary keeps page references, so the user can chat
+against the digest and pull in the full text of specific pages when needed.
+
+Digests are cached per document hash and model; a document digested once is
+never sent upstream again.
+"""
+
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+import json_codec
+
+logger = logging.getLogger(__name__)
+
+_DOCUMENT_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_PAGE_MARKER_RE = re.compile(r'^--- (Page \d+|Sheet: .*?) ---$', re.MULTILINE)
+
+_HEADING_RE = re.compile(r'^(#{1,6} |\d+(\.\d+)*\.? +[A-Z]|[A-Z][A-Z0-9 ,:;&-]{3,80}$)')
+
+# Bump when the prompts change so cached digests are regenerated
+DIGEST_VERSION = 1
+
+MAP_PROMPT = """Summarize the following part of the document "{name}" ({label}).
+
+Keep every key fact, figure, date, name, definition and conclusion. Write dense
+prose or bullet points, no introduction. Mark where information comes from with
+page references like [p. 12] (or [s. 3] for sections, [Sheet: name] for sheets).
+
+{text}"""
+
+REDUCE_PROMPT = """Below are summaries of consecutive parts of the document "{name}", in order.
+Merge them into one summary that covers the whole span ({label}). Remove repetition,
+keep every key fact, figure and conclusion, and keep the page references.
+
+{text}"""
+
+
+class DocumentError(Exception):
+    """Raised for unknown documents, malformed page ranges or failed digests"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def split_segments(text, section_chars=4000):
+    """
+    Splits extracted text into addressable pages
+
+    Args:
+        text (str): Text as returned by extract_text_from_file
+        section_chars (int): Target size of sections for unpaginated text
+
+    Returns:
+        list: (label, text) tuples, e.g. ('Page 3', '...'); unpaginated text
+            yields ('Section 1', ...), ('Section 2', ...)
+    """
+    parts = _PAGE_MARKER_RE.split(text)
+    if len(parts) > 1:
+        segments = [(label, body.strip()) for label, body in zip(parts[1::2], parts[2::2])]
+        if parts[0].strip():
+            segments.insert(0, ('Preamble', parts[0].strip()))
+        return segments
+
+    # Unpaginated: paragraphs grouped into sections, preferring to start a new one at a heading
+    sections = []
+    current = []
+    size = 0
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        at_heading = _HEADING_RE.match(paragraph.split('\n', 1)[0]) is not None
+        if current and (size + len(paragraph) > section_chars or (at_heading and size >= section_chars // 2)):
+            sections.append('\n\n'.join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += len(paragraph) + 2
+    if current:
+        sections.append('\n\n'.join(current))
+    return [(f"Section {i + 1}", section) for i, section in enumerate(sections)]
+
+
+def _split_long(text, limit):
+    """Splits text longer than limit on paragraph, then line, then hard boundaries"""
+    pieces = []
+    for separator in ('\n\n', '\n', None):
+        pieces = []
+        current = ''
+        for part in (text.split(separator) if separator else
+                     [text[i:i + limit] for i in range(0, len(text), limit)]):
+            joined = f"{current}{separator or ''}{part}" if current else part
+            if len(joined) <= limit:
+                current = joined
+            else:
+                if current:
+                    pieces.append(current)
+                current = part
+        pieces.append(current)
+        if all(len(piece) <= limit for piece in pieces):
+            return pieces
+    return pieces
+
+
+def _span_label(labels):
+    if len(labels) == 1:
+        return labels[0]
+    first, last = labels[0], labels[-1]
+    if first.startswith('Page ') and last.startswith('Page '):
+        return f"Pages {first[5:]}-{last[5:]}"
+    return f"{first} to {last}"
+
+
+def plan_chunks(segments, chunk_chars):
+    """
+    Groups consecutive pages into chunks that fit one summarization request
+
+    Args:
+        segments (list): (label, text) tuples from split_segments
+        chunk_chars (int): Maximum characters of document text per chunk
+
+    Returns:
+        list: Dicts with 'label' (e.g. 'Pages 3-5') and 'text' (page texts
+            with their markers, so the model can cite them)
+    """
+    chunks = []
+    labels, texts, size = [], [], 0
+
+    def flush():
+        nonlocal labels, texts, size
+        if texts:
+            chunks.append({'label': _span_label(labels), 'text': '\n\n'.join(texts)})
+        labels, texts, size = [], [], 0
+
+    for label, text in segments:
+        block = f"--- {label} ---\n{text}"
+        if len(block) > chunk_chars:
+            flush()
+            pieces = _split_long(text, chunk_chars - len(label) - 20)
+            for i, piece in enumerate(pieces):
+                part_label = f"{label} (part {i + 1}/{len(pieces)})"
+                chunks.append({'label': part_label, 'text': f"--- {part_label} ---\n{piece}"})
+            continue
+        if size + len(block) > chunk_chars:
+            flush()
+        labels.append(label)
+        texts.append(block)
+        size += len(block) + 2
+    flush()
+    return chunks
+
+
+def parse_page_spec(spec, count):
+    """
+    Parses a page selection like "3-5,9"
+
+    Args:
+        spec (str): Comma-separated 1-based page numbers and ranges
+        count (int): Number of pages in the document
+
+    Returns:
+        list: Sorted 0-based page indexes
+
+    Raises:
+        DocumentError: If the spec is malformed or out of range
+    """
+    indexes = set()
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        first, _, last = item.partition('-')
+        try:
+            first = int(first)
+            last = int(last) if last else first
+        except ValueError:
+            raise DocumentError(f"Invalid page range: {item}")
+        if not 1 <= first <= last <= count:
+            raise DocumentError(f"Page range {item} is outside 1-{count}")
+        indexes.update(range(first - 1, last))
+    if not indexes:
+        raise DocumentError("No pages selected")
+    return sorted(indexes)
+
+
+class DocumentStore:
+    """
+    Content-addressed store for extracted document text and cached digests
+
+    Args:
+        root (str): Directory documents and digests are written to
+        section_chars (int): Section size for documents without page markers
+    """
+
+    def __init__(self, root, section_chars=4000):
+        self.root = root
+        self.section_chars = section_chars
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, document_id, suffix='json'):
+        return os.path.join(self.root, f"{document_id}.{suffix}")
+
+    def _write(self, path, value):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(json_codec.dumps_bytes(value))
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def document_id(file_data):
+        """Returns the id a file is stored under: a prefix of its SHA-256"""
+        return hashlib.sha256(file_data).hexdigest()[:32]
+
+    def put(self, file_data, filename, text):
+        """
+        Stores the extracted text of an uploaded file, split into pages
+
+        Args:
+            file_data (bytes): The uploaded file, hashed for the document id
+            filename (str): Original file name
+            text (str): Extracted text
+
+        Returns:
+            dict: Document metadata (id, name, pages, characters)
+        """
+        document_id = self.document_id(file_data)
+        path = self._path(document_id)
+        with self._lock:
+            if not os.path.exists(path):
+                segments = split_segments(text, self.section_chars)
+                self._write(path, {
+                    'id': document_id,
+                    'name': filename,
+                    'labels': [label for label, _ in segments],
+                    'pages': [page for _, page in segments],
+                    'characters': len(text)
+                })
+        return self.meta(document_id)
+
+    def get(self, document_id):
+        """
+        Returns a stored document with its page texts
+
+        Raises:
+            DocumentError: If the id is malformed or unknown (404)
+        """
+        if not _DOCUMENT_ID_RE.match(document_id or ''):
+            raise DocumentError(f"Invalid document id: {document_id}")
+        try:
+            with open(self._path(document_id), 'rb') as f:
+                return json_codec.loads(f.read())
+        except FileNotFoundError:
+            raise DocumentError(f"Document not found: {document_id}", 404)
+
+    def meta(self, document_id):
+        """Returns a document's id, name, page count and size, without its text"""
+        document = self.get(document_id)
+        return {
+            'id': document['id'],
+            'name': document['name'],
+            'pages': len(document['pages']),
+            'labels': document['labels'],
+            'characters': document['characters']
+        }
+
+    def text(self, document_id):
+        """
+        Returns a stored document's text, with the page or sheet markers the extractor wrote
+
+        Raises:
+            DocumentError: If the id is malformed or unknown (404)
+        """
+        document = self.get(document_id)
+        if all(label.startswith('Section ') for label in document['labels']):
+            return '\n\n'.join(document['pages'])
+        return '\n'.join(page if label == 'Preamble' else f"--- {label} ---\n{page}"
+                         for label, page in zip(document['labels'], document['pages']))
+
+    def pages(self, document_id, spec):
+        """
+        Returns the full text of selected pages
+
+        Args:
+            document_id (str): Document id
+            spec (str): Page selection like "3-5,9" (1-based)
+
+        Returns:
+            list: Dicts with 'page' (1-based), 'label' and 'text'
+        """
+        document = self.get(document_id)
+        return [{'page': i + 1, 'label': document['labels'][i], 'text': document['pages'][i]}
+                for i in parse_page_spec(spec, len(document['pages']))]
+
+    def _digest_path(self, document_id, model):
+        key = hashlib.sha256(f"{model}:{DIGEST_VERSION}".encode('utf-8')).hexdigest()[:16]
+        return self._path(document_id, f"digest-{key}.json")
+
+    def cached_digest(self, document_id, model):
+        """Returns the cached digest of a document for a model, or None"""
+        try:
+            with open(self._digest_path(document_id, model), 'rb') as f:
+                return json_codec.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def put_digest(self, document_id, model, digest):
+        self._write(self._digest_path(document_id, model), digest)
+
+
+class DocumentDigester:
+    """
+    Builds digests with concurrent map and hierarchical reduce steps
+
+    Args:
+        store (DocumentStore): Source of documents and digest cache
+        chunk_chars (int): Document characters per map request
+        reduce_chars (int): Summary characters combined per reduce request
+        concurrency (int): Summarization requests in flight per digest; the
+            upstream governor still paces them per model
+        summary_tokens (int): Completion token cap per summary
+        max_attempts (int): Tries per summary before it is left out
+    """
+
+    def __init__(self, store, chunk_chars=12000, reduce_chars=16000, concurrency=4, summary_tokens=1200,
+                 max_attempts=3):
+        self.store = store
+        self.chunk_chars = chunk_chars
+        self.reduce_chars = reduce_chars
+        self.concurrency = concurrency
+        self.summary_tokens = summary_tokens
+        self.max_attempts = max_attempts
+
+    @classmethod
+    def from_env(cls, store):
+        return cls(
+            store,
+            chunk_chars=int(os.getenv('DIGEST_CHUNK_CHARS', '12000')),
+            reduce_chars=int(os.getenv('DIGEST_REDUCE_CHARS', '16000')),
+            concurrency=int(os.getenv('DIGEST_CONCURRENCY', '4'))
+        )
+
+    def _summarize(self, complete, prompt, retryable):
+        """Runs one summarization request, retrying the errors the caller marks as retryable"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return complete([{'role': 'user', 'content': prompt}], self.summary_tokens)
+            except Exception as e:
+                delay = retryable(e)
+                if delay is None or attempt == self.max_attempts:
+                    raise
+                logger.warning(f"Digest summary attempt {attempt} failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _map(self, executor, complete, retryable, name, items, prompt, on_done):
+        """Summarizes items concurrently; returns summaries in order and the labels that failed"""
+        futures = {
+            executor.submit(self._summarize, complete,
+                            prompt.format(name=name, label=item['label'], text=item['text']), retryable): i
+            for i, item in enumerate(items)
+        }
+        summaries = [None] * len(items)
+        failed = []
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                summaries[i] = {'label': items[i]['label'], 'text': future.result().strip()}
+            except Exception as e:
+                logger.error(f"Digest of {items[i]['label']} failed: {str(e)}")
+                failed.append(items[i]['label'])
+                summaries[i] = {'label': items[i]['label'], 'text': f"[{items[i]['label']} could not be summarized]"}
+            on_done()
+        return summaries, failed
+
+    def _batches(self, summaries):
+        """Groups consecutive summaries into reduce requests of at most reduce_chars"""
+        batches = []
+        current, size = [], 0
+        for summary in summaries:
+            block = f"[{summary['label']}]\n{summary['text']}"
+            if current and size + len(block) > self.reduce_chars:
+                batches.append(current)
+                current, size = [], 0
+            current.append(summary)
+            size += len(block) + 2
+        if current:
+            batches.append(current)
+        return [{
+            'label': _span_label([batch[0]['label'], batch[-1]['label']]) if len(batch) > 1 else batch[0]['label'],
+            'text': '\n\n'.join(f"[{summary['label']}]\n{summary['text']}" for summary in batch)
+        } for batch in batches]
+
+    def digest(self, document_id, model, complete, retryable=lambda e: None, progress=None):
+        """
+        Returns the digest of a document, building and caching it if needed
+
+        Args:
+            document_id (str): Stored document id
+            model (str): Model the summaries are written by (part of the cache key)
+            complete (callable): complete(messages, max_tokens) -> str, one
+                upstream completion
+            retryable (callable): Returns seconds to wait before retrying an
+                exception raised by complete, or None if it is final
+            progress (callable, optional): Called with progress events
+
+        Returns:
+            dict: The digest text with the document's name, page count,
+                chunk count, reduce levels and any pages left out
+
+        Raises:
+            DocumentError: If the document is unknown or every chunk failed
+        """
+        progress = progress or (lambda event: None)
+        cached = self.store.cached_digest(document_id, model)
+        if cached is not None:
+            return {**cached, 'cached': True}
+
+        document = self.store.get(document_id)
+        chunks = plan_chunks(list(zip(document['labels'], document['pages'])), self.chunk_chars)
+        start = time.perf_counter()
+        completed = 0
+
+        def on_done(phase, total, level=None):
+            nonlocal completed
+            completed += 1
+            progress({'phase': phase, 'completed': completed, 'total': total,
+                      **({'level': level} if level is not None else {})})
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency,
+                                                   thread_name_prefix='digest') as executor:
+            summaries, failed = self._map(executor, complete, retryable, document['name'], chunks, MAP_PROMPT,
+                                          lambda: on_done('map', len(chunks)))
+            if len(failed) == len(chunks):
+                raise DocumentError(f"Summarizing {document['name']} failed", 502)
+
+            level = 0
+            while len(summaries) > 1:
+                level += 1
+                batches = self._batches(summaries)
+                if len(batches) == len(summaries) and level > 1:
+                    # Summaries no longer shrink into fewer batches; concatenate what is left
+                    break
+                completed = 0
+                summaries, reduce_failed = self._map(executor, complete, retryable, document['name'], batches,
+                                                     REDUCE_PROMPT, lambda: on_done('reduce', len(batches), level))
+                # A failed reduce leaves a placeholder for its pages, so the digest is as incomplete as a failed map
+                failed.extend(reduce_failed)
+
+        digest = {
+            'document': document_id,
+            'name': document['name'],
+            'model': model,
+            'pages': len(document['pages']),
+            'chunks': len(chunks),
+            'levels': level,
+            'failed': failed,
+            'digest': '\n\n'.join(summary['text'] for summary in summaries),
+            'seconds': round(time.perf_counter() - start, 1),
+            'created': time.time()
+        }
+        if not failed:
+            self.store.put_digest(document_id, model, digest)
+        logger.info(f"Digested {document['name']}: {len(document['pages'])} pages, {len(chunks)} chunks, "
+                    f"{level} reduce level(s) in {digest['seconds']}s")
+        return {**digest, 'cached': False}
@@ -1,39 +1,197 @@
+"""
+Google AI (Gemini) chat provider
 
-import google.genai as genai
-import os
+Sends the whole conversation in one streaming generate_content call through a
+single client that is created once and reused, so its connection pool is
+shared by every request of the process. System messages become the system
+instruction and assistant turns are sent as 'model' turns.
+
+Deltas are yielded in the chunk shape /chat/stream sends to the client
+({'content': ...}, {'reasoning_content': ...} and {'error': ...} for a
+blocked prompt), followed by a {'usage': ...} chunk in Venice/OpenAI field
+names. providers.GoogleProvider adapts them to StreamEvents.
+"""
+
+import base64
 import logging
+import os
+import threading
+
+from image_store import image_ref_id
+from lazy_imports import genai, genai_types as types, genai_errors
 
 logger = logging.getLogger(__name__)
 
+# Models offered through this provider when GOOGLE_MODELS is not set
+DEFAULT_MODELS = 'gemini-2.5-flash,gemini-2.5-pro'
+
+
 class GoogleAIHandler:
-    def __init__(self):
-        api_key = os.getenv('GOOGLE_API_KEY')
-        if not api_key:
+    """
+    Streams chat completions from the Gemini API
+
+    Args:
+        api_key (str, optional): API key; defaults to GOOGLE_API_KEY
+        timeout (float): Seconds allowed per request
+        image_store (image_store.ImageStore, optional): Resolves image-store://
+            references in message content
+    """
+
+    def __init__(self, api_key=None, timeout=120.0, image_store=None):
+        self.api_key = api_key or os.getenv('GOOGLE_API_KEY')
+        if not self.api_key:
             raise ValueError("GOOGLE_API_KEY environment variable not set")
-        genai.configure(api_key=api_key)
-        
-    async def generate_response(self, messages, model="gemini-pro", temperature=0.7):
-        try:
-            # Initialize model
-            model = genai.GenerativeModel(model_name=model)
-            
-            # Create chat
-            chat = model.start_chat()
-            
-            # Send messages
-            for msg in messages:
-                if msg["role"] != "system":  # Skip system messages
-                    response = chat.send_message(
-                        msg["content"],
-                        generation_config={"temperature": temperature}
+        self.timeout = timeout
+        self.image_store = image_store
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """The shared genai.Client, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = genai.Client(
+                        api_key=self.api_key,
+                        http_options=types.HttpOptions(timeout=int(self.timeout * 1000))
                     )
-            
-            # Format response to match Venice format
+        return self._client
+
+    def _parts(self, content):
+        """Converts OpenAI-style message content (a string or a list of parts) to Gemini parts"""
+        if isinstance(content, str):
+            return [types.Part.from_text(text=content)] if content else []
+
+        parts = []
+        for item in content or []:
+            if item.get('type') == 'text' and item.get('text'):
+                parts.append(types.Part.from_text(text=item['text']))
+            elif item.get('type') == 'image_url':
+                url = (item.get('image_url') or {}).get('url', '')
+                image_id = image_ref_id(url)
+                if image_id and self.image_store is not None:
+                    meta, data_path = self.image_store.get(image_id)
+                    with open(data_path, 'rb') as f:
+                        parts.append(types.Part.from_bytes(data=f.read(), mime_type=meta['mime_type']))
+                elif url.startswith('data:') and ';base64,' in url:
+                    header, data = url.split(';base64,', 1)
+                    parts.append(types.Part.from_bytes(data=base64.b64decode(data), mime_type=header[5:]))
+                else:
+                    logger.warning("Skipping image part Gemini cannot read")
+        return parts
+
+    def build_request(self, messages):
+        """
+        Splits a chat history into Gemini contents and a system instruction
+
+        Args:
+            messages (list): Messages with 'role' and 'content'
+
+        Returns:
+            tuple: (list of types.Content, system instruction str or None)
+        """
+        system = []
+        contents = []
+        for message in messages:
+            if message.get('role') == 'system':
+                content = message.get('content')
+                system.append(content if isinstance(content, str) else
+                              ' '.join(p.get('text', '') for p in content or [] if p.get('type') == 'text'))
+                continue
+            parts = self._parts(message.get('content'))
+            if not parts:
+                continue
+            role = 'model' if message.get('role') == 'assistant' else 'user'
+            contents.append(types.Content(role=role, parts=parts))
+        return contents, '\n\n'.join(s for s in system if s) or None
+
+    def _config(self, system_instruction, temperature, max_output_tokens):
+        return types.GenerateContentConfig(
+            system_instruction=system_instruction,
+            temperature=temperature,
+            max_output_tokens=max_output_tokens
+        )
+
+    @staticmethod
+    def _chunks(response):
+        """Converts one streamed GenerateContentResponse into relay chunks"""
+        feedback = response.prompt_feedback
+        if feedback is not None and feedback.block_reason:
+            yield {'error': f"Blocked by Google AI: {feedback.block_reason}"}
+        for candidate in response.candidates or []:
+            if candidate.content is None:
+                continue
+            for part in candidate.content.parts or []:
+                if not part.text:
+                    continue
+                yield {'reasoning_content': part.text} if part.thought else {'content': part.text}
+
+    @staticmethod
+    def _usage(metadata):
+        if metadata is None:
+            return None
+        # Generated tokens are candidates_token_count in responses, response_token_count in newer UsageMetadata
+        generated = getattr(metadata, 'response_token_count', None) or getattr(metadata, 'candidates_token_count', None)
+        completion = (generated or 0) + (metadata.thoughts_token_count or 0)
+        return {
+            'prompt_tokens': metadata.prompt_token_count or 0,
+            'completion_tokens': completion,
+            'total_tokens': metadata.total_token_count or 0
+        }
+
+    @staticmethod
+    def failure_reason(error):
+        """Returns the UpstreamTimer failure reason for an error raised by the API, or None"""
+        if isinstance(error, genai_errors.APIError):
+            return f"http_{error.code}"
+        return None
+
+    def stream(self, messages, model, temperature=0.7, max_output_tokens=None):
+        """
+        Streams a reply to the full chat history in a single request
+
+        Args:
+            messages (list): Chat history including system messages
+            model (str): Gemini model id
+            temperature (float): Sampling temperature
+            max_output_tokens (int, optional): Cap on generated tokens
+
+        Yields:
+            dict: {'content': str}, {'reasoning_content': str} deltas or
+                {'error': str}, then {'usage': {...}} once the usage is known
+
+        Raises:
+            google.genai.errors.APIError: If the API rejects the request
+        """
+        contents, system_instruction = self.build_request(messages)
+        usage = None
+        for response in self.client.models.generate_content_stream(
+                model=model, contents=contents,
+                config=self._config(system_instruction, temperature, max_output_tokens)):
+            yield from self._chunks(response)
+            usage = self._usage(response.usage_metadata) or usage
+        if usage:
+            yield {'usage': usage}
+
+    async def generate_response(self, messages, model="gemini-2.5-flash", temperature=0.7):
+        """
+        Returns the complete reply to a chat history without blocking the event loop
+
+        Returns:
+            dict: {'content': str, 'role': 'assistant'}
+        """
+        try:
+            contents, system_instruction = self.build_request(messages)
+            text = []
+            async for response in await self.client.aio.models.generate_content_stream(
+                    model=model, contents=contents,
+                    config=self._config(system_instruction, temperature, None)):
+                text.extend(chunk['content'] for chunk in self._chunks(response) if 'content' in chunk)
             return {
-                "content": response.text,
+                "content": ''.join(text),
                 "role": "assistant"
             }
-            
         except Exception as e:
             logger.error(f"Google AI generation error: {str(e)}")
             raise
@@ -0,0 +1,260 @@
+"""
+Hedged first-token requests for streaming chat
+
+A slow first token dominates perceived latency, and upstream TTFB has a long
+tail. With hedging enabled, /chat/stream sends its upstream request as usual
+and, if no content has arrived after the model's recent p90 TTFB, sends a
+duplicate to the same model (or, with HEDGE_ALTERNATE=1, a healthy model of
+the same class). Whichever produces content first is relayed; the other is
+closed immediately.
+
+Hedges are limited by a budget: every stream earns HEDGE_MAX_RATE of a hedge,
+so over time at most that share of streams is duplicated, no matter how slow
+the upstream gets.
+"""
+
+import itertools
+import logging
+import os
+import queue
+import threading
+
+import requests
+
+import json_codec
+import metrics
+from cancellation import Cancelled, abort_response
+
+logger = logging.getLogger(__name__)
+
+
+def is_first_token(line):
+    """Returns True for an upstream SSE line that carries content (or ends the stream)"""
+    if not line.startswith(b'data: '):
+        return False
+    data = line[6:]
+    if data.strip() == b'[DONE]':
+        return True
+    try:
+        chunk = json_codec.loads(data)
+    except ValueError:
+        return False
+    if chunk.get('content') or chunk.get('reasoning_content'):
+        return True
+    choices = chunk.get('choices') or [{}]
+    delta = choices[0].get('delta') or {}
+    return bool(delta.get('content') or delta.get('reasoning_content'))
+
+
+class HedgeBudget:
+    """Token bucket limiting hedges to a share of all streams"""
+
+    def __init__(self, ratio, burst):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class StreamAttempt:
+    """
+    One upstream streaming request, read in a background thread up to its first content line
+
+    Args:
+        model (str): Model the request goes to
+        send (callable): send(model) -> requests.Response (stream=True)
+        timer (metrics.UpstreamTimer): Timer for this attempt
+        done (queue.Queue): Receives the attempt once it has content, failed or ended
+    """
+
+    def __init__(self, model, send, timer, done):
+        self.model = model
+        self.send = send
+        self.timer = timer
+        self.done = done
+        self.response = None
+        self.iterator = None
+        self.buffered = []
+        self.error = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run, name=f"stream-attempt-{model}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        try:
+            response = self.send(self.model)
+            self.response = response
+            if self.cancelled.is_set():
+                response.close()
+                return
+            if response.ok:
+                self.iterator = response.iter_lines()
+                for line in self.iterator:
+                    self.buffered.append(line)
+                    if is_first_token(line):
+                        break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done.put(self)
+
+    @property
+    def ok(self):
+        return self.error is None and self.response is not None and self.response.ok
+
+    def failure_reason(self):
+        if isinstance(self.error, requests.exceptions.Timeout):
+            return 'timeout'
+        if isinstance(self.error, requests.exceptions.RequestException):
+            return 'connection'
+        if self.response is not None and not self.response.ok:
+            return f"http_{self.response.status_code}"
+        return 'error'
+
+    def lines(self):
+        """Returns the buffered lines followed by the rest of the stream"""
+        if self.iterator is None:
+            return iter(self.buffered)
+        return itertools.chain(self.buffered, self.iterator)
+
+    def cancel(self):
+        """Abandons the attempt, closing its connection even mid-read"""
+        self.cancelled.set()
+        if self.response is not None:
+            abort_response(self.response)
+
+
+class Hedger:
+    """
+    Decides when to hedge a stream and races the attempts
+
+    Args:
+        health (model_health.ModelHealth): Source of TTFB figures and alternates
+        enabled (bool): Whether streams are hedged at all
+        max_rate (float): Largest share of streams that may be hedged
+        burst (float): Hedges that may be sent back to back from a full budget
+        default_delay (float): Hedge delay while a model has too few TTFB samples
+        min_delay (float): Lower bound for the hedge delay
+        min_samples (int): TTFB samples needed before the p90 is trusted
+        alternate (bool): Hedge to a healthy model of the same class instead of the same model
+    """
+
+    def __init__(self, health, enabled=False, max_rate=0.1, burst=2.0, default_delay=3.0, min_delay=0.5,
+                 min_samples=5, alternate=False):
+        self.health = health
+        self.enabled = enabled
+        self.budget = HedgeBudget(max_rate, burst)
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.alternate = alternate
+
+    @classmethod
+    def from_env(cls, health):
+        """Builds a hedger from the HEDGE_* environment variables"""
+        return cls(
+            health,
+            enabled=os.getenv('HEDGE_STREAMS', '0') == '1',
+            max_rate=float(os.getenv('HEDGE_MAX_RATE', '0.1')),
+            default_delay=float(os.getenv('HEDGE_DEFAULT_DELAY', '3')),
+            min_delay=float(os.getenv('HEDGE_MIN_DELAY', '0.5')),
+            alternate=os.getenv('HEDGE_ALTERNATE', '0') == '1'
+        )
+
+    def delay(self, model):
+        """Seconds to wait for content before hedging: the model's recent p90 TTFB"""
+        samples, p90 = self.health.ttfb_stats(model)
+        if samples < self.min_samples or p90 is None:
+            return self.default_delay
+        return max(self.min_delay, p90)
+
+    def race(self, model, send, make_timer, cancel=None):
+        """
+        Sends a stream request and hedges it if the first token is late
+
+        Args:
+            model (str): Model to use
+            send (callable): send(model) -> streaming requests.Response
+            make_timer (callable): make_timer(model) -> metrics.UpstreamTimer
+            cancel (cancellation.CancelToken, optional): Abandons every attempt when cancelled
+
+        Returns:
+            StreamAttempt: The winner (the one with content first), or the last
+                failed attempt if none succeeded
+
+        Raises:
+            Cancelled: If the token was cancelled before a winner was found
+        """
+        self.budget.earn()
+        metrics.HEDGE_ELIGIBLE.labels(metrics.model_label(model)).inc()
+        done = queue.Queue()
+        attempts = [StreamAttempt(model, send, make_timer(model), done).start()]
+
+        def abandon():
+            for attempt in list(attempts):
+                attempt.cancel()
+            # Wakes the wait below even while the attempts are still waiting for response headers
+            done.put(None)
+
+        unregister = cancel.on_cancel(abandon) if cancel is not None else (lambda: None)
+        cancelled = lambda: cancel is not None and cancel.cancelled
+        try:
+            winner = None
+            try:
+                first = done.get(timeout=self.delay(model))
+            except queue.Empty:
+                first = None
+                if cancelled():
+                    pass  # Nobody waits for this request any more, so it is not worth a hedge
+                elif self.budget.spend():
+                    hedge_model = (self.health.alternative(model) if self.alternate else None) or model
+                    logger.info(f"No first token from {model} after {self.delay(model):.2f}s, "
+                                f"hedging to {hedge_model}")
+                    attempts.append(StreamAttempt(hedge_model, send, make_timer(hedge_model), done).start())
+                else:
+                    metrics.HEDGE_SKIPPED.labels(metrics.model_label(model)).inc()
+
+            finished = []
+            while winner is None and not cancelled():
+                attempt = first if first is not None else done.get()
+                first = None
+                if attempt is None:
+                    continue
+                finished.append(attempt)
+                if attempt.ok or len(finished) == len(attempts):
+                    winner = attempt
+
+            if cancelled():
+                for attempt in attempts:
+                    attempt.cancel()
+                    attempt.timer.cancelled(cancel.reason)
+                raise Cancelled(cancel.reason)
+
+            for attempt in attempts:
+                if attempt is winner:
+                    continue
+                if attempt in finished and not attempt.ok:
+                    attempt.timer.error(attempt.failure_reason())
+                else:
+                    attempt.cancel()
+
+            if len(attempts) > 1:
+                outcome = 'primary' if winner is attempts[0] else 'hedge'
+                metrics.HEDGES.labels(metrics.model_label(model), outcome if winner.ok else 'none').inc()
+            return winner
+        finally:
+            unregister()
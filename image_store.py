@@ -0,0 +1,252 @@
+"""
+Local store for uploaded vision images
+
+Uploads are normalized once with Pillow (EXIF orientation, maximum dimension,
+output format and quality) and stored on disk under their content hash, so the
+same picture uploaded twice is only processed and stored once. Chat messages
+refer to stored images with an ``image-store://<id>`` URL; the bytes are only
+inlined as base64 data URIs while the upstream request body is being streamed.
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import re
+import secrets
+import threading
+
+import json_codec
+from lazy_imports import PIL_Image as Image, PIL_ImageOps as ImageOps
+
+logger = logging.getLogger(__name__)
+
+IMAGE_REF_SCHEME = 'image-store://'
+
+# Raw bytes read per base64 chunk when streaming a stored image (multiple of 3)
+_ENCODE_CHUNK_SIZE = 3 * 16 * 1024
+
+_IMAGE_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+
+class ImageStoreError(Exception):
+    """Raised when an upload cannot be decoded or a stored image is missing"""
+
+
+class ImageStore:
+    """
+    Content-addressed store for normalized images
+
+    Args:
+        root (str): Directory the images and their metadata are written to
+        max_dimension (int): Longest edge in pixels after normalization
+        quality (int): Encoder quality for JPEG/WebP output
+        output_format (str): 'jpeg' or 'webp'
+    """
+
+    def __init__(self, root, max_dimension=1536, quality=85, output_format='jpeg'):
+        if output_format not in _FORMATS:
+            raise ValueError(f"Unsupported image store format: {output_format}")
+        self.root = root
+        self.max_dimension = max_dimension
+        self.quality = quality
+        self.output_format = output_format
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, image_id):
+        return (os.path.join(self.root, f"{image_id}.json"),
+                os.path.join(self.root, f"{image_id}.bin"))
+
+    def _normalize(self, raw_bytes):
+        """Applies EXIF orientation, downscaling and re-encoding to an upload"""
+        try:
+            img = Image.open(io.BytesIO(raw_bytes))
+            img = ImageOps.exif_transpose(img)
+        except Exception as e:
+            raise ImageStoreError(f"Could not decode image: {str(e)}")
+
+        img.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+
+        pil_format, mime_type = _FORMATS[self.output_format]
+        has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+        if pil_format == 'JPEG' and has_alpha:
+            # JPEG has no alpha channel, flatten onto white like the browser canvas does
+            rgba = img.convert('RGBA')
+            img = Image.new('RGB', rgba.size, 'white')
+            img.paste(rgba, mask=rgba.split()[-1])
+        elif pil_format == 'JPEG' or (not has_alpha and img.mode != 'RGB'):
+            img = img.convert('RGB')
+        elif has_alpha and img.mode != 'RGBA':
+            img = img.convert('RGBA')
+
+        buf = io.BytesIO()
+        img.save(buf, format=pil_format, quality=self.quality)
+        return buf.getvalue(), mime_type, img.size
+
+    def ingest(self, raw_bytes):
+        """
+        Normalizes and stores an uploaded image, reusing an existing copy if present
+
+        Args:
+            raw_bytes (bytes): The uploaded file contents
+
+        Returns:
+            dict: Image metadata (id, mime_type, width, height, size, duplicate)
+        """
+        image_id = hashlib.sha256(raw_bytes).hexdigest()[:32]
+        meta_path, data_path = self._paths(image_id)
+
+        if os.path.exists(meta_path):
+            with open(meta_path, 'rb') as f:
+                meta = json_codec.loads(f.read())
+            logger.info(f"Image {image_id} already stored, skipping normalization")
+            return {**meta, 'duplicate': True}
+
+        data, mime_type, (width, height) = self._normalize(raw_bytes)
+        meta = {
+            'id': image_id,
+            'mime_type': mime_type,
+            'width': width,
+            'height': height,
+            'size': len(data),
+            'original_size': len(raw_bytes)
+        }
+
+        # Write data before metadata so a present .json always has its bytes; each file is written under a
+        # name unique to this process and thread and renamed into place, so workers storing the same image
+        # never interleave their writes and a reader never sees a partial file
+        self._write(data_path, data)
+        self._write(meta_path, json_codec.dumps_bytes(meta))
+
+        logger.info(f"Stored image {image_id}: {width}x{height} {mime_type}, "
+                    f"{len(raw_bytes)} -> {len(data)} bytes")
+        return {**meta, 'duplicate': False}
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, image_id):
+        """
+        Returns the metadata and data path of a stored image
+
+        Raises:
+            ImageStoreError: If the id is malformed or unknown
+        """
+        if not _IMAGE_ID_RE.match(image_id or ''):
+            raise ImageStoreError(f"Invalid image id: {image_id}")
+        meta_path, data_path = self._paths(image_id)
+        try:
+            with open(meta_path, 'rb') as f:
+                meta = json_codec.loads(f.read())
+        except FileNotFoundError:
+            raise ImageStoreError(f"Image not found: {image_id}")
+        return meta, data_path
+
+    def iter_data_uri(self, image_id):
+        """Yields a stored image as a base64 data URI in bounded chunks"""
+        meta, data_path = self.get(image_id)
+        yield f"data:{meta['mime_type']};base64,".encode('ascii')
+        with open(data_path, 'rb') as f:
+            while True:
+                chunk = f.read(_ENCODE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield base64.b64encode(chunk)
+
+    def data_uri_length(self, image_id):
+        """Returns the exact byte length of iter_data_uri() for an image"""
+        meta, _ = self.get(image_id)
+        prefix = len(f"data:{meta['mime_type']};base64,")
+        return prefix + 4 * ((meta['size'] + 2) // 3)
+
+
+def image_ref_id(url):
+    """Returns the stored image id for an image-store URL, or None"""
+    if isinstance(url, str) and url.startswith(IMAGE_REF_SCHEME):
+        return url[len(IMAGE_REF_SCHEME):]
+    return None
+
+
+class StreamingJSONBody:
+    """
+    Sized, re-iterable request body that inlines stored images while sending
+
+    requests sends objects with __len__ and __iter__ with a Content-Length header
+    instead of chunked encoding, so only one base64 chunk per image is held in
+    memory at a time.
+    """
+
+    def __init__(self, store, parts):
+        self.store = store
+        self.parts = parts
+        self._length = sum(
+            len(part) if isinstance(part, bytes) else store.data_uri_length(part)
+            for part in parts
+        )
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                yield from self.store.iter_data_uri(part)
+
+
+def _replace_refs(value, refs, token):
+    """Copies a payload, swapping image-store URLs for placeholder tokens"""
+    if isinstance(value, dict):
+        return {k: _replace_refs(v, refs, token) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_refs(v, refs, token) for v in value]
+    image_id = image_ref_id(value)
+    if image_id is not None:
+        refs.append(image_id)
+        return f"{token}:{len(refs) - 1}:{token}"
+    return value
+
+
+def encode_json_body(store, payload):
+    """
+    Serializes an upstream payload, resolving image-store references
+
+    Args:
+        store (ImageStore): Store the referenced images are read from
+        payload (dict): JSON payload that may contain image-store:// URLs
+
+    Returns:
+        bytes or StreamingJSONBody: Body to pass as requests' ``data=``
+
+    Raises:
+        ImageStoreError: If a referenced image is missing
+    """
+    refs = []
+    # Random token so user text can never be mistaken for a placeholder
+    token = f"image-ref-{secrets.token_hex(8)}"
+    resolved = _replace_refs(payload, refs, token)
+    if not refs:
+        return json_codec.dumps_bytes(resolved)
+    encoded = json_codec.dumps(resolved)
+
+    for image_id in refs:
+        store.get(image_id)
+
+    parts = []
+    last = 0
+    for match in re.finditer(rf"{token}:(\d+):{token}", encoded):
+        parts.append(encoded[last:match.start()].encode('utf-8'))
+        parts.append(refs[int(match.group(1))])
+        last = match.end()
+    parts.append(encoded[last:].encode('utf-8'))
+    return StreamingJSONBody(store, parts)
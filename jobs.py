@@ -0,0 +1,425 @@
+"""
+Background jobs for long-running requests
+
+Deep research (up to six minutes of candidates and synthesis) and image
+generation can be submitted as jobs instead of holding an HTTP request open.
+A job runs on a bounded thread pool in the worker that accepted it; its state,
+progress events and result are written to SQLite in WAL mode, so any worker
+can answer a poll or an event subscription, and a client that disconnects
+picks the result up later. Finished jobs are kept for JOB_RESULT_TTL seconds.
+
+Jobs are not re-run after a restart: a job whose worker process is gone is
+reported as failed with the reason 'interrupted'. Running jobs count as
+in-flight work for graceful shutdown, so a draining worker finishes them
+first.
+"""
+
+import concurrent.futures
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import closing, contextmanager
+
+import json_codec
+import lifecycle
+import metrics
+from cancellation import CancelToken, Cancelled
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pid INTEGER NOT NULL,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    expires REAL,
+    cancel INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    status_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL REFERENCES jobs (id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+"""
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Seconds between checks for jobs whose worker died and results past their TTL
+_MAINTENANCE_INTERVAL = 60
+
+
+class JobError(Exception):
+    """Raised by a job handler to fail the job with a message and an HTTP status"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class JobQueueFull(Exception):
+    """Raised when this worker already has as many jobs as it accepts"""
+
+
+class JobNotFound(Exception):
+    """Raised when a job id does not exist or its result has expired"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a handler's progress() call once the job was cancelled"""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Bounded pool of background jobs with persisted state
+
+    Handlers are registered per kind and called as handler(params, progress,
+    cancel) on a pool thread. progress(event) stores a JSON-able progress event
+    for subscribers and raises JobCancelled once the job has been cancelled.
+    cancel is a CancelToken that is cancelled as soon as the job is, from any
+    worker, so upstream calls in flight are aborted without waiting for the
+    next progress event. The handler's return value becomes the job's result;
+    JobError fails the job with the given message and status code.
+
+    Args:
+        path (str): SQLite database file
+        workers (int): Jobs run concurrently per worker process
+        max_pending (int): Jobs a worker process holds (running plus queued)
+            before submissions are refused
+        result_ttl (float): Seconds finished jobs and their results are kept
+        poll_interval (float): Seconds between checks for events and cancels
+            written by other processes
+    """
+
+    def __init__(self, path, workers=4, max_pending=32, result_ttl=3600, poll_interval=0.5):
+        self.path = path
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._futures = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._executor = None
+        self._executor_pid = None
+        self._last_maintenance = 0.0
+        with closing(sqlite3.connect(path, timeout=10)) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_env(cls, data_dir):
+        """Builds the queue from JOB_* variables, or returns None if JOBS=0"""
+        if os.getenv('JOBS', '1') != '1':
+            return None
+        os.makedirs(data_dir, exist_ok=True)
+        return cls(
+            os.getenv('JOBS_PATH', os.path.join(data_dir, 'jobs.sqlite3')),
+            workers=int(os.getenv('JOB_WORKERS', '4')),
+            max_pending=int(os.getenv('JOB_MAX_PENDING', '32')),
+            result_ttl=float(os.getenv('JOB_RESULT_TTL', '3600'))
+        )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def register(self, kind, handler):
+        """Registers the handler that runs jobs of a kind"""
+        self._handlers[kind] = handler
+
+    @property
+    def kinds(self):
+        return tuple(self._handlers)
+
+    def _pool(self):
+        # Created lazily and per process: threads started before gunicorn forks do not exist in the workers
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix='job')
+                    self._futures = {}
+                    self._tokens = {}
+                    self._executor_pid = os.getpid()
+                    threading.Thread(target=self._watch_cancels, name='job-cancel-watcher', daemon=True).start()
+        return self._executor
+
+    def _watch_cancels(self):
+        """Fires the tokens of running jobs that another worker process cancelled"""
+        pid = os.getpid()
+        while self._executor_pid == pid:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                running = list(self._tokens)
+            if not running:
+                continue
+            try:
+                with self._connect() as conn:
+                    cancelled = conn.execute(
+                        f"SELECT id FROM jobs WHERE cancel = 1 AND id IN ({','.join('?' * len(running))})",
+                        running).fetchall()
+            except sqlite3.Error as e:
+                logger.warning(f"Job cancel check failed: {str(e)}")
+                continue
+            for job_id, in cancelled:
+                token = self._tokens.get(job_id)
+                if token is not None:
+                    token.cancel('job_cancelled')
+
+    def submit(self, kind, params):
+        """
+        Queues a job
+
+        Args:
+            kind (str): A registered job kind
+            params (dict): Passed to the handler as is; not persisted
+
+        Returns:
+            dict: The queued job
+
+        Raises:
+            ValueError: If the kind is not registered
+            JobQueueFull: If this worker already holds max_pending jobs
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self._maintain()
+        pool = self._pool()
+        job_id = secrets.token_hex(16)
+        with self._lock:
+            if len(self._futures) >= self.max_pending:
+                metrics.JOBS.labels(kind, 'rejected').inc()
+                raise JobQueueFull(f"Too many background jobs in progress (limit {self.max_pending})")
+            with self._connect() as conn:
+                conn.execute('INSERT INTO jobs (id, kind, status, pid, created) VALUES (?, ?, ?, ?, ?)',
+                             (job_id, kind, QUEUED, os.getpid(), time.time()))
+            self._futures[job_id] = pool.submit(self._run, job_id, kind, params)
+        logger.info(f"Job {job_id} ({kind}) queued")
+        return self.get(job_id)
+
+    def _run(self, job_id, kind, params):
+        try:
+            with self._connect() as conn:
+                started = conn.execute(
+                    'UPDATE jobs SET status = ?, started = ? WHERE id = ? AND status = ? AND cancel = 0',
+                    (RUNNING, time.time(), job_id, QUEUED)).rowcount
+            if not started:
+                self._finish(job_id, CANCELLED)
+                return
+
+            seq = 0
+            token = CancelToken()
+            with self._lock:
+                self._tokens[job_id] = token
+
+            def progress(event):
+                nonlocal seq
+                seq += 1
+                with self._connect() as conn:
+                    conn.execute('INSERT INTO job_events VALUES (?, ?, ?, ?)',
+                                 (job_id, seq, time.time(), json_codec.dumps(event)))
+                self._notify()
+                if token.cancelled or self._cancel_requested(job_id):
+                    token.cancel('job_cancelled')
+                    raise JobCancelled()
+
+            with lifecycle.in_flight():
+                try:
+                    result = self._handlers[kind](params, progress, token)
+                except (JobCancelled, Cancelled):
+                    self._finish(job_id, CANCELLED)
+                except JobError as e:
+                    self._finish(job_id, FAILED, error=e.message, status_code=e.status_code)
+                except Exception as e:
+                    logger.exception(f"Job {job_id} ({kind}) failed: {str(e)}")
+                    self._finish(job_id, FAILED, error=str(e), status_code=500)
+                else:
+                    # A cancel that arrived after the last progress event still discards the result
+                    if self._cancel_requested(job_id):
+                        self._finish(job_id, CANCELLED)
+                    else:
+                        self._finish(job_id, SUCCEEDED, result=result)
+        except sqlite3.Error as e:
+            logger.error(f"Job {job_id} ({kind}) could not record its state: {str(e)}")
+        finally:
+            with self._lock:
+                self._futures.pop(job_id, None)
+                self._tokens.pop(job_id, None)
+                self._changed.notify_all()
+
+    def _cancel_requested(self, job_id):
+        with self._connect() as conn:
+            return bool(conn.execute('SELECT cancel FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])
+
+    def _finish(self, job_id, status, result=None, error=None, status_code=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET status = ?, finished = ?, expires = ?, result = ?, error = ?, status_code = ? '
+                'WHERE id = ?',
+                (status, now, now + self.result_ttl, None if result is None else json_codec.dumps(result),
+                 error, status_code, job_id))
+            kind = conn.execute('SELECT kind FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+        metrics.JOBS.labels(kind, status).inc()
+        logger.info(f"Job {job_id} ({kind}) {status}")
+        self._notify()
+
+    def _notify(self):
+        with self._lock:
+            self._changed.notify_all()
+
+    def _maintain(self):
+        """Fails jobs whose worker process died and deletes expired results"""
+        now = time.time()
+        if now - self._last_maintenance < _MAINTENANCE_INTERVAL:
+            return
+        self._last_maintenance = now
+        try:
+            with self._connect() as conn:
+                orphans = conn.execute('SELECT id, pid FROM jobs WHERE status IN (?, ?)', (QUEUED, RUNNING)).fetchall()
+                dead = [(job_id,) for job_id, pid in orphans if pid != os.getpid() and not _pid_alive(pid)]
+                if dead:
+                    conn.executemany(
+                        'UPDATE jobs SET status = ?, finished = ?, expires = ?, error = ?, status_code = 503 '
+                        'WHERE id = ?',
+                        [(FAILED, now, now + self.result_ttl, 'interrupted', job_id) for job_id, in dead])
+                    logger.warning(f"Marked {len(dead)} job(s) of exited workers as interrupted")
+                conn.execute('DELETE FROM jobs WHERE expires < ?', (now,))
+        except sqlite3.Error as e:
+            logger.warning(f"Job maintenance failed: {str(e)}")
+
+    @staticmethod
+    def _job(row):
+        job_id, kind, status, created, started, finished, expires, result, error, status_code = row
+        job = {'id': job_id, 'kind': kind, 'status': status, 'created': created, 'started': started,
+               'finished': finished}
+        if status in FINISHED:
+            job['expires'] = expires
+        if result is not None:
+            job['result'] = json_codec.loads(result)
+        if error is not None:
+            job['error'] = error
+            job['status_code'] = status_code
+        return job
+
+    def get(self, job_id, include_result=True):
+        """
+        Returns a job's state, with its result once it has succeeded
+
+        Raises:
+            JobNotFound: If the job does not exist or has expired
+        """
+        self._maintain()
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT id, kind, status, created, started, finished, expires, "
+                f"{'result' if include_result else 'NULL'}, error, status_code FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if row is None:
+            raise JobNotFound(f"Job not found: {job_id}")
+        return self._job(row)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job; a queued job never starts, a running one has its upstream calls aborted
+
+        Returns:
+            dict: The job's state after the request
+
+        Raises:
+            JobNotFound: If the job does not exist or has expired
+        """
+        with self._connect() as conn:
+            if not conn.execute('UPDATE jobs SET cancel = 1 WHERE id = ?', (job_id,)).rowcount:
+                raise JobNotFound(f"Job not found: {job_id}")
+        local = self._executor_pid == os.getpid()
+        future = self._futures.get(job_id) if local else None
+        if future is not None and future.cancel():
+            self._finish(job_id, CANCELLED)
+            with self._lock:
+                self._futures.pop(job_id, None)
+        # A job running in another worker is reached by that worker's cancel watcher
+        token = self._tokens.get(job_id) if local else None
+        if token is not None:
+            token.cancel('job_cancelled')
+        return self.get(job_id, include_result=False)
+
+    def events(self, job_id, after=0, heartbeat=15.0):
+        """
+        Follows a job's progress until it finishes
+
+        Args:
+            job_id (str): Job id
+            after (int): Sequence number of the last event already seen
+            heartbeat (float): Seconds without events after which None is
+                yielded, so the caller can keep the connection alive
+
+        Yields:
+            tuple or None: (seq, event) for every progress event, then
+                (None, job) with the final state; None as a heartbeat
+
+        Raises:
+            JobNotFound: If the job does not exist or has expired
+        """
+        self.get(job_id, include_result=False)
+        last_activity = time.monotonic()
+        while True:
+            with self._connect() as conn:
+                rows = conn.execute('SELECT seq, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq',
+                                    (job_id, after)).fetchall()
+                status = conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            for seq, data in rows:
+                after = seq
+                yield seq, json_codec.loads(data)
+            if status is None:
+                raise JobNotFound(f"Job not found: {job_id}")
+            if status[0] in FINISHED:
+                yield None, self.get(job_id)
+                return
+
+            if rows:
+                last_activity = time.monotonic()
+            elif time.monotonic() - last_activity >= heartbeat:
+                last_activity = time.monotonic()
+                yield None
+            # Woken early by events of jobs in this process; jobs elsewhere are picked up by polling
+            with self._lock:
+                self._changed.wait(self.poll_interval)
@@ -0,0 +1,117 @@
+"""
+JSON codec for the hot paths
+
+Every SSE frame, upstream chunk, chat history and extracted document passes
+through JSON. This module uses orjson when it is installed and the stdlib
+json module otherwise, with the same output either way: compact separators
+and UTF-8 text instead of \\u escapes. Values orjson refuses (integers beyond
+64 bits, lone surrogates) are encoded by the stdlib instead of failing.
+
+The two backends agree byte for byte on strings, integers, booleans, None
+and containers. Floats are shortest round-trip in both but differ in exponent
+notation (1e+16 vs 1e16), which any JSON parser reads the same, and orjson
+writes NaN and Infinity as null where the stdlib writes invalid JSON.
+
+Set JSON_CODEC=stdlib to force the stdlib backend.
+"""
+
+import json
+import os
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.getenv('JSON_CODEC', 'auto') == 'stdlib':
+    orjson = None
+
+BACKEND = 'orjson' if orjson is not None else 'stdlib'
+
+# orjson.JSONDecodeError subclasses this, so one except clause covers both backends
+JSONDecodeError = json.JSONDecodeError
+
+_SEPARATORS = (',', ':')
+
+
+def _stdlib_dumps(obj, default=None):
+    return json.dumps(obj, separators=_SEPARATORS, ensure_ascii=False, default=default)
+
+
+def _stdlib_dumps_bytes(obj, default=None):
+    try:
+        return _stdlib_dumps(obj, default).encode('utf-8')
+    except UnicodeEncodeError:
+        # Lone surrogates have no UTF-8 form; \u escapes keep the output valid
+        return json.dumps(obj, separators=_SEPARATORS, default=default).encode('ascii')
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj, default=None):
+        """Encodes a value as compact UTF-8 JSON bytes"""
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS)
+        except TypeError:
+            return _stdlib_dumps_bytes(obj, default)
+
+    def dumps(obj, default=None):
+        """Encodes a value as a compact JSON string"""
+        try:
+            return orjson.dumps(obj, default=default, option=_ORJSON_OPTIONS).decode('utf-8')
+        except TypeError:
+            return _stdlib_dumps(obj, default)
+
+    def loads(data):
+        """Decodes JSON from str, bytes or bytearray"""
+        return orjson.loads(data)
+
+else:
+    def dumps_bytes(obj, default=None):
+        """Encodes a value as compact UTF-8 JSON bytes"""
+        return _stdlib_dumps_bytes(obj, default)
+
+    def dumps(obj, default=None):
+        """Encodes a value as a compact JSON string"""
+        return _stdlib_dumps(obj, default)
+
+    def loads(data):
+        """Decodes JSON from str, bytes or bytearray"""
+        return json.loads(data)
+
+
+def sse(obj):
+    """Returns a value as an SSE data frame"""
+    return f"data: {dumps(obj)}\n\n"
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider backed by the codec
+
+    request.json / request.get_json() and jsonify() go through it. Calls with
+    explicit json module options (e.g. indent) keep the stdlib behaviour.
+    """
+
+    ensure_ascii = False
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        options = dict(kwargs)
+        # jsonify() asks for compact separators, which is what the codec writes anyway
+        if options.pop('separators', _SEPARATORS) != _SEPARATORS or options:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj, default=self.default)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+
+def init_app(app):
+    """Makes the codec Flask's JSON provider"""
+    app.json = CodecJSONProvider(app)
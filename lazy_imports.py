@@ -0,0 +1,148 @@
+"""
+Lazy import registry for heavy optional dependencies
+
+File extraction and visualization pull in large libraries (PyMuPDF, pandas,
+matplotlib, Pillow, ...) that most requests never touch. Modules registered
+here are imported on first attribute access instead of at startup, which keeps
+cold starts short on scale-from-zero deployments. prewarm() imports them in a
+background thread once the server is up so the first request that needs one
+does not pay for it either. Import times are recorded for the startup benchmark.
+"""
+
+import importlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+# Seconds spent importing each registered module, filled in on first load
+import_timings = {}
+
+
+def _use_agg_backend(name):
+    """Selects the non-interactive backend before pyplot is imported"""
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+class LazyModule:
+    """
+    Proxy that imports a module on first attribute access
+
+    Args:
+        name (str): Dotted module name to import
+        setup (callable, optional): Called with the module name before importing
+    """
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Imports the module if needed and returns it"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    if self._setup:
+                        self._setup(self._name)
+                    module = importlib.import_module(self._name)
+                    import_timings[self._name] = time.perf_counter() - start
+                    logger.debug(f"Lazy import of {self._name} took {import_timings[self._name]:.3f}s")
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.loaded else 'not loaded'
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name, setup=None):
+    """
+    Returns the shared lazy proxy for a module, registering it on first use
+
+    Args:
+        name (str): Dotted module name
+        setup (callable, optional): Hook run once before the import
+
+    Returns:
+        LazyModule: Proxy resolving to the imported module
+    """
+    with _registry_lock:
+        proxy = _registry.get(name)
+        if proxy is None:
+            proxy = LazyModule(name, setup)
+            _registry[name] = proxy
+        return proxy
+
+
+def registered_modules():
+    """Returns the names of all registered lazy modules"""
+    with _registry_lock:
+        return list(_registry)
+
+
+def prewarm(names=None):
+    """
+    Imports registered modules, logging failures instead of raising
+
+    Args:
+        names (list, optional): Modules to load; defaults to all registered modules
+    """
+    start = time.perf_counter()
+    for name in names or registered_modules():
+        try:
+            lazy_module(name).load()
+        except Exception as e:
+            logger.warning(f"Pre-warm import of {name} failed: {str(e)}")
+    logger.info(f"Pre-warmed lazy imports in {time.perf_counter() - start:.2f}s")
+
+
+def start_prewarm(delay=0.0, names=None):
+    """
+    Runs prewarm() in a daemon thread so it never delays startup
+
+    Args:
+        delay (float): Seconds to wait before importing, letting the server bind first
+        names (list, optional): Modules to load; defaults to all registered modules
+
+    Returns:
+        threading.Thread: The started pre-warm thread
+    """
+    def run():
+        if delay:
+            time.sleep(delay)
+        prewarm(names)
+
+    thread = threading.Thread(target=run, name='lazy-import-prewarm', daemon=True)
+    thread.start()
+    return thread
+
+
+# Heavy dependencies shared across the app
+PyPDF2 = lazy_module('PyPDF2')
+docx = lazy_module('docx')
+pandas = lazy_module('pandas')
+fitz = lazy_module('fitz')
+pyplot = lazy_module('matplotlib.pyplot', setup=_use_agg_backend)
+PIL_Image = lazy_module('PIL.Image')
+PIL_ImageOps = lazy_module('PIL.ImageOps')
+PIL_ImageDraw = lazy_module('PIL.ImageDraw')
+PIL_ImageFont = lazy_module('PIL.ImageFont')
+svgwrite = lazy_module('svgwrite')
+genai = lazy_module('google.genai')
+genai_types = lazy_module('google.genai.types')
+genai_errors = lazy_module('google.genai.errors')
@@ -0,0 +1,102 @@
+"""
+Request lifecycle tracking for graceful shutdown
+
+Long-running routes (SSE streams, deep research) are wrapped with @drainable so
+the process knows how many are in flight. When a worker is told to stop,
+begin_drain() makes those routes refuse new work with 503 + Retry-After while
+the requests already running are allowed to finish.
+"""
+
+import functools
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+from flask import make_response
+
+logger = logging.getLogger(__name__)
+
+_draining = threading.Event()
+_active_lock = threading.Condition()
+_active_requests = 0
+
+
+def is_draining():
+    """Returns True once the process has started shutting down"""
+    return _draining.is_set()
+
+
+def begin_drain():
+    """Stops accepting new long-running requests; in-flight ones keep running"""
+    if not _draining.is_set():
+        _draining.set()
+        logger.info(f"Draining: refusing new streams, {active_requests()} still in flight")
+
+
+def active_requests():
+    """Returns the number of in-flight drainable requests"""
+    with _active_lock:
+        return _active_requests
+
+
+def _enter():
+    global _active_requests
+    with _active_lock:
+        _active_requests += 1
+
+
+def _exit():
+    global _active_requests
+    with _active_lock:
+        _active_requests -= 1
+        _active_lock.notify_all()
+
+
+@contextmanager
+def in_flight():
+    """Counts the enclosed work, such as a background job, as an in-flight request"""
+    _enter()
+    try:
+        yield
+    finally:
+        _exit()
+
+
+def wait_idle(timeout=None):
+    """
+    Blocks until no drainable requests are in flight
+
+    Args:
+        timeout (float, optional): Maximum seconds to wait
+
+    Returns:
+        bool: True if idle, False if the timeout expired first
+    """
+    with _active_lock:
+        return _active_lock.wait_for(lambda: _active_requests == 0, timeout)
+
+
+def drainable(view):
+    """
+    Marks a route as long-running for graceful shutdown
+
+    The request counts as in flight until its response (including a streamed
+    body) has been closed. While draining, new requests get a 503.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if is_draining():
+            return json.dumps({'error': 'Server is restarting, please retry shortly'}), 503, {
+                'Content-Type': 'application/json',
+                'Retry-After': '5'
+            }
+        _enter()
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            _exit()
+            raise
+        response.call_on_close(_exit)
+        return response
+    return wrapper
@@ -0,0 +1,267 @@
+"""
+Non-blocking structured logging
+
+Request threads never format or write log records. A QueueHandler on the root
+logger puts each record on a bounded in-memory queue, unformatted; a listener
+thread formats it and writes it to stderr. Message arguments are therefore
+only rendered in the listener, and only for records that pass the level
+check, so ``logger.debug("Payload: %s", Payload(payload))`` costs one level
+check on the request path when DEBUG is off. When the queue is full, records
+are dropped and counted rather than blocking the request.
+
+Records are written as one JSON object per line (or in the classic text
+format with LOG_FORMAT=text). Any extra= fields are included. Long strings are
+truncated, base64 data is replaced by its length and credentials by a marker,
+so a logged payload with images and a long chat history stays one short line.
+
+High-volume debug records (one per stream chunk) are passed with
+``extra={'sample': '<key>'}`` and only one in LOG_SAMPLE_EVERY of them per key
+is kept.
+"""
+
+import atexit
+import datetime
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+
+import json_codec
+import metrics
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else on a record came from extra=
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+SECRET_KEYS = ('api_key', 'apikey', 'authorization', 'password', 'secret', 'token')
+
+DATA_URL = re.compile(r'data:([\w.+/-]+);base64,[A-Za-z0-9+/=\s]+')
+# Base64 runs too long to be words or ids: raw image data without a data: prefix
+BASE64_RUN = re.compile(r'[A-Za-z0-9+/]{256,}={0,2}')
+
+
+def _is_secret(key):
+    key = str(key).lower()
+    # Token counts (max_completion_tokens, tokens_per_second) are not credentials
+    return 'tokens' not in key and any(secret in key for secret in SECRET_KEYS)
+
+
+def redact_text(text, max_chars):
+    """Replaces base64 data in a string and truncates it to max_chars"""
+    if len(text) > 64:
+        text = DATA_URL.sub(lambda m: f"data:{m.group(1)};base64,<{len(m.group(0))} chars>", text)
+        text = BASE64_RUN.sub(lambda m: f"<base64 {len(m.group(0))} chars>", text)
+    if max_chars and len(text) > max_chars:
+        text = f"{text[:max_chars]}...<{len(text) - max_chars} more chars>"
+    return text
+
+
+def redact(value, max_chars=2000, max_items=50):
+    """
+    Returns a copy of a value that is safe and short enough to log
+
+    Args:
+        value: Any JSON-like value (dicts, lists, strings, numbers)
+        max_chars (int): Longest string kept in full
+        max_items (int): Longest list kept in full; later items are counted
+
+    Returns:
+        The value with base64 data replaced, secrets masked, and long strings
+        and lists truncated
+    """
+    if isinstance(value, str):
+        return redact_text(value, max_chars)
+    if isinstance(value, dict):
+        return {key: '<redacted>' if _is_secret(key) else redact(item, max_chars, max_items)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [redact(item, max_chars, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"<{len(value) - max_items} more items>")
+        return items
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    return value
+
+
+class Payload:
+    """
+    Wraps a value for logging as redacted JSON
+
+    The value is only serialized when the record is formatted, in the listener
+    thread, so wrapping a request payload in a debug call is free when DEBUG
+    is off.
+    """
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json_codec.dumps(redact(self.value, max_chars=200, max_items=20), default=str)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, including extra= fields"""
+
+    def __init__(self, max_chars=2000):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': redact_text(record.getMessage(), self.max_chars),
+            'pid': record.process,
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in entry:
+                entry[key] = '<redacted>' if _is_secret(key) else redact(value, self.max_chars)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json_codec.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The classic text format, with the message redacted and truncated"""
+
+    def __init__(self, max_chars=2000):
+        super().__init__(TEXT_FORMAT)
+        self.max_chars = max_chars
+
+    def formatMessage(self, record):
+        record.message = redact_text(record.message, self.max_chars)
+        return super().formatMessage(record)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps one in ``every`` records per sample key
+
+    Records without a ``sample`` attribute always pass. Kept records get a
+    ``sampled_every`` attribute so readers can scale counts back up.
+    """
+
+    def __init__(self, every=100):
+        super().__init__()
+        self.every = max(1, every)
+        self._counters = {}
+
+    def filter(self, record):
+        key = getattr(record, 'sample', None)
+        if key is None or self.every == 1:
+            return True
+        counter = self._counters.get(key)
+        if counter is None:
+            counter = self._counters.setdefault(key, itertools.count())
+        # next() on itertools.count is atomic under the GIL, so no lock is needed
+        if next(counter) % self.every:
+            return False
+        record.sampled_every = self.every
+        return True
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The stdlib uses put_nowait, which fails on a full queue at shutdown
+        self.queue.put(self._sentinel, timeout=5)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a listener thread without formatting them
+
+    The queue and listener are created lazily and per process: a thread
+    started before gunicorn forks does not exist in the workers, and a queue
+    inherited across a fork may have its lock held.
+
+    Args:
+        target (logging.Handler): Handler the listener writes records to
+        max_queue (int): Records buffered before new ones are dropped
+    """
+
+    def __init__(self, target, max_queue=10000):
+        super().__init__(None)
+        self.target = target
+        self.max_queue = max_queue
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.Queue(maxsize=self.max_queue)
+            self._listener = _Listener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.flush_and_stop)
+
+    def prepare(self, record):
+        # The stdlib formats here, on the calling thread; the listener's formatter does it instead
+        return record
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+    def flush_and_stop(self):
+        """Writes out queued records and stops the listener"""
+        if self._listener is None or self._pid != os.getpid():
+            return
+        try:
+            self._listener.stop()
+        except queue.Full:
+            pass
+        self._listener = None
+        self._pid = None
+
+    def close(self):
+        # logging.shutdown() closes handlers at exit, including in processes that skip atexit
+        self.flush_and_stop()
+        super().close()
+
+
+def configure(level='INFO'):
+    """
+    Routes the root logger through the queue, from LOG_* variables
+
+    LOG_FORMAT is 'json' (default) or 'text'; LOG_QUEUE_SIZE bounds the queue,
+    LOG_MAX_FIELD_CHARS truncates long strings and LOG_SAMPLE_EVERY thins
+    sampled debug records.
+
+    Args:
+        level (str): Root log level name
+    """
+    max_chars = int(os.getenv('LOG_MAX_FIELD_CHARS', '2000'))
+    formatter = TextFormatter(max_chars) if os.getenv('LOG_FORMAT', 'json') == 'text' else JSONFormatter(max_chars)
+    target = logging.StreamHandler(sys.stderr)
+    target.setFormatter(formatter)
+
+    handler = QueueLogHandler(target, max_queue=int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    handler.addFilter(SamplingFilter(int(os.getenv('LOG_SAMPLE_EVERY', '100'))))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level))
+    return handler
@@ -8,54 +8,255 @@ Author: WugaBot Team
 Version: 1.0
 """
 
-from flask import Flask, Response, render_template, request
-from openai import OpenAI
+from flask import Flask, Response, render_template, request, send_file
 import os
-import json
-import PyPDF2
-import docx
+import base64
 import io
 import logging
+import threading
+import time
+import zipfile
+import concurrent.futures
 
-# Configure logging
-log_level = os.getenv('LOG_LEVEL', 'INFO')
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+import log_pipeline
+
+# Configure logging: records are formatted and written by a background thread
+log_pipeline.configure(os.getenv('LOG_LEVEL', 'INFO'))
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
 import requests
+from lazy_imports import pyplot as plt, svgwrite, PIL_Image as Image, PIL_ImageDraw as ImageDraw, \
+    PIL_ImageFont as ImageFont, start_prewarm
+import json_codec
+import metrics
+import profiler
+import tracing
+import compression
+from lifecycle import drainable, is_draining, active_requests
+from image_store import ImageStore, ImageStoreError, IMAGE_REF_SCHEME
+from usage_ledger import UsageLedger, BUCKETS as USAGE_BUCKETS
+from conversation_store import ConversationStore, ConversationStoreError, ConversationNotFound
+from jobs import JobQueue, JobError, JobQueueFull, JobNotFound
+from document_digest import DocumentStore, DocumentDigester, DocumentError
+from text_extraction import ExtractionPool, SUPPORTED_TYPES, extract_text_from_file
+from upstream_governor import UpstreamGovernor, UpstreamBusyError
+from model_health import ModelHealth
+from hedging import Hedger
+from replay_buffer import StreamRegistry, ResumeError
+from cancellation import CancelToken, Cancelled
+from upstream_timeouts import UpstreamTimeouts
+from providers import ProviderRegistry, VeniceProvider, GoogleProvider, ProviderError, StreamEvent, venice_events
+
+DATA_DIR = os.getenv('WUGABOT_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+image_store = ImageStore(
+    os.path.join(DATA_DIR, 'images'),
+    max_dimension=int(os.getenv('IMAGE_MAX_DIMENSION', '1536')),
+    quality=int(os.getenv('IMAGE_QUALITY', '85')),
+    output_format=os.getenv('IMAGE_UPLOAD_FORMAT', 'jpeg')
+)
+
+# Tokens and timings of every upstream call, written to SQLite off the request path
+usage_ledger = UsageLedger.from_env(DATA_DIR)
+metrics.UpstreamTimer.ledger = usage_ledger
+
+# Chat histories, so conversations survive reloads and open one page at a time
+conversation_store = ConversationStore.from_env(DATA_DIR)
+
+# Extracted document text by file hash, and map-reduce digests of documents too large to paste into a prompt
+document_store = DocumentStore(os.path.join(DATA_DIR, 'documents'))
+digester = DocumentDigester.from_env(document_store)
+DIGEST_THRESHOLD_CHARS = int(os.getenv('DIGEST_THRESHOLD_CHARS', '24000'))
+
+# Deep research and image generation in the background; handlers are registered below the routes they share code with
+job_queue = JobQueue.from_env(DATA_DIR)
+
+json_codec.init_app(app)
+metrics.init_app(app)
+tracing.init_app(app)
+compression.init_app(app)
+
+# Base URL of the Venice API; point it at benchmarks/mock_venice.py for load tests
+VENICE_API_BASE = os.getenv('VENICE_API_BASE', 'https://api.venice.ai/api/v1').rstrip('/')
+
+# Paces model calls per model and retries 429/503 before anything is relayed
+governor = UpstreamGovernor.from_env()
+
+# Circuit breaker per model; unhealthy models are routed to a fallback of the same class
+model_health = ModelHealth.from_env()
+
+# Connect, first-byte and idle limits per model class; a watchdog ends upstream streams that stall
+upstream_timeouts = UpstreamTimeouts.from_env()
+
+# One pooled client per upstream vendor; models go to a provider by id prefix, the rest to Venice
+venice = VeniceProvider(VENICE_API_BASE, governor, image_store, upstream_timeouts,
+                        pool_size=int(os.getenv('VENICE_POOL_SIZE', '32')))
+providers = ProviderRegistry(default=venice)
+providers.register(GoogleProvider.from_env(image_store, upstream_timeouts))
+
+model_health.catalog_loader = providers.catalog
+upstream_timeouts.capabilities = model_health.capabilities
+model_health.timeouts = upstream_timeouts
+
+
+def known_model(model):
+    """Returns True for models in the text catalog and for known image models"""
+    return (model_health.known(model) or model in _image_default_steps or
+            any(image_model['id'] == model for image_model in KNOWN_IMAGE_MODELS))
+
+
+# Model ids outside the catalogs are labelled 'unknown' in metrics and share one rate limit bucket
+metrics.known_model = known_model
+
+# Opt-in duplicate requests for streams whose first token is late
+hedger = Hedger.from_env(model_health)
+
+# Chat streams are buffered per stream so a dropped client can resume with Last-Event-ID;
+# the upstream request of a stream without a client is cancelled after STREAM_CANCEL_GRACE
+STREAM_RESUME = os.getenv('STREAM_RESUME', '1') == '1'
+stream_registry = StreamRegistry(
+    capacity=int(os.getenv('STREAM_REPLAY_FRAMES', '4096')),
+    grace=float(os.getenv('STREAM_RESUME_GRACE', '60')),
+    cancel_grace=float(os.getenv('STREAM_CANCEL_GRACE', '20'))
+)
 
 @app.route('/models')
 def get_models():
     """
-    Retrieves available AI models from the Venice API
+    Retrieves available AI models from all configured providers
 
     Returns:
         JSON response with available models or error information
     """
     try:
-        response = requests.get(
-            "https://api.venice.ai/api/v1/models",
-            headers={
-                "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                "Content-Type": "application/json"
-            }
-        )
-        response.raise_for_status()
-        models_data = response.json()
-        models = []
-        for model in models_data['data']:
-            # Pass the entire model structure to the client
-            # This includes model_spec with offline status and all capabilities
-            models.append(model)
-        return json.dumps({'models': models})
+        # Pass the entire model structure to the client
+        # This includes model_spec with offline status and all capabilities
+        models = providers.catalog()
+        model_health.update_catalog(models)
+        return json_codec.dumps({'models': models})
     except Exception as e:
         logger.error(f"Error fetching models: {str(e)}")
-        return json.dumps({'error': str(e)}), 500
+        return json_codec.dumps({'error': str(e)}), 500
+
+@app.route('/models/health')
+def get_model_health():
+    """
+    Reports circuit breaker state, failure rate and TTFB per model for this worker
+    """
+    return json_codec.dumps({'models': model_health.snapshot()}), 200, {'Content-Type': 'application/json'}
+
+@app.route('/usage')
+def get_usage():
+    """
+    Aggregates the usage ledger by model, kind of call and hour (or day)
+
+    Accepts:
+        - hours: Window ending now (default 24), or since/until as Unix timestamps
+        - bucket: 'hour' (default) or 'day'
+        - model, call: Optional filters
+
+    Returns:
+        - Per-bucket rows plus totals per model, with an estimated cost where
+          the model catalog has pricing
+    """
+    if usage_ledger is None:
+        return json_codec.dumps({'error': 'Usage ledger is disabled'}), 404, {'Content-Type': 'application/json'}
+    try:
+        until = float(request.args['until']) if 'until' in request.args else time.time()
+        since = float(request.args['since']) if 'since' in request.args else \
+            until - float(request.args.get('hours', '24')) * 3600
+    except ValueError:
+        return json_codec.dumps({'error': 'since, until and hours must be numbers'}), 400, \
+            {'Content-Type': 'application/json'}
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in USAGE_BUCKETS:
+        return json_codec.dumps({'error': f"bucket must be one of {', '.join(USAGE_BUCKETS)}"}), 400, \
+            {'Content-Type': 'application/json'}
+
+    rows = usage_ledger.query(since, until, bucket, model=request.args.get('model'), call=request.args.get('call'))
+
+    totals = {}
+    for row in rows:
+        total = totals.setdefault(row['model'], {'calls': 0, 'errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+        for key in total:
+            total[key] += row[key]
+    for model, total in totals.items():
+        pricing = model_health.catalog.get(model, {}).get('pricing', {})
+        input_price = pricing.get('input', {}).get('usd')
+        output_price = pricing.get('output', {}).get('usd')
+        if input_price is not None and output_price is not None:
+            # Catalog prices are USD per million tokens
+            total['cost_usd'] = round((total['prompt_tokens'] * input_price +
+                                       total['completion_tokens'] * output_price) / 1e6, 4)
+
+    return json_codec.dumps({'since': since, 'until': until, 'bucket': bucket, 'usage': rows, 'models': totals}), \
+        200, {'Content-Type': 'application/json'}
+
+@app.route('/providers')
+def get_providers():
+    """
+    Lists the configured model providers with their id prefixes and capabilities
+    """
+    return json_codec.dumps({'providers': [p.describe() for p in providers.all()]}), 200, \
+        {'Content-Type': 'application/json'}
+
+@app.route('/healthz')
+def healthz():
+    """
+    Health check for load balancers; reports 503 while the worker is draining
+
+    Returns:
+        JSON with the drain state and number of in-flight streams
+    """
+    status = 503 if is_draining() else 200
+    return json_codec.dumps({
+        'status': 'draining' if is_draining() else 'ok',
+        'active_streams': active_requests()
+    }), status, {'Content-Type': 'application/json'}
+
+@app.route('/metrics')
+def get_metrics():
+    """
+    Exposes Prometheus metrics aggregated across worker processes
+    """
+    body, content_type = metrics.render()
+    return Response(body, mimetype=content_type)
+
+DEBUG_ENDPOINTS = os.getenv('DEBUG_ENDPOINTS', '0') == '1'
+
+
+@app.route('/debug/profile')
+def debug_profile():
+    """
+    Samples the stacks of this worker process for a number of seconds
+
+    Only available when DEBUG_ENDPOINTS=1 or the app runs in debug mode.
+
+    Query parameters:
+        seconds: Sampling duration (default 10, max 60)
+        interval_ms: Milliseconds between samples (default 5)
+        idle: Set to 1 to keep threads that are blocked waiting
+
+    Returns:
+        Collapsed stacks ("thread;frame;frame count") for flame graph tools
+    """
+    if not (DEBUG_ENDPOINTS or app.debug):
+        return json_codec.dumps({'error': 'Not found'}), 404, {'Content-Type': 'application/json'}
+    try:
+        seconds = min(float(request.args.get('seconds', 10)), 60.0)
+        interval = max(float(request.args.get('interval_ms', 5)), 1.0) / 1000
+    except ValueError:
+        return json_codec.dumps({'error': 'seconds and interval_ms must be numbers'}), 400, {'Content-Type': 'application/json'}
+
+    logger.info(f"Profiling process {os.getpid()} for {seconds}s")
+    try:
+        counts = profiler.sample(seconds, interval, include_idle=request.args.get('idle') == '1')
+    except profiler.ProfilerBusyError as e:
+        return json_codec.dumps({'error': str(e)}), 409, {'Content-Type': 'application/json'}
+    return Response(profiler.collapsed(counts), mimetype='text/plain',
+                    headers={'X-Profile-Pid': str(os.getpid())})
 
 @app.route('/')
 def index():
@@ -68,131 +269,261 @@ def index():
     return render_template('index.html')
 
 
+def conversation_error(e):
+    """Maps a conversation store error (or None when the store is disabled) to a JSON error response"""
+    if e is None:
+        return json_codec.dumps({'error': 'Conversation store is disabled'}), 404, {'Content-Type': 'application/json'}
+    status = 404 if isinstance(e, ConversationNotFound) else 400
+    return json_codec.dumps({'error': str(e)}), status, {'Content-Type': 'application/json'}
 
-@app.route('/chat/expert', methods=['POST'])
-def chat_expert():
+@app.route('/conversations', methods=['GET', 'POST'])
+def conversations():
     """
-    Handles expert mode chat with multiple model candidates and synthesis
-    
+    Lists stored conversations (GET) or starts a new one (POST)
+
     Accepts:
-        - JSON request with messages, candidate models, synthesis model, and parameters
-        
+        - GET: limit and cursor (next_cursor of the previous page)
+        - POST: JSON with an optional title and optional initial messages
+
     Returns:
-        - JSON response with individual candidates and synthesized final answer
+        - GET: Conversations, most recently updated first, and next_cursor
+        - POST: The new conversation (201)
     """
+    if conversation_store is None:
+        return conversation_error(None)
     try:
-        data = request.json
-        messages = data.get('messages', [])
-        candidate_models = data.get('candidate_models', [])
-        synthesis_model = data.get('synthesis_model', 'mistral-31-24b')
-        show_candidates = data.get('show_candidates', False)
-        temperature = data.get('temperature', 0.7)
-        max_completion_tokens = data.get('max_completion_tokens', 8000)
-        candidate_capabilities = data.get('candidate_capabilities', {})
-        synthesis_capabilities = data.get('synthesis_capabilities', {})
-        
-        logger.info(f"Deep research request: {len(candidate_models)} candidates, synthesis: {synthesis_model}")
-        logger.info(f"Candidate models: {candidate_models}")
-        logger.info(f"Synthesis model from request: {synthesis_model}")
-        
-        if not candidate_models:
-            return json.dumps({'error': 'No candidate models selected for deep research'}), 400
-            
-        # Generate responses from candidate models in parallel
-        candidate_responses = []
-        
-        import concurrent.futures
-        import threading
-        
-        def get_candidate_response(model):
-            """Get response from a single candidate model"""
+        if request.method == 'GET':
+            page = conversation_store.list(request.args.get('limit', 50), request.args.get('cursor'))
+            return json_codec.dumps(page), 200, {'Content-Type': 'application/json'}
+
+        data = request.get_json(silent=True) or {}
+        conversation = conversation_store.create(data.get('title'))
+        if data.get('messages'):
             try:
-                venice_params = {
-                    "include_venice_system_prompt": False
-                }
-                
-                # Enable web search for web-capable models
-                model_caps = candidate_capabilities.get(model, {})
-                if model_caps.get('supportsWebSearch', False):
-                    venice_params["enable_web_search"] = "on"
-                    venice_params["enable_web_citations"] = False
-                
-                payload = {
-                    "model": model,
-                    "messages": messages,
-                    "venice_parameters": venice_params,
-                    "max_completion_tokens": max_completion_tokens,
-                    "temperature": temperature,
-                    "stream": False  # Non-streaming for candidates
-                }
-                
-                response = requests.post(
-                    "https://api.venice.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                        "Content-Type": "application/json"
-                    },
-                    json=payload,
-                    timeout=120
-                )
-                
-                if response.ok:
-                    result = response.json()
-                    if 'choices' in result and result['choices']:
-                        content = result['choices'][0]['message']['content']
-                        return {'model': model, 'content': content, 'success': True}
-                    else:
-                        return {'model': model, 'content': f"No response from {model}", 'success': False}
-                else:
-                    return {'model': model, 'content': f"Error from {model}: {response.status_code}", 'success': False}
-                    
-            except Exception as e:
-                logger.error(f"Error getting response from {model}: {str(e)}")
-                return {'model': model, 'content': f"Error: {str(e)}", 'success': False}
+                conversation_store.append(conversation['id'], data['messages'])
+            except ConversationStoreError:
+                conversation_store.delete(conversation['id'])
+                raise
+            conversation = conversation_store.get(conversation['id'])
+        return json_codec.dumps(conversation), 201, {'Content-Type': 'application/json'}
+    except ConversationStoreError as e:
+        return conversation_error(e)
+
+@app.route('/conversations/<conversation_id>', methods=['GET', 'DELETE'])
+def conversation(conversation_id):
+    """
+    Returns (GET) or deletes (DELETE) one conversation
+    """
+    if conversation_store is None:
+        return conversation_error(None)
+    try:
+        if request.method == 'DELETE':
+            conversation_store.delete(conversation_id)
+            return '', 204
+        return json_codec.dumps(conversation_store.get(conversation_id)), 200, {'Content-Type': 'application/json'}
+    except ConversationStoreError as e:
+        return conversation_error(e)
+
+@app.route('/conversations/<conversation_id>/messages', methods=['GET', 'POST'])
+def conversation_messages(conversation_id):
+    """
+    Pages through (GET) or appends to (POST) a conversation's history
+
+    Accepts:
+        - GET: limit and before (next_cursor of the previous page); without
+          before, the most recent messages are returned
+        - POST: JSON with messages, each with role, content, optional model
+          and optional attachments ([{kind: image|file, ref, name}])
+
+    Returns:
+        - GET: Messages oldest first and next_cursor for the page before them
+          (null when the start of the conversation is reached)
+        - POST: Ids of the stored messages (201)
+    """
+    if conversation_store is None:
+        return conversation_error(None)
+    try:
+        if request.method == 'GET':
+            page = conversation_store.messages(conversation_id, request.args.get('limit', 50),
+                                               request.args.get('before'))
+            return json_codec.dumps(page), 200, {'Content-Type': 'application/json'}
+
+        data = request.get_json(silent=True) or {}
+        ids = conversation_store.append(conversation_id, data.get('messages'))
+        return json_codec.dumps({'ids': ids}), 201, {'Content-Type': 'application/json'}
+    except ConversationStoreError as e:
+        return conversation_error(e)
+
+
+class DeepResearchError(Exception):
+    """Raised when a deep research request has no candidates or all of them failed"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+# Seconds a deep research candidate may spend generating once it started answering
+EXPERT_GENERATION_ALLOWANCE = float(os.getenv('EXPERT_GENERATION_ALLOWANCE', '120'))
+
+
+def candidates_deadline(models):
+    """
+    Returns the seconds deep research waits for its candidates before going on with the answers it has
+
+    Follows the timeout policies: the longest first-byte limit among the
+    candidates' model classes plus EXPERT_GENERATION_ALLOWANCE, so a reasoning
+    candidate is never cut off while still inside its own first-byte limit.
+    """
+    return max(upstream_timeouts.policy(model).first_byte for model in models) + EXPERT_GENERATION_ALLOWANCE
+
+
+def run_deep_research(data, trace, progress=None, cancel=None):
+    """
+    Runs deep research: the candidate models in parallel, then a synthesis of their answers
+
+    Args:
+        data (dict): The /chat/expert request body
+        trace (tracing.RequestTrace): Receives the phase timings
+        progress (callable, optional): Called with a progress event after each
+            candidate and before the synthesis
+        cancel (cancellation.CancelToken, optional): Aborts the upstream calls
+            in flight and abandons the candidates not yet started
+
+    Returns:
+        dict: The /chat/expert response body
+
+    Raises:
+        DeepResearchError: If no candidates were selected or all of them failed
+        Cancelled: If the token was cancelled
+    """
+    progress = progress or (lambda event: None)
+    cancel = cancel or CancelToken()
+    messages = data.get('messages', [])
+    candidate_models = data.get('candidate_models', [])
+    synthesis_model = data.get('synthesis_model', 'mistral-31-24b')
+    show_candidates = data.get('show_candidates', False)
+    temperature = data.get('temperature', 0.7)
+    max_completion_tokens = data.get('max_completion_tokens', 8000)
+    candidate_capabilities = data.get('candidate_capabilities', {})
+    synthesis_capabilities = data.get('synthesis_capabilities', {})
+    
+    logger.info(f"Deep research request: {len(candidate_models)} candidates, synthesis: {synthesis_model}")
+    logger.info(f"Candidate models: {candidate_models}")
+    logger.info(f"Synthesis model from request: {synthesis_model}")
+    
+    if not candidate_models:
+        raise DeepResearchError('No candidate models selected for deep research', 400)
         
-        # Execute candidate requests in parallel with improved error handling
-        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(candidate_models), 5)) as executor:
-            future_to_model = {executor.submit(get_candidate_response, model): model for model in candidate_models}
-            
-            # Process completed futures with individual timeouts
-            for future in concurrent.futures.as_completed(future_to_model, timeout=180):
+    # Generate responses from candidate models in parallel; candidates past the deadline are cancelled on their own
+    candidate_responses = []
+    candidates_cancel = cancel.child()
+    
+    def get_candidate_response(requested_model):
+        """Get response from a single candidate model, from whichever provider serves it"""
+        model, substitution = model_health.route(requested_model, exclude=candidate_models)
+        substituted = {'requested_model': requested_model, 'substitution': substitution} if substitution else {}
+        provider = providers.for_model(model)
+        timer = metrics.UpstreamTimer(model, 'candidate', on_outcome=model_health.record)
+        try:
+            # Enable web search for web-capable models
+            model_caps = candidate_capabilities.get(requested_model, {})
+            options = {
+                'temperature': temperature,
+                'max_completion_tokens': max_completion_tokens,
+                'web_search': model_caps.get('supportsWebSearch', False) and provider.capabilities['web_search'],
+                'citations': False,
+                'cancel': candidates_cancel
+            }
+
+            result = provider.complete(model, messages, options, 'candidate', timer)
+            timer.finish(result['usage'].get('completion_tokens'), result['usage'].get('prompt_tokens'))
+            return {'model': model, 'content': result['content'], 'success': True, **substituted}
+
+        except Cancelled as e:
+            timer.cancelled(e.reason)
+            return {'model': model, 'content': f"Cancelled: {e.reason}", 'success': False, 'cancelled': True}
+        except UpstreamBusyError as e:
+            logger.warning(f"Candidate {model} throttled: {e}")
+            timer.error('throttled')
+            return {'model': model, 'content': f"Error from {model}: {e}", 'success': False}
+        except ProviderError as e:
+            logger.error(f"Error getting response from {model} ({provider.name}): {e.message}")
+            if e.reason == 'empty':
+                timer.finish()
+                return {'model': model, 'content': e.message, 'success': False}
+            timer.error(e.reason)
+            if e.reason == 'timeout':
+                return {'model': model, 'content': e.message, 'success': False, 'timeout': True}
+            return {'model': model, 'content': f"Error from {model}: {e.message}", 'success': False}
+        except Exception as e:
+            logger.error(f"Error getting response from {model}: {str(e)}")
+            return {'model': model, 'content': f"Error: {str(e)}", 'success': False}
+    
+    # Execute candidate requests in parallel with improved error handling
+    trace.mark('prepare')
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(len(candidate_models), 5))
+    future_to_model = {executor.submit(get_candidate_response, model): model for model in candidate_models}
+    deadline = time.monotonic() + candidates_deadline(candidate_models)
+    pending = set(future_to_model)
+    try:
+        # Waits in short steps rather than blocking on as_completed, so a cancel is acted on promptly
+        while pending and not cancel.cancelled and time.monotonic() < deadline:
+            timeout = min(0.5, max(0, deadline - time.monotonic()))
+            done, pending = concurrent.futures.wait(pending, timeout, concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                model = future_to_model[future]
                 try:
-                    result = future.result(timeout=120)  # Individual future timeout
+                    result = future.result()
+                    if result.get('cancelled'):
+                        continue
                     candidate_responses.append(result)
+                    outcome = 'success' if result['success'] else ('timeout' if result.get('timeout') else 'error')
+                    metrics.EXPERT_CANDIDATES.labels(metrics.model_label(result['model']), outcome).inc()
                     logger.info(f"Received response from {result['model']}: success={result['success']}")
-                except concurrent.futures.TimeoutError:
-                    model = future_to_model[future]
-                    logger.warning(f"Timeout for model {model}")
-                    candidate_responses.append({
-                        'model': model, 
-                        'content': f"Timeout error for {model}", 
-                        'success': False
-                    })
                 except Exception as e:
-                    model = future_to_model[future]
+                    metrics.EXPERT_CANDIDATES.labels(metrics.model_label(model), 'error').inc()
                     logger.error(f"Error processing future for {model}: {str(e)}")
                     candidate_responses.append({
-                        'model': model, 
-                        'content': f"Processing error for {model}: {str(e)}", 
+                        'model': model,
+                        'content': f"Processing error for {model}: {str(e)}",
                         'success': False
                     })
-        
-        # Filter successful responses
-        successful_responses = [r for r in candidate_responses if r['success']]
-        
-        if not successful_responses:
-            return json.dumps({'error': 'All research models failed to respond'}), 500
-        
-        # Create synthesis prompt
-        synthesis_messages = messages.copy()
-        
-        # Add candidate responses to synthesis prompt
-        candidates_text = "\n\n".join([
-            f"Response from {resp['model']}:\n{resp['content']}" 
-            for resp in successful_responses
-        ])
-        
-        synthesis_prompt = f"""You are tasked with synthesizing multiple AI responses into a single, comprehensive answer. Below are responses from different AI models to the same query.
+                progress({'phase': 'candidates', 'model': candidate_responses[-1]['model'],
+                          'success': candidate_responses[-1]['success'],
+                          'completed': len(candidate_responses), 'total': len(candidate_models)})
+        cancel.check()
+
+        for future in pending:
+            model = future_to_model[future]
+            metrics.EXPERT_CANDIDATES.labels(metrics.model_label(model), 'timeout').inc()
+            logger.warning(f"Timeout for model {model}")
+            candidate_responses.append({'model': model, 'content': f"Timeout error for {model}", 'success': False})
+    finally:
+        # Candidates still running are aborted and queued ones dropped instead of holding up the answer
+        if pending:
+            candidates_cancel.cancel('deadline' if time.monotonic() >= deadline else 'abandoned')
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    trace.mark('candidates')
+
+    # Filter successful responses
+    successful_responses = [r for r in candidate_responses if r['success']]
+    
+    if not successful_responses:
+        raise DeepResearchError('All research models failed to respond', 500)
+    
+    # Create synthesis prompt
+    synthesis_messages = messages.copy()
+    
+    # Add candidate responses to synthesis prompt
+    candidates_text = "\n\n".join([
+        f"Response from {resp['model']}:\n{resp['content']}" 
+        for resp in successful_responses
+    ])
+    
+    synthesis_prompt = f"""You are tasked with synthesizing multiple AI responses into a single, comprehensive answer. Below are responses from different AI models to the same query.
 
 Please create a synthesized response that:
 1. Combines the best insights from all responses
@@ -205,83 +536,155 @@ Candidate Responses:
 
 Please provide a synthesized response that incorporates the strengths of each candidate while maintaining clarity and coherence."""
 
-        synthesis_messages.append({'role': 'user', 'content': synthesis_prompt})
-        
-        # Get synthesis response with better error handling
-        logger.info(f"Starting synthesis with model: {synthesis_model}")
-        
-        # Build venice parameters for synthesis
-        synthesis_venice_params = {
-            "include_venice_system_prompt": False
-        }
-        
+    synthesis_messages.append({'role': 'user', 'content': synthesis_prompt})
+    
+    # Get synthesis response with better error handling
+    requested_synthesis_model = synthesis_model
+    synthesis_caps = synthesis_capabilities.get(synthesis_model, {})
+    synthesis_model, synthesis_substitution = model_health.route(synthesis_model)
+    logger.info(f"Starting synthesis with model: {synthesis_model}")
+    progress({'phase': 'synthesis', 'model': synthesis_model})
+    
+    synthesis_provider = providers.for_model(synthesis_model)
+    synthesis_options = {
+        'temperature': 0.3,  # Lower temperature for more consistent synthesis
+        'max_completion_tokens': max_completion_tokens,
         # Enable web search for synthesis model if it supports it
-        synthesis_caps = synthesis_capabilities.get(synthesis_model, {})
-        if synthesis_caps.get('supportsWebSearch', False):
-            synthesis_venice_params["enable_web_search"] = "on"
-            synthesis_venice_params["enable_web_citations"] = True
-        
-        synthesis_payload = {
-            "model": synthesis_model,
-            "messages": synthesis_messages,
-            "venice_parameters": synthesis_venice_params,
-            "max_completion_tokens": max_completion_tokens,
-            "temperature": 0.3,  # Lower temperature for more consistent synthesis
-            "stream": False
-        }
-        
-        try:
-            synthesis_response = requests.post(
-                "https://api.venice.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                    "Content-Type": "application/json"
-                },
-                json=synthesis_payload,
-                timeout=180
-            )
-            
-            if synthesis_response.ok:
-                synthesis_result = synthesis_response.json()
-                if 'choices' in synthesis_result and synthesis_result['choices']:
-                    synthesized_content = synthesis_result['choices'][0]['message']['content']
-                    logger.info("Synthesis completed successfully")
-                else:
-                    synthesized_content = "Failed to synthesize responses - no choices in response"
-                    logger.error("Synthesis response missing choices")
-            else:
-                error_text = synthesis_response.text
-                synthesized_content = f"Synthesis failed: {synthesis_response.status_code} - {error_text}"
-                logger.error(f"Synthesis API error: {synthesis_response.status_code} - {error_text}")
-        
-        except requests.exceptions.Timeout:
+        'web_search': synthesis_caps.get('supportsWebSearch', False) and synthesis_provider.capabilities['web_search'],
+        'citations': True,
+        'cancel': cancel
+    }
+    
+    synthesis_timer = metrics.UpstreamTimer(synthesis_model, 'synthesis', on_outcome=model_health.record)
+    try:
+        synthesis_result = synthesis_provider.complete(synthesis_model, synthesis_messages, synthesis_options,
+                                                       'synthesis', synthesis_timer)
+        synthesis_usage = synthesis_result['usage']
+        synthesis_timer.finish(synthesis_usage.get('completion_tokens'), synthesis_usage.get('prompt_tokens'))
+        synthesized_content = synthesis_result['content']
+        logger.info("Synthesis completed successfully")
+    
+    except Cancelled as e:
+        synthesis_timer.cancelled(e.reason)
+        raise
+    except UpstreamBusyError as e:
+        synthesis_timer.error('throttled')
+        synthesized_content = f"Synthesis failed: {e}"
+        logger.warning(f"Synthesis throttled with model: {synthesis_model}")
+    except ProviderError as e:
+        if e.reason == 'empty':
+            synthesis_timer.finish()
+            synthesized_content = "Failed to synthesize responses - no choices in response"
+        elif e.reason == 'timeout':
+            synthesis_timer.error('timeout')
             synthesized_content = f"Synthesis timed out using model {synthesis_model}"
-            logger.error(f"Synthesis timeout with model: {synthesis_model}")
-        except Exception as e:
-            synthesized_content = f"Synthesis error: {str(e)}"
-            logger.error(f"Synthesis exception: {str(e)}")
-        
-        # Prepare response
-        response_data = {
-            'synthesized_response': synthesized_content,
-            'synthesis_model': synthesis_model,
-            'candidate_count': len(successful_responses)
-        }
-        
-        # Include individual candidates if requested
-        if show_candidates:
-            response_data['candidates'] = [
-                {'model': resp['model'], 'content': resp['content']} 
-                for resp in successful_responses
-            ]
-        
-        return json.dumps(response_data), 200
+        else:
+            synthesis_timer.error(e.reason)
+            synthesized_content = f"Synthesis failed: {e.message}"
+        logger.error(f"Synthesis error with model {synthesis_model} ({synthesis_provider.name}): {e.message}")
+    except Exception as e:
+        synthesized_content = f"Synthesis error: {str(e)}"
+        logger.error(f"Synthesis exception: {str(e)}")
+    
+    trace.mark('synthesis')
+
+    # Prepare response
+    response_data = {
+        'synthesized_response': synthesized_content,
+        'synthesis_model': synthesis_model,
+        'candidate_count': len(successful_responses)
+    }
+
+    # Tell the client which requested models were swapped for healthy fallbacks
+    substitutions = {resp['requested_model']: resp['model'] for resp in successful_responses
+                     if resp.get('requested_model')}
+    if synthesis_substitution:
+        substitutions[requested_synthesis_model] = synthesis_model
+    if substitutions:
+        response_data['model_substitutions'] = substitutions
+    
+    # Include individual candidates if requested
+    if show_candidates:
+        response_data['candidates'] = [
+            {'model': resp['model'], 'content': resp['content'],
+             **({'requested_model': resp['requested_model']} if resp.get('requested_model') else {})}
+            for resp in successful_responses
+        ]
+    
+    return response_data
+
+
+@app.route('/chat/expert', methods=['POST'])
+@drainable
+def chat_expert():
+    """
+    Handles expert mode chat with multiple model candidates and synthesis
+    
+    Accepts:
+        - JSON request with messages, candidate models, synthesis model, and parameters
         
+    Returns:
+        - JSON response with individual candidates and synthesized final answer
+
+    Deep research can take minutes; POST /jobs with kind "deep_research" runs
+    it in the background instead of holding this request open.
+    """
+    try:
+        trace = tracing.current_trace()
+        data = request.json
+        trace.mark('parse')
+        return json_codec.dumps(run_deep_research(data, trace)), 200
+
+    except DeepResearchError as e:
+        return json_codec.dumps({'error': e.message}), e.status_code
     except Exception as e:
         logger.exception(f"Deep research error: {str(e)}")
-        return json.dumps({'error': f'Deep research error: {str(e)}'}), 500
+        return json_codec.dumps({'error': f'Deep research error: {str(e)}'}), 500
+
+def relay_events(events, state):
+    """
+    Converts provider StreamEvents into the frames sent to the client
+
+    Args:
+        events (iterable): StreamEvents from a provider
+        state (dict): Receives the 'usage' block if the provider reports one
+
+    Yields:
+        str: SSE frames ("data: ...\\n\\n") for the client
+    """
+    # Checked once per stream rather than per chunk; chunk records are sampled by the log pipeline
+    log_chunks = logger.isEnabledFor(logging.DEBUG)
+    for event in events:
+        if log_chunks:
+            logger.debug("Relaying %s event: %s", event.kind, log_pipeline.Payload(event.value),
+                         extra={'sample': 'relay_event'})
+        if event.kind == StreamEvent.USAGE:
+            state['usage'] = event.value
+            continue
+        yield event.frame()
+        if event.kind == StreamEvent.DONE:
+            break
+
+
+def relay_upstream_lines(lines, state):
+    """
+    Converts upstream Venice SSE lines into the frames sent to the client
+
+    Citations are cleaned and sent as their own compact chunk, content and
+    reasoning deltas are forwarded, and other venice_parameters are passed on.
+
+    Args:
+        lines (iterable): Raw upstream lines (bytes) as from response.iter_lines()
+        state (dict): Receives the upstream 'usage' block if one is sent
+
+    Yields:
+        str: SSE frames ("data: ...\\n\\n") for the client
+    """
+    return relay_events(venice_events(lines), state)
+
 
 @app.route('/chat/stream', methods=['POST'])
+@drainable
 def chat_stream():
     """
     Handles streaming chat completions from the AI model
@@ -292,7 +695,9 @@ def chat_stream():
     Returns:
         - Streaming response with AI-generated content
     """
+    trace = tracing.current_trace()
     data = request.json
+    trace.mark('parse')
     search_enabled = data.get('web_search', False)
     messages = data.get('messages', [])
 
@@ -300,10 +705,15 @@ def chat_stream():
     max_completion_tokens = data.get('max_completion_tokens', data.get('max_tokens', 8000))
     temperature = data.get('temperature', 0.7)
 
+    cancel = CancelToken()
+
     def generate(model, messages, temperature, max_completion_tokens, search_enabled):
         """
         Generator function that streams AI responses
 
+        Closing the generator (the client disconnected) or cancelling the
+        stream's token aborts the upstream request.
+
         Args:
             model (str): The AI model to use
             messages (list): Chat history to send to the model
@@ -314,287 +724,155 @@ def chat_stream():
         Yields:
             Streaming response data from the AI model
         """
+        timer = None
         try:
-            logger.info(f"Generating response for model: {model}")
-            logger.info(f"Web search setting: {search_enabled}")
-            logger.info(f"Max completion tokens: {max_completion_tokens}")
-
-            # Prepare the payload for Venice API with proper parameter names
-            payload = {
-                "model": model,
-                "messages": messages,
-                "venice_parameters": {
-                    "include_venice_system_prompt": False
-                },
-                "max_completion_tokens": max_completion_tokens,  # Using specified parameter name
-                "temperature": temperature,
-                "stream": True
+            requested_model = model
+            model, substitution = model_health.route(model)
+            if substitution:
+                notice = {'requested': requested_model, 'model': model, 'reason': substitution}
+                yield f"data: {json_codec.dumps({'model_substitution': notice})}\n\n"
+
+            provider = providers.for_model(model)
+            logger.info("Generating response for model: %s (%s)", model, provider.name,
+                        extra={'model': model, 'provider': provider.name, 'web_search': search_enabled,
+                               'max_completion_tokens': max_completion_tokens, 'messages': len(messages)})
+
+            options = {
+                'temperature': temperature,
+                'max_completion_tokens': max_completion_tokens,
+                # Only add web search when explicitly enabled and the provider can do it
+                'web_search': search_enabled == "on" and provider.capabilities['web_search'],
+                'citations': True,
+                'cancel': cancel
             }
 
-            # Only add web search parameter when explicitly enabled
-            if search_enabled == "on":
-                payload["venice_parameters"]["enable_web_search"] = "on"
-                payload["venice_parameters"]["enable_web_citations"] = True
-                payload["venice_parameters"]["include_search_results_in_stream"] = True
-
-            # Make request to Venice API
-            logger.debug(f"Sending request to Venice API with payload: {json.dumps(payload)}")
-            response = requests.post(
-                "https://api.venice.ai/api/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                    "Content-Type": "application/json"
-                },
-                json=payload,
-                stream=True
-            )
-
-            if not response.ok:
-                logger.error(f"Venice API error: Status {response.status_code}")
-                logger.error(f"Response content: {response.text}")
-                yield f"data: {json.dumps({'error': f'API error: {response.status_code}'})}\n\n"
-                return
+            if hedger.enabled and provider.capabilities['hedging']:
+                # Connect and first token are raced between attempts, so they are one span here
+                with trace.span('upstream_first_byte'):
+                    attempt = hedger.race(
+                        model, lambda target: provider.open_stream(target, messages, options),
+                        lambda target: metrics.UpstreamTimer(target, 'stream', on_outcome=model_health.record),
+                        cancel)
+                timer = attempt.timer
+                if attempt.error:
+                    raise attempt.error
+                provider.check(attempt.response)
+                events = provider.events(attempt.model, attempt.response, attempt.lines(), cancel)
+                first_span = None
+                if attempt.model != model:
+                    notice = {'requested': model, 'model': attempt.model, 'reason': 'hedged'}
+                    yield f"data: {json_codec.dumps({'model_substitution': notice})}\n\n"
+            else:
+                timer = metrics.UpstreamTimer(model, 'stream', on_outcome=model_health.record)
+                with trace.span('upstream_connect'):
+                    events = provider.stream(model, messages, options)
+                first_span = 'upstream_first_byte'
 
             # Stream the response with improved handling
-            for line in response.iter_lines():
-                if not line:
-                    continue
-
-                line = line.decode('utf-8')
-                if not line.startswith('data: '):
-                    continue
-
-                data = line[6:]
-                if data == '[DONE]':
-                    yield "data: [DONE]\n\n"
-                    break
-
-                try:
-                    json_data = json.loads(data)
-
-                    # Forward venice_parameters at the top level
-                    if 'venice_parameters' in json_data:
-                        # Handle citations separately to ensure proper JSON formatting
-                        if 'web_search_citations' in json_data['venice_parameters']:
-                            citations = json_data['venice_parameters']['web_search_citations']
-
-                            if isinstance(citations, list) and len(citations) > 0:
-                                # Clean and validate each citation before sending
-                                cleaned_citations = []
-                                for citation in citations:
-                                    try:
-                                        # Simplified citation with only title and URL
-                                        cleaned_citation = {
-                                            "title": str(citation.get("title", "")).strip() or "Untitled",
-                                            "url": str(citation.get("url", "")).strip() or "#"
-                                        }
-                                        # Only add if we have at least a title or URL
-                                        if cleaned_citation["title"] != "Untitled" or cleaned_citation["url"] != "#":
-                                            cleaned_citations.append(cleaned_citation)
-                                    except Exception as clean_error:
-                                        logger.warning(f"Error cleaning citation: {clean_error}")
-                                        continue
-
-                                if cleaned_citations:
-                                    # Send citations as a separate, well-formed JSON chunk
-                                    try:
-                                        citations_chunk = {
-                                            "venice_parameters": {
-                                                "web_search_citations": cleaned_citations
-                                            }
-                                        }
-                                        # Use separators to ensure compact, clean JSON
-                                        citations_json = json.dumps(citations_chunk, separators=(',', ':'), ensure_ascii=False)
-                                        yield f"data: {citations_json}\n\n"
-                                    except Exception as citation_error:
-                                        logger.error(f"Error formatting citations: {citation_error}")
-
-                        # Send other venice_parameters without citations to avoid duplication
-                        other_params = {k: v for k, v in json_data['venice_parameters'].items() 
-                                      if k != 'web_search_citations'}
-                        if other_params:
-                            other_chunk = {
-                                "venice_parameters": other_params
-                            }
-                            yield f"data: {json.dumps(other_chunk)}\n\n"
-
-                    # Process content and reasoning_content if present
-                    if 'content' in json_data:
-                        yield f"data: {json.dumps({'content': json_data['content']})}\n\n"
-
-                    # Use standardized field for reasoning content
-                    if 'reasoning_content' in json_data:
-                        logger.debug(f"Found reasoning_content at top level: {json_data['reasoning_content'][:100]}...")
-                        yield f"data: {json.dumps({'reasoning_content': json_data['reasoning_content']})}\n\n"
-
-                    # Process delta content for streaming
-                    if 'choices' in json_data and json_data['choices'] and 'delta' in json_data['choices'][0]:
-                        delta = json_data['choices'][0]['delta']
-
-                        # Stream content
-                        if 'content' in delta and delta['content']:
-                            yield f"data: {json.dumps({'content': delta['content']})}\n\n"
-
-                        # Stream reasoning content
-                        if 'reasoning_content' in delta and delta['reasoning_content']:
-                            yield f"data: {json.dumps({'reasoning_content': delta['reasoning_content']})}\n\n"
-
-                        # Stream venice parameters
-                        if 'venice_parameters' in delta:
-                            # Handle delta citations separately
-                            if 'web_search_citations' in delta['venice_parameters']:
-                                citations = delta['venice_parameters']['web_search_citations']
-
-                                if isinstance(citations, list) and len(citations) > 0:
-                                    # Clean and validate delta citations too
-                                    cleaned_delta_citations = []
-                                    for citation in citations:
-                                        try:
-                                            # Simplified citation with only title and URL
-                                            cleaned_citation = {
-                                                "title": str(citation.get("title", "")).strip() or "Untitled",
-                                                "url": str(citation.get("url", "")).strip() or "#"
-                                            }
-                                            # Only add if we have at least a title or URL
-                                            if cleaned_citation["title"] != "Untitled" or cleaned_citation["url"] != "#":
-                                                cleaned_delta_citations.append(cleaned_citation)
-                                        except Exception as clean_error:
-                                            logger.warning(f"Error cleaning delta citation: {clean_error}")
-                                            continue
-
-                                    if cleaned_delta_citations:
-                                        # Send delta citations as separate chunk
-                                        try:
-                                            delta_citations_chunk = {
-                                                "venice_parameters": {
-                                                    "web_search_citations": cleaned_delta_citations
-                                                }
-                                            }
-                                            delta_citations_json = json.dumps(delta_citations_chunk, separators=(',', ':'), ensure_ascii=False)
-                                            yield f"data: {delta_citations_json}\n\n"
-                                        except Exception as delta_citation_error:
-                                            logger.error(f"Error formatting delta citations: {delta_citation_error}")
-
-                            # Send other delta venice_parameters without citations
-                            other_delta_params = {k: v for k, v in delta['venice_parameters'].items() 
-                                                if k != 'web_search_citations'}
-                            if other_delta_params:
-                                other_delta_chunk = json_data.copy()
-                                other_delta_chunk['choices'][0]['delta']['venice_parameters'] = other_delta_params
-                                yield f"data: {json.dumps(other_delta_chunk)}\n\n"
-
-                except json.JSONDecodeError as e:
-                    logger.warning(f"JSON decode error: {str(e)}, data: {data[:100]}...")
-                    continue
-
+            state = {}
+            yield from relay_events(timer.watch(trace.timed_iter(events, 'upstream_read', first_span)), state)
+
+            usage = state.get('usage', {})
+            timer.finish(usage.get('completion_tokens'), usage.get('prompt_tokens'))
+
+        except GeneratorExit:
+            # The client went away mid-stream; abort the upstream rather than let it finish unread
+            if cancel.cancel('client_gone') and timer is not None:
+                timer.cancelled('client_gone')
+            raise
+        except Cancelled as e:
+            logger.info(f"Stream for {model} cancelled: {e.reason}")
+            if timer is not None:
+                timer.cancelled(e.reason)
+        except UpstreamBusyError as e:
+            logger.warning(f"Stream throttled: {e}")
+            timer.error('throttled')
+            yield f"data: {json_codec.dumps({'error': str(e)})}\n\n"
+        except ProviderError as e:
+            logger.error(f"Upstream error for {model}: {e.message}")
+            timer.error(e.reason)
+            yield f"data: {json_codec.dumps({'error': e.message})}\n\n"
+        except requests.exceptions.RequestException as e:
+            logger.error(f"Upstream request failed for {model}: {str(e)}")
+            timer.error('timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection')
+            yield f"data: {json_codec.dumps({'error': str(e)})}\n\n"
         except Exception as e:
             logger.exception(f"Error in generate: {str(e)}")
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield f"data: {json_codec.dumps({'error': str(e)})}\n\n"
+
+    frames = tracing.traced_stream(trace, generate(
+        model=data.get('model', 'mistral-31-24b'),
+        messages=data.get('messages', []),
+        temperature=temperature,
+        max_completion_tokens=max_completion_tokens,
+        search_enabled=search_enabled
+    ))
+    headers = {}
+    if STREAM_RESUME:
+        stream = stream_registry.open(frames, cancel)
+        frames = stream.sse()
+        headers['X-Stream-Id'] = stream.id
 
     return Response(
-        generate(
-            model=data.get('model', 'mistral-31-24b'),
-            messages=data.get('messages', []),
-            temperature=temperature,
-            max_completion_tokens=max_completion_tokens,
-            search_enabled=search_enabled
-        ), 
-        mimetype='text/event-stream'
+        metrics.track_stream(frames, '/chat/stream'),
+        mimetype='text/event-stream',
+        headers=headers
     )
 
-def extract_text_from_file(file_data, file_type):
+@app.route('/chat/stream/<stream_id>')
+@drainable
+def resume_chat_stream(stream_id):
     """
-    Extracts text content from various file formats
-
-    Supports txt, pdf, doc/docx, and xls/xlsx files
+    Reattaches a client to a chat stream after its connection dropped
 
-    Args:
-        file_data (bytes): Binary file data
-        file_type (str): File extension indicating the type
+    Accepts:
+        - Last-Event-ID header (or last_event_id query parameter) with the
+          last "<stream id>:<seq>" the client received
 
     Returns:
-        str: Extracted text content or None if extraction fails
+        - The missed frames followed by the rest of the live stream, or 404
+          if the stream has expired and 410 if the missed frames are gone
     """
+    event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or f"{stream_id}:0"
     try:
-        logger.info(f"Extracting text from {file_type} file")
-        text = ""
-        if file_type == 'txt':
-            text = file_data.decode('utf-8')
-            logger.debug("Text file decoded successfully")
-        elif file_type == 'pdf':
-            try:
-                # Try using PyMuPDF first
-                import fitz  # PyMuPDF
-                pdf_file = io.BytesIO(file_data)
-                pdf_document = fitz.open(stream=pdf_file, filetype="pdf")
+        stream, last_seq = stream_registry.resume(event_id)
+        if stream.id != stream_id:
+            raise ResumeError('Last-Event-ID does not belong to this stream', 400)
+    except ResumeError as e:
+        metrics.STREAM_RESUMES.labels(str(e.status_code)).inc()
+        logger.info(f"Stream resume refused ({e.status_code}): {e.message}")
+        return json_codec.dumps({'error': e.message}), e.status_code, {'Content-Type': 'application/json'}
+
+    metrics.STREAM_RESUMES.labels('resumed').inc()
+    logger.info(f"Resuming stream {stream_id} after frame {last_seq}")
+    return Response(
+        metrics.track_stream(stream.sse(last_seq), '/chat/stream/<stream_id>'),
+        mimetype='text/event-stream',
+        headers={'X-Stream-Id': stream.id}
+    )
 
-                logger.debug(f"PDF file loaded, pages: {len(pdf_document)}")
+@app.route('/chat/stream/<stream_id>', methods=['DELETE'])
+def stop_chat_stream(stream_id):
+    """
+    Stops a chat stream: the upstream request is aborted and no more tokens are generated
 
-                # Process each page
-                for page_num in range(len(pdf_document)):
-                    page = pdf_document[page_num]
+    Returns:
+        - {"cancelled": bool}, false if the stream had already finished, or
+          404 if it is unknown or expired
+    """
+    try:
+        cancelled = stream_registry.cancel(stream_id, 'stopped')
+    except ResumeError as e:
+        return json_codec.dumps({'error': e.message}), e.status_code, {'Content-Type': 'application/json'}
+    return json_codec.dumps({'cancelled': cancelled}), 200, {'Content-Type': 'application/json'}
 
-                    # Extract text with better formatting preservation
-                    page_text = page.get_text("text")
+FILE_MAX_BYTES = 2 * 1024 * 1024
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv('BATCH_UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+BATCH_UPLOAD_MAX_FILES = int(os.getenv('BATCH_UPLOAD_MAX_FILES', '100'))
+
+# Batch uploads are extracted on worker processes; /process_file still extracts in the request thread
+extraction_pool = ExtractionPool.from_env()
 
-                    # Safer table extraction
-                    try:
-                        tables = page.find_tables()
-                        if tables and hasattr(tables, 'tables') and tables.tables:
-                            for table in tables.tables:
-                                rows = []
-                                for cells in table.rows:
-                                    row_text = " | ".join([page.get_text("text", clip=cell.rect) for cell in cells])
-                                    rows.append(row_text)
-                                table_text = "\n".join(rows)
-                                page_text += f"\n\n--- Table ---\n{table_text}\n--- End Table ---\n"
-                    except Exception as table_err:
-                        logger.warning(f"Table extraction error: {str(table_err)}")
-
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-
-                pdf_document.close()
-            except Exception as fitz_err:
-                # Fallback to PyPDF2 if PyMuPDF fails
-                logger.warning(f"PyMuPDF failed: {str(fitz_err)}, falling back to PyPDF2")
-                pdf_file = io.BytesIO(file_data)
-                pdf_reader = PyPDF2.PdfReader(pdf_file)
-
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    page_text = page.extract_text() or "No text extracted"
-                    text += f"\n--- Page {page_num + 1} ---\n{page_text}"
-        elif file_type in ['doc', 'docx']:
-            doc_file = io.BytesIO(file_data)
-            doc = docx.Document(doc_file)
-            logger.debug(f"DOC file loaded, paragraphs: {len(doc.paragraphs)}")
-            text = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-        elif file_type in ['xls', 'xlsx']:
-            import pandas as pd
-            excel_file = io.BytesIO(file_data)
-            # Read all sheets
-            excel_data = pd.read_excel(excel_file, sheet_name=None)
-
-            # Process each sheet
-            tables = []
-            for sheet_name, df in excel_data.items():
-                # Convert DataFrame to string representation with proper formatting
-                table_text = f"\n--- Sheet: {sheet_name} ---\n"
-                table_text += df.to_string(index=False)
-                tables.append(table_text)
-
-            text = "\n\n".join(tables)
-            logger.debug(f"Excel file processed, found {len(excel_data)} sheets")
-
-        if not text:
-            logger.warning("Warning: Extracted text is empty")
-            return None
-
-        logger.info(f"Successfully extracted {len(text)} characters")
-        return text.strip()
-    except Exception as e:
-        logger.exception(f"Error extracting text: {str(e)}")
-        return None
 
 @app.route('/process_file', methods=['POST'])
 def process_file():
@@ -612,14 +890,14 @@ def process_file():
 
         if 'file' not in request.files:
             logger.warning("No file in request.files")
-            return json.dumps({'error': 'No file part'}), 400, {'Content-Type': 'application/json'}
+            return json_codec.dumps({'error': 'No file part'}), 400, {'Content-Type': 'application/json'}
 
         file = request.files['file']
         logger.info(f"Received file: {file.filename}")
 
         if file.filename == '':
             logger.warning("Empty filename received")
-            return json.dumps({'error': 'No file selected'}), 400, {'Content-Type': 'application/json'}
+            return json_codec.dumps({'error': 'No file selected'}), 400, {'Content-Type': 'application/json'}
 
         # Set CORS headers
         headers = {
@@ -630,23 +908,219 @@ def process_file():
         }
 
         # Check file size (2MB limit)
+        trace = tracing.current_trace()
         file_data = file.read()
+        trace.mark('parse')
         logger.debug(f"File size: {len(file_data)} bytes")
-        if len(file_data) > 2 * 1024 * 1024:  # 2MB in bytes
-            return json.dumps({'error': 'File too large. Maximum size is 2MB'}), 400, {'Content-Type': 'application/json'}
+        if len(file_data) > FILE_MAX_BYTES:
+            return json_codec.dumps({'error': 'File too large. Maximum size is 2MB'}), 400, {'Content-Type': 'application/json'}
 
         file_type = file.filename.split('.')[-1].lower()
-        if file_type not in ['txt', 'pdf', 'doc', 'docx', 'xls', 'xlsx']:
-            return json.dumps({'error': f'Unsupported file type: {file_type}'}, ensure_ascii=False), 400, {'Content-Type': 'application/json'}
+        if file_type not in SUPPORTED_TYPES:
+            return json_codec.dumps({'error': f'Unsupported file type: {file_type}'}), 400, {'Content-Type': 'application/json'}
 
-        extracted_text = extract_text_from_file(file_data, file_type)
+        with trace.span('extract'):
+            extracted_text = extract_text_from_file(file_data, file_type)
         if extracted_text is None:
-            return json.dumps({'error': 'Failed to extract text from file'}, ensure_ascii=False), 400
+            return json_codec.dumps({'error': 'Failed to extract text from file'}), 400
+
+        # Kept by file hash so large documents can be digested and their pages fetched later
+        document = document_store.put(file_data, file.filename, extracted_text)
+        document['digest_recommended'] = document['characters'] > DIGEST_THRESHOLD_CHARS
 
-        return json.dumps({'text': extracted_text}, ensure_ascii=False), 200, headers
+        return json_codec.dumps({'text': extracted_text, 'document': document}), 200, headers
     except Exception as e:
         logger.exception(f"File processing error: {str(e)}")
-        return json.dumps({'error': f'File processing error: {str(e)}'}, ensure_ascii=False), 500, headers
+        return json_codec.dumps({'error': f'File processing error: {str(e)}'}), 500, headers
+
+class BatchUploadError(Exception):
+    """Raised when a batch upload is empty, malformed or over its size budget"""
+
+
+def expand_batch_upload(uploads):
+    """
+    Expands uploaded files and ZIP archives into the files to extract
+
+    Archive members are read one by one, checking their declared and actual
+    sizes, so an archive never inflates past the budget in memory.
+
+    Args:
+        uploads (list): werkzeug FileStorage objects
+
+    Returns:
+        list: (name, file_data or None, reason) tuples; file_data is None for
+            files that are skipped, with the reason
+
+    Raises:
+        BatchUploadError: If there are no files, too many, an archive is
+            unreadable or the files exceed BATCH_UPLOAD_MAX_BYTES together
+    """
+    files = []
+    total = 0
+
+    def add(name, size, read):
+        nonlocal total
+        file_type = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+        if file_type not in SUPPORTED_TYPES:
+            files.append((name, None, f'Unsupported file type: {file_type or "none"}'))
+            return
+        if size > FILE_MAX_BYTES:
+            files.append((name, None, 'File too large. Maximum size is 2MB'))
+            return
+        if total + size > BATCH_UPLOAD_MAX_BYTES:
+            raise BatchUploadError(f'Upload too large. Maximum total size is {BATCH_UPLOAD_MAX_BYTES // (1024 * 1024)}MB')
+        # Declared archive member sizes are checked above, actual sizes here
+        file_data = read()
+        if len(file_data) > FILE_MAX_BYTES:
+            files.append((name, None, 'File too large. Maximum size is 2MB'))
+            return
+        if total + len(file_data) > BATCH_UPLOAD_MAX_BYTES:
+            raise BatchUploadError(f'Upload too large. Maximum total size is {BATCH_UPLOAD_MAX_BYTES // (1024 * 1024)}MB')
+        total += len(file_data)
+        files.append((name, file_data, None))
+
+    for upload in uploads:
+        if not upload.filename:
+            continue
+        if upload.filename.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(upload.stream) as archive:
+                    for info in archive.infolist():
+                        base = os.path.basename(info.filename)
+                        if info.is_dir() or not base or base.startswith('.') or info.filename.startswith('__MACOSX/'):
+                            continue
+                        add(f"{upload.filename}/{info.filename}", info.file_size,
+                            lambda info=info: archive.open(info).read(FILE_MAX_BYTES + 1))
+            except (zipfile.BadZipFile, zipfile.LargeZipFile, NotImplementedError, RuntimeError) as e:
+                raise BatchUploadError(f'Could not read archive {upload.filename}: {str(e)}')
+        else:
+            file_data = upload.read(FILE_MAX_BYTES + 1)
+            add(upload.filename, len(file_data), lambda file_data=file_data: file_data)
+        if len(files) > BATCH_UPLOAD_MAX_FILES:
+            raise BatchUploadError(f'Too many files. Maximum is {BATCH_UPLOAD_MAX_FILES} per upload')
+
+    if not files:
+        raise BatchUploadError('No files selected')
+    return files
+
+
+@app.route('/process_files', methods=['POST'])
+@drainable
+def process_files():
+    """
+    Extracts the text of many files, or of the documents in ZIP archives, at once
+
+    Accepts:
+        - multipart form data with one or more 'files' fields (txt, pdf,
+          doc/docx, xls/xlsx or zip)
+
+    Returns:
+        - Server-sent events: one {"file": {...}} per file as soon as it is
+          done, with 'status' extracted, cached (the same file was processed
+          before), duplicate (the same file appears earlier in this upload),
+          skipped or failed, and the text and document metadata of extracted
+          and cached files; then {"summary": {...}} and [DONE]
+    """
+    try:
+        files = expand_batch_upload(request.files.getlist('files'))
+    except BatchUploadError as e:
+        return json_codec.dumps({'error': str(e)}), 400, {'Content-Type': 'application/json'}
+    logger.info(f"Batch upload: {len(files)} files")
+
+    def document_result(document_id, text):
+        document = document_store.meta(document_id)
+        document['digest_recommended'] = document['characters'] > DIGEST_THRESHOLD_CHARS
+        return {'text': text, 'document': document}
+
+    def generate():
+        counts = {'extracted': 0, 'cached': 0, 'duplicate': 0, 'skipped': 0, 'failed': 0}
+
+        def event(index, status, **fields):
+            counts[status] += 1
+            return json_codec.sse({'file': {'index': index, 'name': files[index][0], 'status': status, **fields}})
+
+        # Files already seen, in this upload or before, are answered without extracting them again
+        seen = {}
+        pending = []
+        for index, (name, file_data, reason) in enumerate(files):
+            if file_data is None:
+                yield event(index, 'skipped', error=reason)
+                continue
+            document_id = document_store.document_id(file_data)
+            if document_id in seen:
+                yield event(index, 'duplicate', duplicate_of=files[seen[document_id]][0])
+                continue
+            seen[document_id] = index
+            try:
+                yield event(index, 'cached', **document_result(document_id, document_store.text(document_id)))
+            except DocumentError:
+                pending.append((index, file_data, name.rsplit('.', 1)[-1].lower()))
+
+        for index, text in extraction_pool.extract_many(pending):
+            name, file_data, _ = files[index]
+            if text is None:
+                yield event(index, 'failed', error='Failed to extract text from file')
+                continue
+            document = document_store.put(file_data, os.path.basename(name), text)
+            yield event(index, 'extracted', **document_result(document['id'], text))
+
+        yield json_codec.sse({'summary': {'files': len(files), **counts}})
+        yield "data: [DONE]\n\n"
+
+    return Response(metrics.track_stream(generate(), '/process_files'), mimetype='text/event-stream')
+
+
+IMAGE_UPLOAD_MAX_BYTES = int(os.getenv('IMAGE_UPLOAD_MAX_BYTES', str(20 * 1024 * 1024)))
+
+
+@app.route('/image/upload', methods=['POST'])
+def upload_image():
+    """
+    Normalizes and stores an image attachment for vision messages
+
+    Images are stored once per content hash. Messages refer to the result with
+    an image_url part whose url is "image-store://<id>"; the server inlines the
+    image only when it sends the request upstream.
+
+    Returns:
+        JSON with the image id, reference url, display url and metadata
+    """
+    try:
+        if 'file' not in request.files:
+            return json_codec.dumps({'error': 'No file part'}), 400, {'Content-Type': 'application/json'}
+
+        raw_bytes = request.files['file'].read()
+        if not raw_bytes:
+            return json_codec.dumps({'error': 'Empty image'}), 400, {'Content-Type': 'application/json'}
+        if len(raw_bytes) > IMAGE_UPLOAD_MAX_BYTES:
+            max_mb = IMAGE_UPLOAD_MAX_BYTES // (1024 * 1024)
+            return json_codec.dumps({'error': f'Image too large. Maximum size is {max_mb}MB'}), 400, {'Content-Type': 'application/json'}
+
+        meta = image_store.ingest(raw_bytes)
+        return json_codec.dumps({
+            **meta,
+            'ref': f"{IMAGE_REF_SCHEME}{meta['id']}",
+            'url': f"/image/stored/{meta['id']}"
+        }), 200, {'Content-Type': 'application/json'}
+    except ImageStoreError as e:
+        logger.warning(f"Image upload rejected: {str(e)}")
+        return json_codec.dumps({'error': str(e)}), 400, {'Content-Type': 'application/json'}
+    except Exception as e:
+        logger.exception(f"Image upload error: {str(e)}")
+        return json_codec.dumps({'error': f'Image upload error: {str(e)}'}), 500, {'Content-Type': 'application/json'}
+
+
+@app.route('/image/stored/<image_id>')
+def get_stored_image(image_id):
+    """
+    Serves a normalized image from the local image store
+    """
+    try:
+        meta, data_path = image_store.get(image_id)
+    except ImageStoreError as e:
+        return json_codec.dumps({'error': str(e)}), 404, {'Content-Type': 'application/json'}
+    return send_file(data_path, mimetype=meta['mime_type'], max_age=31536000)
+
 
 @app.route('/generate_visualization', methods=['POST'])
 def generate_visualization():
@@ -665,20 +1139,22 @@ def generate_visualization():
         # Make sure we have a valid JSON request
         if not request.is_json:
             logger.error("Invalid request: Not JSON")
-            return json.dumps({'error': 'Invalid request format. Expected JSON.'}), 400
+            return json_codec.dumps({'error': 'Invalid request format. Expected JSON.'}), 400
 
+        trace = tracing.current_trace()
         data = request.json
+        trace.mark('parse')
         logger.info(f"Visualization request received: {data.keys()}")
 
         visualization_type = data.get('visualization_type')
         if not visualization_type:
             logger.error("Missing visualization_type in request")
-            return json.dumps({'error': 'Missing visualization_type parameter'}), 400
+            return json_codec.dumps({'error': 'Missing visualization_type parameter'}), 400
 
         # Validate visualization type is one of the supported types
         if visualization_type not in ['chart', 'diagram', 'drawing']:
             logger.error(f"Unsupported visualization type: {visualization_type}")
-            return json.dumps({'error': f'Unsupported visualization type: {visualization_type}'}), 400
+            return json_codec.dumps({'error': f'Unsupported visualization type: {visualization_type}'}), 400
 
         # Simplified handling of visualization data
         viz_data = data.get('data', {})
@@ -808,16 +1284,11 @@ def generate_visualization():
 
         # Log the final data being used
         logger.info(f"Using data for visualization: {str(viz_data)[:200]}")
+        trace.mark('validate')
 
         if visualization_type == 'chart':
             # Generate chart using matplotlib
             try:
-                import matplotlib.pyplot as plt
-                import matplotlib
-                matplotlib.use('Agg')
-                import io
-                import base64
-
                 chart_type = viz_data.get('chart_type', 'bar')
                 title = viz_data.get('title', 'Chart')
                 labels = viz_data.get('labels', [])
@@ -867,7 +1338,6 @@ def generate_visualization():
             except Exception as chart_error:
                 logger.exception(f"Error generating chart: {chart_error}")
                 # Return a simple error chart
-                import numpy as np
                 plt.figure(figsize=(10, 6))
                 plt.text(0.5, 0.5, f"Error generating chart: {str(chart_error)}", 
                         horizontalalignment='center', verticalalignment='center',
@@ -879,7 +1349,8 @@ def generate_visualization():
                 img_str = base64.b64encode(buf.read()).decode('utf-8')
                 plt.close()
 
-            return json.dumps({
+            trace.mark('render')
+            return json_codec.dumps({
                 'image': f'data:image/png;base64,{img_str}',
                 'type': 'chart'
             })
@@ -889,12 +1360,12 @@ def generate_visualization():
             try:
                 # First make sure svgwrite is installed
                 try:
-                    import svgwrite
+                    svgwrite.load()
                 except ImportError:
                     logger.error("svgwrite module not found, installing...")
                     import subprocess
                     subprocess.check_call(["pip", "install", "svgwrite"])
-                    import svgwrite
+                    svgwrite.load()
 
                 diagram_type = viz_data.get('diagram_type', 'flowchart')
                 elements = viz_data.get('elements', [])
@@ -907,7 +1378,7 @@ def generate_visualization():
                 dwg.add(dwg.rect((0, 0), ('100%', '100%'), fill='#ffffff'))
             except Exception as diagram_setup_error:
                 logger.exception(f"Error setting up diagram: {diagram_setup_error}")
-                return json.dumps({'error': f'Error setting up diagram: {str(diagram_setup_error)}'}), 500
+                return json_codec.dumps({'error': f'Error setting up diagram: {str(diagram_setup_error)}'}), 500
 
             # Default elements for a simple flowchart if none provided
             if not elements and diagram_type == 'flowchart':
@@ -996,16 +1467,14 @@ def generate_visualization():
                                 text_anchor="middle", font_size=16))
 
             svg_string = dwg.tostring()
-            return json.dumps({
+            trace.mark('render')
+            return json_codec.dumps({
                 'svg': svg_string,
                 'type': 'diagram'
             })
 
         elif visualization_type == 'drawing':
             # Generate a simple drawing based on text description
-            from PIL import Image, ImageDraw, ImageFont
-            import io
-            import base64
 
             description = viz_data.get('description', '')
             logger.info(f"Drawing description: {description}")
@@ -1082,21 +1551,17 @@ def generate_visualization():
             buf.seek(0)
             img_str = base64.b64encode(buf.read()).decode('utf-8')
 
-            return json.dumps({
+            trace.mark('render')
+            return json_codec.dumps({
                 'image': f'data:image/png;base64,{img_str}',
                 'type': 'drawing'
             })
 
         else:
-            return json.dumps({'error': 'Unsupported visualization type'}), 400
+            return json_codec.dumps({'error': 'Unsupported visualization type'}), 400
 
     except Exception as e:
         logger.exception(f"Visualization generation error: {str(e)}")
-        import matplotlib.pyplot as plt
-        import matplotlib
-        matplotlib.use('Agg')
-        import io
-        import base64
 
         # Create a cleaner error visualization
         plt.figure(figsize=(8, 4), facecolor='white')
@@ -1129,7 +1594,7 @@ def generate_visualization():
         plt.close()
 
         # Return the error image with a cleaner response
-        return json.dumps({
+        return json_codec.dumps({
             'image': f'data:image/png;base64,{img_str}',
             'type': 'error',
             'error': str(e)
@@ -1166,37 +1631,41 @@ KNOWN_IMAGE_MODELS = [
 ]
 
 
+# Default steps per image model from /models?type=image, refreshed every IMAGE_CATALOG_TTL seconds
+IMAGE_CATALOG_TTL = float(os.getenv('IMAGE_CATALOG_TTL', '300'))
+_image_default_steps = {}
+_image_default_steps_updated = None
+_image_default_steps_lock = threading.Lock()
+
+
 def get_model_default_steps(model_id):
     """
-    Fetches the default steps value for an image model from the Venice API.
-    Returns the default steps from the model's constraints, or 20 as fallback.
+    Returns the default steps value for an image model, or 20 as fallback.
+
+    The image model list is fetched once per IMAGE_CATALOG_TTL and shared by
+    all requests, so a batch of jobs does not send one catalog request each.
     """
-    try:
-        response = requests.get(
-            "https://api.venice.ai/api/v1/models?type=image",
-            headers={
-                "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            timeout=10
-        )
-        response.raise_for_status()
-        models_data = response.json()
-        
-        for model in models_data.get('data', []):
-            if model.get('id') == model_id:
-                model_spec = model.get('model_spec', {})
-                constraints = model_spec.get('constraints', {})
-                steps_config = constraints.get('steps', {})
-                default_steps = steps_config.get('default', 20)
-                logger.info(f"Model {model_id}: using default steps={default_steps} from API")
-                return default_steps
-        
+    global _image_default_steps, _image_default_steps_updated
+    with _image_default_steps_lock:
+        if _image_default_steps_updated is None or time.monotonic() - _image_default_steps_updated > IMAGE_CATALOG_TTL:
+            try:
+                response = venice.get('/models?type=image', timeout=10)
+                response.raise_for_status()
+                _image_default_steps = {
+                    model.get('id'): model.get('model_spec', {}).get('constraints', {}).get('steps', {}).get('default', 20)
+                    for model in response.json().get('data', [])
+                }
+            except Exception as e:
+                # Kept until the next refresh, so a failing catalog is not asked again for every image
+                logger.warning(f"Failed to fetch image model steps: {e}, using fallback steps=20")
+            _image_default_steps_updated = time.monotonic()
+        default_steps = _image_default_steps.get(model_id)
+
+    if default_steps is None:
         logger.warning(f"Model {model_id} not found in API, using fallback steps=20")
         return 20
-    except Exception as e:
-        logger.warning(f"Failed to fetch model steps for {model_id}: {e}, using fallback steps=20")
-        return 20
+    logger.debug("Model %s: using default steps=%s from API", model_id, default_steps)
+    return default_steps
 
 
 @app.route('/image/models')
@@ -1206,13 +1675,7 @@ def get_image_models():
     Uses ?type=image query parameter for direct filtering
     """
     try:
-        response = requests.get(
-            "https://api.venice.ai/api/v1/models?type=image",
-            headers={
-                "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                "Content-Type": "application/json"
-            }
-        )
+        response = venice.get('/models?type=image')
         response.raise_for_status()
         models_data = response.json()
         
@@ -1229,10 +1692,10 @@ def get_image_models():
         if not image_models:
             image_models = KNOWN_IMAGE_MODELS
         
-        return json.dumps({'models': image_models})
+        return json_codec.dumps({'models': image_models})
     except Exception as e:
         logger.error(f"Error fetching image models: {str(e)}")
-        return json.dumps({'models': KNOWN_IMAGE_MODELS})
+        return json_codec.dumps({'models': KNOWN_IMAGE_MODELS})
 
 
 @app.route('/image/styles')
@@ -1241,23 +1704,196 @@ def get_image_styles():
     Retrieves available image styles from the Venice API
     """
     try:
-        response = requests.get(
-            "https://api.venice.ai/api/v1/image/styles",
-            headers={
-                "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                "Content-Type": "application/json"
-            }
-        )
+        response = venice.get('/image/styles')
         response.raise_for_status()
         styles_data = response.json()
         
-        return json.dumps({
+        return json_codec.dumps({
             'styles': styles_data.get('data', []),
             'formats': ['webp', 'png', 'jpeg']
         })
     except Exception as e:
         logger.error(f"Error fetching image styles: {str(e)}")
-        return json.dumps({'error': str(e)}), 500
+        return json_codec.dumps({'error': str(e)}), 500
+
+
+IMAGE_MODEL_CONCURRENCY = int(os.getenv('IMAGE_MODEL_CONCURRENCY', '2'))
+IMAGE_BATCH_MAX_JOBS = int(os.getenv('IMAGE_BATCH_MAX_JOBS', '16'))
+
+_image_model_semaphores = {}
+_image_model_semaphores_lock = threading.Lock()
+
+
+def get_image_model_semaphore(model):
+    """
+    Returns the shared semaphore that caps concurrent generations per image model.
+    """
+    with _image_model_semaphores_lock:
+        semaphore = _image_model_semaphores.get(model)
+        if semaphore is None:
+            semaphore = threading.BoundedSemaphore(IMAGE_MODEL_CONCURRENCY)
+            _image_model_semaphores[model] = semaphore
+        return semaphore
+
+
+class ImageGenerationError(Exception):
+    """Raised when the Venice API fails to return an image for a request"""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def build_image_payload(data):
+    """
+    Builds the Venice image generation payload from a client request
+
+    Args:
+        data (dict): Client request with prompt, model and optional image settings
+
+    Returns:
+        tuple: (payload dict, image format)
+    """
+    prompt = data.get('prompt', '').strip()
+    model = data.get('model', 'fluently-xl')
+    style_preset = data.get('style_preset')
+    image_format = data.get('format', 'webp')
+    negative_prompt = data.get('negative_prompt', '')
+    safe_mode = data.get('safe_mode', False)
+    hide_watermark = data.get('hide_watermark', True)
+
+    # nano-banana-pro uses different parameters (aspect_ratio + resolution instead of width/height)
+    if model == 'nano-banana-pro':
+        aspect_ratio = data.get('aspect_ratio', '1:1')
+        resolution = data.get('resolution', '1K')
+
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "aspect_ratio": aspect_ratio,
+            "resolution": resolution,
+            "return_binary": False
+        }
+    else:
+        width = data.get('width', 1024)
+        height = data.get('height', 1024)
+
+        steps = data.get('steps') or get_model_default_steps(model)
+
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "format": image_format,
+            "width": width,
+            "height": height,
+            "steps": steps,
+            "safe_mode": safe_mode,
+            "hide_watermark": hide_watermark,
+            "return_binary": False
+        }
+
+    if style_preset:
+        payload["style_preset"] = style_preset
+
+    if negative_prompt:
+        payload["negative_prompt"] = negative_prompt
+
+    if data.get('seed') is not None:
+        payload["seed"] = data['seed']
+
+    enable_web_search = data.get('enable_web_search')
+    if enable_web_search is not None:
+        payload["enable_web_search"] = enable_web_search
+        logger.info(f"Image generation with web search: {enable_web_search}")
+
+    return payload, image_format
+
+
+def request_image_generation(payload, image_format, cancel=None):
+    """
+    Sends an image generation payload to the Venice API
+
+    Holds the per-model semaphore for the duration of the upstream call.
+
+    Args:
+        payload (dict): Venice image generation payload
+        image_format (str): Requested output format (webp, png, jpeg)
+        cancel (cancellation.CancelToken, optional): Checked while waiting
+            for the semaphore and once it is acquired, so a cancelled request
+            stops queueing and does not start generating
+
+    Returns:
+        dict: Generated images as data URIs plus the upstream id and timing
+
+    Raises:
+        ImageGenerationError: If the API returns an error or no images
+        Cancelled: If the token was cancelled before the request was sent
+    """
+    def check_cancelled():
+        if cancel is not None and cancel.cancelled:
+            metrics.UPSTREAM_CANCELLED.labels(metrics.model_label(payload['model']), 'image', cancel.reason).inc()
+            raise Cancelled(cancel.reason)
+
+    semaphore = get_image_model_semaphore(payload['model'])
+    # Waits in short steps rather than blocking, so a cancel is acted on while the request queues
+    while not semaphore.acquire(timeout=0.5):
+        check_cancelled()
+    try:
+        check_cancelled()
+        start = time.perf_counter()
+
+        def record(outcome, reason=None):
+            duration = time.perf_counter() - start
+            metrics.IMAGE_GENERATION.labels(metrics.model_label(payload['model']), outcome).observe(duration)
+            if usage_ledger is not None:
+                usage_ledger.record(payload['model'], 'image', outcome == 'success', reason=reason, duration=duration)
+
+        try:
+            response = venice.post(payload['model'], 'image', '/image/generate', json=payload,
+                                   timeout=upstream_timeouts.policy(payload['model'], 'image').requests_timeout)
+        except requests.exceptions.Timeout:
+            record('timeout', 'timeout')
+            raise
+        except UpstreamBusyError as e:
+            record('throttled', 'throttled')
+            raise ImageGenerationError(str(e), 429)
+        except requests.exceptions.RequestException:
+            record('error', 'connection')
+            raise
+        if response.ok:
+            record('success')
+        else:
+            record('error', f"http_{response.status_code}")
+    finally:
+        semaphore.release()
+
+    if not response.ok:
+        error_msg = response.text
+        logger.error(f"Image generation API error: {response.status_code} - {error_msg}")
+        raise ImageGenerationError(f'Image generation failed: {error_msg}', response.status_code)
+
+    result = response.json()
+
+    images = result.get('images', [])
+    if not images:
+        raise ImageGenerationError('No images generated', 500)
+
+    image_data_list = []
+    for img_base64 in images:
+        mime_type = f"image/{image_format}"
+        if image_format == 'jpeg':
+            mime_type = 'image/jpeg'
+        image_data_list.append({
+            'data': f"data:{mime_type};base64,{img_base64}",
+            'format': image_format
+        })
+
+    return {
+        'images': image_data_list,
+        'id': result.get('id'),
+        'timing': result.get('timing', {})
+    }
 
 
 @app.route('/image/generate', methods=['POST'])
@@ -1274,109 +1910,380 @@ def generate_image():
     """
     try:
         if not request.json:
-            return json.dumps({'error': 'No JSON data provided'}), 400
+            return json_codec.dumps({'error': 'No JSON data provided'}), 400
             
+        trace = tracing.current_trace()
         data = request.json
-        prompt = data.get('prompt', '').strip()
-        model = data.get('model', 'fluently-xl')
-        style_preset = data.get('style_preset')
-        image_format = data.get('format', 'webp')
-        negative_prompt = data.get('negative_prompt', '')
-        safe_mode = data.get('safe_mode', False)
-        hide_watermark = data.get('hide_watermark', True)
-        
-        if not prompt:
-            return json.dumps({'error': 'Prompt is required'}), 400
-        
-        logger.info(f"Image generation request: model={model}, prompt={prompt[:50]}...")
-        
-        # nano-banana-pro uses different parameters (aspect_ratio + resolution instead of width/height)
-        if model == 'nano-banana-pro':
-            aspect_ratio = data.get('aspect_ratio', '1:1')
-            resolution = data.get('resolution', '1K')
-            
-            payload = {
-                "model": model,
-                "prompt": prompt,
-                "aspect_ratio": aspect_ratio,
-                "resolution": resolution,
-                "return_binary": False
-            }
-        else:
-            width = data.get('width', 1024)
-            height = data.get('height', 1024)
-            
-            steps = get_model_default_steps(model)
-            
-            payload = {
-                "model": model,
-                "prompt": prompt,
-                "format": image_format,
-                "width": width,
-                "height": height,
-                "steps": steps,
-                "safe_mode": safe_mode,
-                "hide_watermark": hide_watermark,
-                "return_binary": False
-            }
-        
-        if style_preset:
-            payload["style_preset"] = style_preset
-        
-        if negative_prompt:
-            payload["negative_prompt"] = negative_prompt
-        
-        enable_web_search = data.get('enable_web_search')
-        if enable_web_search is not None:
-            payload["enable_web_search"] = enable_web_search
-            logger.info(f"Image generation with web search: {enable_web_search}")
-        
-        response = requests.post(
-            "https://api.venice.ai/api/v1/image/generate",
-            headers={
-                "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
-                "Content-Type": "application/json"
-            },
-            json=payload,
-            timeout=120
-        )
-        
-        if not response.ok:
-            error_msg = response.text
-            logger.error(f"Image generation API error: {response.status_code} - {error_msg}")
-            return json.dumps({'error': f'Image generation failed: {error_msg}'}), response.status_code
-        
-        result = response.json()
-        
-        images = result.get('images', [])
-        if not images:
-            return json.dumps({'error': 'No images generated'}), 500
-        
-        image_data_list = []
-        for img_base64 in images:
-            mime_type = f"image/{image_format}"
-            if image_format == 'jpeg':
-                mime_type = 'image/jpeg'
-            image_data_list.append({
-                'data': f"data:{mime_type};base64,{img_base64}",
-                'format': image_format
-            })
-        
-        logger.info(f"Image generation successful: {len(image_data_list)} image(s) generated")
-        
-        return json.dumps({
-            'images': image_data_list,
-            'id': result.get('id'),
-            'timing': result.get('timing', {})
-        })
-        
+        if not data.get('prompt', '').strip():
+            return json_codec.dumps({'error': 'Prompt is required'}), 400
+
+        payload, image_format = build_image_payload(data)
+        trace.mark('prepare')
+        logger.info(f"Image generation request: model={payload['model']}, prompt={payload['prompt'][:50]}...")
+
+        with trace.span('upstream'):
+            result = request_image_generation(payload, image_format)
+        logger.info(f"Image generation successful: {len(result['images'])} image(s) generated")
+
+        return json_codec.dumps(result)
+
+    except ImageGenerationError as e:
+        return json_codec.dumps({'error': e.message}), e.status_code
     except requests.exceptions.Timeout:
         logger.error("Image generation timeout")
-        return json.dumps({'error': 'Image generation timed out. Please try again.'}), 504
+        return json_codec.dumps({'error': 'Image generation timed out. Please try again.'}), 504
     except Exception as e:
         logger.exception(f"Image generation error: {str(e)}")
-        return json.dumps({'error': f'Image generation error: {str(e)}'}), 500
+        return json_codec.dumps({'error': f'Image generation error: {str(e)}'}), 500
+
+
+@app.route('/image/generate/batch', methods=['POST'])
+@drainable
+def generate_image_batch():
+    """
+    Generates several images concurrently and streams each result as it finishes
+
+    Accepts:
+        - JSON with a "jobs" list; each job takes the same fields as /image/generate.
+          Top-level fields other than "jobs" are used as defaults for every job.
+
+    Returns:
+        - Server-sent events, one per job ({'index', 'model', 'images', ...} or
+          {'index', 'model', 'error'}), followed by a summary event and [DONE]
+    """
+    data = request.json or {}
+    jobs = data.get('jobs', [])
+    defaults = {k: v for k, v in data.items() if k != 'jobs'}
+
+    if not isinstance(jobs, list) or not jobs:
+        return json_codec.dumps({'error': 'No image jobs provided'}), 400
+    if len(jobs) > IMAGE_BATCH_MAX_JOBS:
+        return json_codec.dumps({'error': f'Too many image jobs. Maximum is {IMAGE_BATCH_MAX_JOBS}'}), 400
+
+    job_requests = [{**defaults, **job} if isinstance(job, dict) else dict(defaults) for job in jobs]
+    logger.info(f"Image batch request: {len(job_requests)} jobs")
+
+    cancel = CancelToken()
+
+    def run_job(index, job):
+        """Generate the images for a single batch job"""
+        model = job.get('model', 'fluently-xl')
+        try:
+            if not job.get('prompt', '').strip():
+                return {'index': index, 'model': model, 'error': 'Prompt is required'}
+            payload, image_format = build_image_payload(job)
+            result = request_image_generation(payload, image_format, cancel)
+            return {'index': index, 'model': model, **result}
+        except Cancelled as e:
+            return {'index': index, 'model': model, 'error': f'Cancelled: {e.reason}'}
+        except ImageGenerationError as e:
+            return {'index': index, 'model': model, 'error': e.message, 'status': e.status_code}
+        except requests.exceptions.Timeout:
+            logger.error(f"Image batch job {index} timed out ({model})")
+            return {'index': index, 'model': model, 'error': 'Image generation timed out', 'status': 504}
+        except Exception as e:
+            logger.exception(f"Image batch job {index} error: {str(e)}")
+            return {'index': index, 'model': model, 'error': f'Image generation error: {str(e)}'}
+
+    def generate():
+        succeeded = 0
+        # Per-model semaphores bound the upstream load; the pool just needs a thread per job
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(job_requests))
+        futures = [executor.submit(run_job, i, job) for i, job in enumerate(job_requests)]
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                result = future.result()
+                if 'error' not in result:
+                    succeeded += 1
+                yield f"data: {json_codec.dumps(result)}\n\n"
+        except GeneratorExit:
+            # The client went away; jobs still queued for their model's semaphore give up instead of generating
+            cancel.cancel('client_gone')
+            for future, job in zip(futures, job_requests):
+                if future.cancel():
+                    model = metrics.model_label(job.get('model', 'fluently-xl'))
+                    metrics.UPSTREAM_CANCELLED.labels(model, 'image', 'client_gone').inc()
+            raise
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        logger.info(f"Image batch finished: {succeeded}/{len(job_requests)} succeeded")
+        yield f"data: {json_codec.dumps({'batch_complete': True, 'total': len(job_requests), 'succeeded': succeeded})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return Response(metrics.track_stream(generate(), '/image/generate/batch'), mimetype='text/event-stream')
+
+
+def deep_research_job(data, progress, cancel):
+    """Runs /chat/expert as a background job"""
+    try:
+        return run_deep_research(data, tracing.RequestTrace(), progress, cancel)
+    except DeepResearchError as e:
+        raise JobError(e.message, e.status_code)
+
+
+def image_job(data, progress, cancel):
+    """Runs /image/generate as a background job"""
+    payload, image_format = build_image_payload(data)
+    progress({'phase': 'generating', 'model': payload['model']})
+    try:
+        return request_image_generation(payload, image_format, cancel)
+    except ImageGenerationError as e:
+        raise JobError(e.message, e.status_code)
+    except requests.exceptions.Timeout:
+        raise JobError('Image generation timed out. Please try again.', 504)
+
+
+def digest_completion(model, cancel=None):
+    """
+    Returns a complete(messages, max_tokens) function that summarizes with a model
+
+    Each call goes through the model's provider and is timed, governed and
+    recorded in the usage ledger like any other upstream call; cancelling the
+    token aborts the calls in flight.
+    """
+    def complete(messages, max_tokens):
+        provider = providers.for_model(model)
+        timer = metrics.UpstreamTimer(model, 'digest', on_outcome=model_health.record)
+        options = {
+            'temperature': 0.2,
+            'max_completion_tokens': max_tokens,
+            'web_search': False,
+            'citations': False,
+            'cancel': cancel
+        }
+        try:
+            result = provider.complete(model, messages, options, 'digest', timer)
+        except Cancelled as e:
+            timer.cancelled(e.reason)
+            raise
+        except UpstreamBusyError:
+            timer.error('throttled')
+            raise
+        except ProviderError as e:
+            if e.reason == 'empty':
+                timer.finish()
+            else:
+                timer.error(e.reason)
+            raise
+        timer.finish(result['usage'].get('completion_tokens'), result['usage'].get('prompt_tokens'))
+        return result['content']
+    return complete
+
+
+def digest_retry_delay(error):
+    """Returns seconds to wait before retrying a failed digest summary, or None if retrying is pointless"""
+    if isinstance(error, UpstreamBusyError):
+        return min(error.retry_after, 30)
+    if isinstance(error, ProviderError) and (error.reason in ('timeout', 'connection') or
+                                             error.reason.startswith('http_5')):
+        return 2.0
+    return None
+
+
+def run_document_digest(data, progress=None, cancel=None):
+    """
+    Digests a stored document with the requested model (or its healthy fallback)
+
+    Args:
+        data (dict): 'document' (id from /process_file) and optional 'model'
+        progress (callable, optional): Receives map/reduce progress events
+        cancel (cancellation.CancelToken, optional): Aborts the summaries in flight
+
+    Returns:
+        dict: The digest, see DocumentDigester.digest
+
+    Raises:
+        DocumentError: If the document is unknown or could not be summarized
+    """
+    model, _ = model_health.route(data.get('model') or os.getenv('DIGEST_MODEL', 'llama-3.3-70b'))
+    return digester.digest(data.get('document'), model, digest_completion(model, cancel), digest_retry_delay,
+                           progress)
+
+
+def document_digest_job(data, progress, cancel):
+    """Runs a document digest as a background job"""
+    try:
+        return run_document_digest(data, progress, cancel)
+    except DocumentError as e:
+        raise JobError(e.message, e.status_code)
+
+
+def validate_job(kind, params):
+    """Returns an error message for job parameters that could never succeed, or None"""
+    if not isinstance(params, dict):
+        return 'params must be an object'
+    if kind == 'deep_research' and not params.get('candidate_models'):
+        return 'No candidate models selected for deep research'
+    if kind == 'image' and not str(params.get('prompt', '')).strip():
+        return 'Prompt is required'
+    if kind == 'document_digest':
+        try:
+            document_store.meta(params.get('document'))
+        except DocumentError as e:
+            return e.message
+    return None
+
+
+if job_queue is not None:
+    job_queue.register('deep_research', deep_research_job)
+    job_queue.register('image', image_job)
+    job_queue.register('document_digest', document_digest_job)
+
+
+@app.route('/documents/<document_id>')
+def get_document(document_id):
+    """
+    Returns a stored document's name, page labels and size, without its text
+    """
+    try:
+        return json_codec.dumps(document_store.meta(document_id)), 200, {'Content-Type': 'application/json'}
+    except DocumentError as e:
+        return json_codec.dumps({'error': e.message}), e.status_code, {'Content-Type': 'application/json'}
+
+
+@app.route('/documents/<document_id>/pages')
+def get_document_pages(document_id):
+    """
+    Returns the full text of selected pages of a stored document
+
+    Accepts:
+        - pages: 1-based pages and ranges, e.g. "3-5,9"; sections and sheets
+          of unpaginated documents are numbered the same way
+
+    Returns:
+        - JSON with the document's name and a list of {page, label, text}
+    """
+    try:
+        document = document_store.meta(document_id)
+        pages = document_store.pages(document_id, request.args.get('pages'))
+    except DocumentError as e:
+        return json_codec.dumps({'error': e.message}), e.status_code, {'Content-Type': 'application/json'}
+    return json_codec.dumps({'document': document_id, 'name': document['name'], 'pages': pages}), 200, \
+        {'Content-Type': 'application/json'}
+
+
+@app.route('/documents/<document_id>/digest', methods=['GET', 'POST'])
+@drainable
+def document_digest(document_id):
+    """
+    Returns the cached digest of a document (GET), or builds it (POST)
+
+    Accepts:
+        - GET: model; 404 if no digest of the document by that model is cached
+        - POST: JSON with an optional model. Digests of long documents take a
+          while; POST /jobs with kind "document_digest" builds one in the
+          background instead
+
+    Returns:
+        - JSON with the digest text, page and chunk counts and reduce levels
+    """
+    try:
+        if request.method == 'GET':
+            model, _ = model_health.route(request.args.get('model') or os.getenv('DIGEST_MODEL', 'llama-3.3-70b'))
+            document_store.meta(document_id)
+            digest = document_store.cached_digest(document_id, model)
+            if digest is None:
+                return json_codec.dumps({'error': 'No digest of this document yet'}), 404, \
+                    {'Content-Type': 'application/json'}
+            return json_codec.dumps({**digest, 'cached': True}), 200, {'Content-Type': 'application/json'}
+
+        data = request.get_json(silent=True) or {}
+        digest = run_document_digest({**data, 'document': document_id})
+        return json_codec.dumps(digest), 200, {'Content-Type': 'application/json'}
+    except DocumentError as e:
+        return json_codec.dumps({'error': e.message}), e.status_code, {'Content-Type': 'application/json'}
+
+
+@app.route('/jobs', methods=['POST'])
+@drainable
+def submit_job():
+    """
+    Starts a background job
+
+    Accepts:
+        - JSON with kind and params:
+          - "deep_research": the body /chat/expert would take
+          - "image": the body /image/generate would take
+          - "document_digest": {"document": id from /process_file, "model": optional}
+
+    Returns:
+        - The queued job (202) with its id; poll GET /jobs/<id> or follow
+          GET /jobs/<id>/events for progress and the result
+    """
+    if job_queue is None:
+        return json_codec.dumps({'error': 'Background jobs are disabled'}), 404, {'Content-Type': 'application/json'}
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    params = data.get('params', {})
+    if kind not in job_queue.kinds:
+        return json_codec.dumps({'error': f"kind must be one of {', '.join(job_queue.kinds)}"}), 400, \
+            {'Content-Type': 'application/json'}
+    error = validate_job(kind, params)
+    if error:
+        return json_codec.dumps({'error': error}), 400, {'Content-Type': 'application/json'}
+    try:
+        job = job_queue.submit(kind, params)
+    except JobQueueFull as e:
+        return json_codec.dumps({'error': str(e)}), 503, {'Content-Type': 'application/json', 'Retry-After': '10'}
+    return json_codec.dumps(job), 202, {'Content-Type': 'application/json', 'Location': f"/jobs/{job['id']}"}
+
+
+@app.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    """
+    Returns a job's state and, once it succeeded, its result (GET), or cancels it (DELETE)
+    """
+    if job_queue is None:
+        return json_codec.dumps({'error': 'Background jobs are disabled'}), 404, {'Content-Type': 'application/json'}
+    try:
+        job = job_queue.cancel(job_id) if request.method == 'DELETE' else job_queue.get(job_id)
+    except JobNotFound as e:
+        return json_codec.dumps({'error': str(e)}), 404, {'Content-Type': 'application/json'}
+    return json_codec.dumps(job), 200, {'Content-Type': 'application/json'}
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """
+    Follows a job over server-sent events
+
+    Every progress event is sent as {"progress": {...}} with an SSE id, so a
+    client that reconnects with Last-Event-ID only receives what it missed.
+    The final state, including the result, follows as {"job": {...}} and
+    [DONE]; a comment is sent every 15 seconds while nothing happens so
+    proxies keep the connection open.
+    """
+    if job_queue is None:
+        return json_codec.dumps({'error': 'Background jobs are disabled'}), 404, {'Content-Type': 'application/json'}
+    last_event_id = request.headers.get('Last-Event-ID', '0')
+    after = int(last_event_id) if last_event_id.isdigit() else 0
+    events = job_queue.events(job_id, after=after)
+    try:
+        first = next(events)
+    except JobNotFound as e:
+        return json_codec.dumps({'error': str(e)}), 404, {'Content-Type': 'application/json'}
+
+    def frame(item):
+        if item is None:
+            return ": keepalive\n\n"
+        seq, value = item
+        if seq is None:
+            return json_codec.sse({'job': value})
+        return f"id: {seq}\n{json_codec.sse({'progress': value})}"
+
+    def generate():
+        yield frame(first)
+        for item in events:
+            yield frame(item)
+        yield "data: [DONE]\n\n"
+
+    return Response(metrics.track_stream(generate(), '/jobs/<job_id>/events'), mimetype='text/event-stream')
+
 
+if os.getenv('PREWARM_IMPORTS', '1') == '1':
+    # Load heavy file/visualization dependencies off the request path once the server is up
+    start_prewarm(delay=float(os.getenv('PREWARM_DELAY', '1.0')))
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000)
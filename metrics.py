@@ -0,0 +1,308 @@
+"""
+Prometheus metrics for WugaBot
+
+Metrics are plain prometheus_client counters, gauges and histograms. When
+PROMETHEUS_MULTIPROC_DIR is set (serve.py does this for gunicorn), every worker
+writes its values to memory-mapped files in that directory and /metrics
+aggregates them, so the numbers cover all worker processes rather than the one
+that happened to answer the scrape.
+"""
+
+import os
+import threading
+import time
+
+from flask import g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, generate_latest, multiprocess)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TTFB_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60, 120)
+TOKEN_RATE_BUCKETS = (1, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+
+REQUEST_LATENCY = Histogram(
+    'wugabot_request_duration_seconds',
+    'Time until a route returned its response (headers for streams)',
+    ['route', 'method', 'status'],
+    buckets=LATENCY_BUCKETS
+)
+STREAM_DURATION = Histogram(
+    'wugabot_stream_duration_seconds',
+    'Lifetime of server-sent event responses',
+    ['route'],
+    buckets=LATENCY_BUCKETS
+)
+UPSTREAM_TTFB = Histogram(
+    'wugabot_upstream_ttfb_seconds',
+    'Time from sending an upstream request to its first response byte',
+    ['model', 'call'],
+    buckets=TTFB_BUCKETS
+)
+UPSTREAM_TOKENS_PER_SECOND = Histogram(
+    'wugabot_upstream_tokens_per_second',
+    'Completion tokens per second after the first byte',
+    ['model', 'call'],
+    buckets=TOKEN_RATE_BUCKETS
+)
+UPSTREAM_COMPLETION_TOKENS = Counter(
+    'wugabot_upstream_completion_tokens_total',
+    'Completion tokens reported by the upstream',
+    ['model', 'call']
+)
+UPSTREAM_ERRORS = Counter(
+    'wugabot_upstream_errors_total',
+    'Upstream calls that failed, by reason',
+    ['model', 'call', 'reason']
+)
+UPSTREAM_CANCELLED = Counter(
+    'wugabot_upstream_cancelled_total',
+    'Upstream calls aborted because their client went away, stopped or cancelled them',
+    ['model', 'call', 'reason']
+)
+UPSTREAM_STALLS = Counter(
+    'wugabot_upstream_stalls_total',
+    'Upstream streams ended by the watchdog for missing their first-byte or idle deadline',
+    ['model', 'call', 'phase']
+)
+UPSTREAM_RETRIES = Counter(
+    'wugabot_upstream_retries_total',
+    'Upstream calls retried after a 429/503',
+    ['call', 'status']
+)
+UPSTREAM_THROTTLED = Counter(
+    'wugabot_upstream_throttled_total',
+    'Upstream calls refused because no rate limit slot freed up in time',
+    ['call']
+)
+UPSTREAM_QUEUE_WAIT = Histogram(
+    'wugabot_upstream_queue_wait_seconds',
+    'Time upstream calls spent queued for a rate limit slot or backing off',
+    ['call'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+)
+MODEL_CIRCUIT_STATE = Gauge(
+    'wugabot_model_circuit_state',
+    'Circuit breaker state per model (0 closed, 1 half open, 2 open)',
+    ['model'],
+    multiprocess_mode='livemax'
+)
+MODEL_FALLBACKS = Counter(
+    'wugabot_model_fallbacks_total',
+    'Calls routed to a fallback model',
+    ['requested', 'used', 'reason']
+)
+HEDGE_ELIGIBLE = Counter(
+    'wugabot_stream_hedge_eligible_total',
+    'Streams sent through the hedging path',
+    ['model']
+)
+HEDGES = Counter(
+    'wugabot_stream_hedges_total',
+    'Streams that sent a hedge request, by which attempt produced content first',
+    ['model', 'winner']
+)
+HEDGE_SKIPPED = Counter(
+    'wugabot_stream_hedges_skipped_total',
+    'Streams past the hedge delay that were not hedged because the hedge budget was spent',
+    ['model']
+)
+STREAM_RESUMES = Counter(
+    'wugabot_stream_resumes_total',
+    'Reconnects to a buffered stream with Last-Event-ID, by outcome',
+    ['outcome']
+)
+ACTIVE_STREAMS = Gauge(
+    'wugabot_active_sse_streams',
+    'Server-sent event responses currently open',
+    multiprocess_mode='livesum'
+)
+THREADS = Gauge(
+    'wugabot_threads',
+    'Python threads alive in the serving processes',
+    multiprocess_mode='livesum'
+)
+EXPERT_CANDIDATES = Counter(
+    'wugabot_expert_candidates_total',
+    'Deep research candidate outcomes',
+    ['model', 'outcome']
+)
+JOBS = Counter(
+    'wugabot_jobs_total',
+    'Background jobs by kind and outcome (succeeded, failed, cancelled, rejected)',
+    ['kind', 'outcome']
+)
+FILE_EXTRACTION = Histogram(
+    'wugabot_file_extraction_seconds',
+    'Text extraction time by file type and page count',
+    ['file_type', 'pages'],
+    buckets=LATENCY_BUCKETS
+)
+IMAGE_GENERATION = Histogram(
+    'wugabot_image_generation_seconds',
+    'Upstream image generation latency',
+    ['model', 'outcome'],
+    buckets=LATENCY_BUCKETS
+)
+USAGE_LEDGER_WRITES = Counter(
+    'wugabot_usage_ledger_writes_total',
+    'Upstream call records written to the usage ledger'
+)
+USAGE_LEDGER_DROPPED = Counter(
+    'wugabot_usage_ledger_dropped_total',
+    'Usage ledger records dropped because the queue was full or the write failed'
+)
+LOG_RECORDS_DROPPED = Counter(
+    'wugabot_log_records_dropped_total',
+    'Log records dropped because the logging queue was full'
+)
+
+
+def page_bucket(pages):
+    """Groups page (or sheet) counts into a small set of label values"""
+    if pages <= 1:
+        return '1'
+    if pages <= 10:
+        return '2-10'
+    if pages <= 50:
+        return '11-50'
+    return '51+'
+
+
+# Set by the app to known_model(model) -> bool. Other model ids share the 'unknown' label, so ids sent by
+# clients cannot create label values (and multiprocess metric files) without bound
+known_model = None
+UNKNOWN_MODEL = 'unknown'
+
+
+def model_label(model):
+    """Returns the label value for a model id: the id itself for known models, 'unknown' otherwise"""
+    if known_model is None or known_model(model):
+        return model
+    return UNKNOWN_MODEL
+
+
+def update_thread_gauge():
+    THREADS.set(threading.active_count())
+
+
+class UpstreamTimer:
+    """
+    Times one upstream call and records TTFB, throughput and token totals
+
+    Usage:
+        timer = UpstreamTimer(model, 'stream')
+        ... send request ...
+        timer.first_byte()       # when the first body byte arrives
+        timer.finish(tokens)     # completion tokens, or None if unknown
+
+    on_outcome, if given, is called as on_outcome(model, ok, reason, ttfb) when
+    the call finishes or fails, e.g. to feed model health tracking. Calls
+    cancelled by the client say nothing about the model and are left out.
+
+    If UpstreamTimer.ledger is set (a usage_ledger.UsageLedger), every
+    finished or failed call is recorded there with its tokens and timings.
+    Metrics are labelled with model_label(model).
+    """
+
+    ledger = None
+
+    def __init__(self, model, call, on_outcome=None):
+        self.model = model
+        self.label = model_label(model)
+        self.call = call
+        self.on_outcome = on_outcome
+        self.start = time.perf_counter()
+        self.first_byte_at = None
+
+    def first_byte(self):
+        if self.first_byte_at is None:
+            self.first_byte_at = time.perf_counter()
+            UPSTREAM_TTFB.labels(self.label, self.call).observe(self.first_byte_at - self.start)
+
+    def watch(self, lines):
+        """Passes upstream lines through, recording TTFB at the first non-empty one"""
+        for line in lines:
+            if line and self.first_byte_at is None:
+                self.first_byte()
+            yield line
+
+    def finish(self, completion_tokens=None, prompt_tokens=None):
+        self.first_byte()
+        if self.on_outcome:
+            self.on_outcome(self.model, True, None, self.first_byte_at - self.start)
+        if self.ledger is not None:
+            self.ledger.record(self.model, self.call, True, prompt_tokens=prompt_tokens,
+                               completion_tokens=completion_tokens, ttfb=self.first_byte_at - self.start,
+                               duration=time.perf_counter() - self.start)
+        if completion_tokens:
+            UPSTREAM_COMPLETION_TOKENS.labels(self.label, self.call).inc(completion_tokens)
+            generation_time = time.perf_counter() - self.first_byte_at
+            # Non-streaming calls deliver everything at once, so fall back to the whole call
+            if generation_time < 0.05:
+                generation_time = time.perf_counter() - self.start
+            if generation_time > 0:
+                UPSTREAM_TOKENS_PER_SECOND.labels(self.label, self.call).observe(
+                    completion_tokens / generation_time)
+
+    def error(self, reason):
+        UPSTREAM_ERRORS.labels(self.label, self.call, reason).inc()
+        if self.on_outcome:
+            self.on_outcome(self.model, False, reason, None)
+        if self.ledger is not None:
+            ttfb = self.first_byte_at - self.start if self.first_byte_at is not None else None
+            self.ledger.record(self.model, self.call, False, reason=reason, ttfb=ttfb,
+                               duration=time.perf_counter() - self.start)
+
+    def cancelled(self, reason):
+        """Records a call aborted on the client's behalf; unlike error(), on_outcome is not told"""
+        UPSTREAM_CANCELLED.labels(self.label, self.call, reason).inc()
+        if self.ledger is not None:
+            ttfb = self.first_byte_at - self.start if self.first_byte_at is not None else None
+            self.ledger.record(self.model, self.call, False, reason=f"cancelled_{reason}", ttfb=ttfb,
+                               duration=time.perf_counter() - self.start)
+
+
+def track_stream(generator, route):
+    """Wraps an SSE generator so open streams and their lifetime are measured"""
+    ACTIVE_STREAMS.inc()
+    update_thread_gauge()
+    start = time.perf_counter()
+    try:
+        yield from generator
+    finally:
+        ACTIVE_STREAMS.dec()
+        STREAM_DURATION.labels(route).observe(time.perf_counter() - start)
+
+
+def init_app(app):
+    """Registers request latency hooks on the Flask app"""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_latency(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            REQUEST_LATENCY.labels(route, request.method, str(response.status_code)).observe(
+                time.perf_counter() - start)
+        update_thread_gauge()
+        return response
+
+
+def render():
+    """
+    Returns the current metrics in the Prometheus text format
+
+    Returns:
+        tuple: (body bytes, content type)
+    """
+    update_thread_gauge()
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,377 @@
+"""
+Model health tracking, circuit breaking and fallback routing
+
+Every upstream chat call reports its outcome here (through UpstreamTimer).
+Per model the registry keeps a short window of recent results and TTFBs and
+runs a circuit breaker:
+
+    closed     normal operation
+    open       the model failed repeatedly; traffic goes to a fallback until
+               the cooldown expires
+    half_open  after the cooldown one probe request is let through; success
+               closes the circuit, failure re-opens it with a longer cooldown
+
+Only failures that say something about the model count: timeouts, connection
+errors, 5xx responses and calls whose TTFB exceeds MODEL_SLOW_TTFB_RATIO of the
+first-byte limit of the model's class (so reasoning models, which may think
+for minutes, are held to their own longer limit). Rate limiting and
+client errors (4xx) do not. Models the /models catalog reports as offline are
+treated as open.
+
+Fallbacks come from MODEL_FALLBACKS first, then from catalog models of the
+same class (at least the capabilities of the requested model), preferring the
+lowest recent TTFB. State is per process, and only kept for models in the
+catalog or MODEL_FALLBACKS, so model ids sent by clients cannot grow it; calls
+to other models pass through untracked.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, HALF_OPEN, OPEN = 'closed', 'half_open', 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Capabilities a fallback must share with the requested model to be of the same class
+CLASS_CAPABILITIES = ('supportsVision', 'supportsReasoning', 'supportsFunctionCalling', 'supportsWebSearch')
+
+
+def parse_fallbacks(value):
+    """
+    Parses a MODEL_FALLBACKS value
+
+    Args:
+        value (str): Comma-separated model=fallback[|fallback...] entries
+
+    Returns:
+        dict: Ordered fallback lists keyed by model id
+    """
+    fallbacks = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        model, targets = item.split('=', 1)
+        fallbacks[model.strip()] = [t.strip() for t in targets.split('|') if t.strip()]
+    return fallbacks
+
+
+def counts_as_failure(reason):
+    """Returns True for failure reasons that indicate an unhealthy model"""
+    return reason in ('timeout', 'connection', 'slow') or reason.startswith('http_5')
+
+
+class ModelState:
+    """Recent outcomes and circuit state of one model"""
+
+    def __init__(self, window):
+        self.results = deque(maxlen=window)
+        self.ttfbs = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.cooldown = 0.0
+        self.probe_started = None
+
+    def failure_rate(self):
+        return self.results.count(False) / len(self.results) if self.results else 0.0
+
+    def ttfb_percentile(self, pct):
+        if not self.ttfbs:
+            return None
+        ordered = sorted(self.ttfbs)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class ModelHealth:
+    """
+    Registry of model health with a circuit breaker per model
+
+    Args:
+        window (int): Results kept per model
+        failure_threshold (int): Consecutive failures that open the circuit
+        failure_rate (float): Failure share of the window that opens the circuit
+        min_calls (int): Results needed before failure_rate applies
+        cooldown (float): Seconds an opened circuit stays open before a probe
+        max_cooldown (float): Cap for the cooldown, which doubles on failed probes
+        slow_ttfb (float): TTFB in seconds above which a call counts as failed,
+            used until timeouts is set
+        slow_ttfb_ratio (float): Share of the model's first-byte limit above
+            which a call counts as failed, once timeouts is set
+        fallbacks (dict): Explicit fallback lists by model id
+        catalog_ttl (float): Seconds before the model catalog is refreshed
+        max_uncataloged (int): Models tracked while the catalog has not loaded
+    """
+
+    def __init__(self, window=20, failure_threshold=3, failure_rate=0.5, min_calls=5, cooldown=30.0,
+                 max_cooldown=300.0, slow_ttfb=30.0, slow_ttfb_ratio=0.5, fallbacks=None, catalog_ttl=300.0,
+                 max_uncataloged=50):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.slow_ttfb = slow_ttfb
+        self.slow_ttfb_ratio = slow_ttfb_ratio
+        # upstream_timeouts.UpstreamTimeouts whose first-byte limits scale the slow threshold; set by the app
+        self.timeouts = None
+        self.fallbacks = fallbacks or {}
+        self.catalog_ttl = catalog_ttl
+        self.catalog = {}
+        self.catalog_updated = 0.0
+        self.catalog_loader = None
+        self._refreshing = False
+        self.max_uncataloged = max_uncataloged
+        self._uncataloged = set()
+        self._models = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Builds the registry from MODEL_* environment variables"""
+        return cls(
+            failure_threshold=int(os.getenv('MODEL_CIRCUIT_FAILURES', '3')),
+            cooldown=float(os.getenv('MODEL_CIRCUIT_COOLDOWN', '30')),
+            slow_ttfb_ratio=float(os.getenv('MODEL_SLOW_TTFB_RATIO', '0.5')),
+            fallbacks=parse_fallbacks(os.getenv('MODEL_FALLBACKS', ''))
+        )
+
+    def known(self, model):
+        """
+        Returns True for models whose health is tracked
+
+        Those are the models in the catalog or MODEL_FALLBACKS; until the
+        catalog has loaded, the first max_uncataloged other ids are tracked too.
+        """
+        with self._lock:
+            return self._known(model)
+
+    def _known(self, model):
+        # Called with self._lock held, so the size check and add below cannot overshoot max_uncataloged
+        if model in self.catalog or model in self.fallbacks:
+            return True
+        if self.catalog or not isinstance(model, str):
+            return False
+        if model in self._uncataloged:
+            return True
+        if len(self._uncataloged) < self.max_uncataloged:
+            self._uncataloged.add(model)
+            return True
+        return False
+
+    def _state(self, model):
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = ModelState(self.window)
+        return state
+
+    def _set_state(self, model, state, new_state):
+        if state.state != new_state:
+            logger.warning(f"Circuit for {model}: {state.state} -> {new_state}")
+            state.state = new_state
+        metrics.MODEL_CIRCUIT_STATE.labels(model).set(STATE_VALUES[new_state])
+
+    def slow_threshold(self, model):
+        """Returns the TTFB in seconds above which a call to the model counts as failed"""
+        if self.timeouts is None:
+            return self.slow_ttfb
+        return self.timeouts.policy(model).first_byte * self.slow_ttfb_ratio
+
+    def record(self, model, ok, reason=None, ttfb=None):
+        """
+        Records the outcome of an upstream call
+
+        Args:
+            model (str): Model id
+            ok (bool): Whether the call succeeded
+            reason (str, optional): Failure reason (e.g. 'timeout', 'http_502')
+            ttfb (float, optional): Seconds to the first byte
+        """
+        if not ok and not counts_as_failure(reason or ''):
+            return
+        if ok and ttfb is not None and ttfb > self.slow_threshold(model):
+            ok, reason = False, 'slow'
+
+        with self._lock:
+            if not self._known(model):
+                return
+            state = self._state(model)
+            if ttfb is not None:
+                state.ttfbs.append(ttfb)
+            state.results.append(ok)
+            state.probe_started = None
+
+            if ok:
+                state.consecutive_failures = 0
+                if state.state != CLOSED:
+                    state.cooldown = 0.0
+                    self._set_state(model, state, CLOSED)
+                return
+
+            state.consecutive_failures += 1
+            tripped = (state.consecutive_failures >= self.failure_threshold or
+                       (len(state.results) >= self.min_calls and state.failure_rate() >= self.failure_rate))
+            if state.state == HALF_OPEN or (state.state == CLOSED and tripped):
+                # A failed probe backs off further than the first trip
+                state.cooldown = min(self.max_cooldown, state.cooldown * 2 if state.cooldown else self.base_cooldown)
+                state.opened_at = time.monotonic()
+                self._set_state(model, state, OPEN)
+                logger.warning(f"Model {model} unhealthy ({reason}), circuit open for {state.cooldown:.0f}s")
+
+    def _available(self, model, now):
+        """Returns True if a call may go to the model, claiming the probe slot of a half-open circuit"""
+        if self.catalog.get(model, {}).get('offline'):
+            return False
+        if not self._known(model):
+            return True
+        state = self._state(model)
+        if state.state == CLOSED:
+            return True
+        if state.state == OPEN and now - state.opened_at >= state.cooldown:
+            self._set_state(model, state, HALF_OPEN)
+        if state.state == HALF_OPEN:
+            # One probe at a time; a probe that never reported back is given up after two minutes
+            if state.probe_started is None or now - state.probe_started > 120:
+                state.probe_started = now
+                return True
+        return False
+
+    def _same_class(self, model, candidate):
+        spec = self.catalog.get(model)
+        candidate_spec = self.catalog.get(candidate)
+        if spec is None or candidate_spec is None or candidate_spec.get('type', 'text') != spec.get('type', 'text'):
+            return False
+        capabilities = spec.get('capabilities', {})
+        candidate_capabilities = candidate_spec.get('capabilities', {})
+        return all(candidate_capabilities.get(c) for c in CLASS_CAPABILITIES if capabilities.get(c))
+
+    def _alternatives(self, model, exclude=()):
+        candidates = list(self.fallbacks.get(model, []))
+        same_class = [m for m in self.catalog if m != model and self._same_class(model, m)]
+        same_class.sort(key=lambda m: self._state(m).ttfb_percentile(50) or float('inf'))
+        candidates += [m for m in same_class if m not in candidates]
+        return [m for m in candidates if m != model and m not in exclude]
+
+    def alternative(self, model):
+        """
+        Returns a healthy model that could stand in for another, without routing to it
+
+        Returns:
+            str: Fallback model id, or None if there is none
+        """
+        with self._lock:
+            for candidate in self._alternatives(model):
+                state = self._state(candidate)
+                if state.state == CLOSED and not self.catalog.get(candidate, {}).get('offline'):
+                    return candidate
+        return None
+
+    def ttfb_stats(self, model):
+        """
+        Returns recent time-to-first-byte figures for a model
+
+        Returns:
+            tuple: (number of samples, p90 seconds or None)
+        """
+        with self._lock:
+            if not self._known(model):
+                return 0, None
+            state = self._state(model)
+            return len(state.ttfbs), state.ttfb_percentile(90)
+
+    def route(self, model, exclude=()):
+        """
+        Picks the model a call should go to
+
+        Args:
+            model (str): Requested model id
+            exclude (iterable): Models not to fall back to (e.g. other expert candidates)
+
+        Returns:
+            tuple: (model to use, reason it was substituted or None)
+        """
+        self.refresh_catalog_if_stale()
+        with self._lock:
+            now = time.monotonic()
+            if self._available(model, now):
+                return model, None
+            reason = 'offline' if self.catalog.get(model, {}).get('offline') else 'circuit_open'
+
+            for candidate in self._alternatives(model, exclude):
+                if self._available(candidate, now):
+                    metrics.MODEL_FALLBACKS.labels(model, candidate, reason).inc()
+                    logger.warning(f"Routing {model} to {candidate} ({reason})")
+                    return candidate, reason
+
+        # Nothing better available; trying the requested model beats failing outright
+        return model, None
+
+    def update_catalog(self, models):
+        """
+        Stores the text model catalog from the /models response
+
+        Args:
+            models (list): Model entries as returned by the Venice API
+        """
+        catalog = {}
+        for model in models:
+            spec = model.get('model_spec', {})
+            catalog[model.get('id')] = {
+                'type': model.get('type', 'text'),
+                'offline': bool(spec.get('offline') or model.get('offline')),
+                'capabilities': spec.get('capabilities', {}),
+                'pricing': spec.get('pricing', {})
+            }
+        with self._lock:
+            self.catalog = catalog
+            self.catalog_updated = time.monotonic()
+
+    def capabilities(self, model):
+        """Returns the catalog capabilities of a model, or {} if it is not in the catalog"""
+        return self.catalog.get(model, {}).get('capabilities', {})
+
+    def refresh_catalog_if_stale(self):
+        """Reloads the catalog in the background once it is older than catalog_ttl"""
+        if self.catalog_loader is None or time.monotonic() - self.catalog_updated < self.catalog_ttl:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def load():
+            try:
+                self.update_catalog(self.catalog_loader())
+            except Exception as e:
+                logger.warning(f"Model catalog refresh failed: {e}")
+                self.catalog_updated = time.monotonic()
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=load, name='model-catalog-refresh', daemon=True).start()
+
+    def snapshot(self):
+        """Returns the health of every known model for the status endpoint"""
+        with self._lock:
+            now = time.monotonic()
+            result = {}
+            for model, state in self._models.items():
+                entry = {
+                    'state': state.state,
+                    'calls': len(state.results),
+                    'failure_rate': round(state.failure_rate(), 3),
+                    'consecutive_failures': state.consecutive_failures,
+                    'ttfb_p50': state.ttfb_percentile(50),
+                    'ttfb_p90': state.ttfb_percentile(90),
+                    'offline': self.catalog.get(model, {}).get('offline', False)
+                }
+                if state.state == OPEN:
+                    entry['retry_in'] = round(max(0.0, state.cooldown - (now - state.opened_at)), 1)
+                result[model] = entry
+            return result
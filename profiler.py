@@ -0,0 +1,79 @@
+"""
+On-demand sampling profiler for the live process
+
+Samples the Python stacks of every thread at a fixed interval using
+sys._current_frames() and aggregates them in the collapsed ("folded") format
+understood by flamegraph.pl, speedscope and most flame graph viewers:
+
+    thread;module:function;module:function count
+
+Sampling runs in the calling thread, needs no extra dependency, and only one
+profile can run at a time per process.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Leaf functions of threads that are blocked rather than doing work
+IDLE_FUNCTIONS = {'wait', 'select', 'poll', 'epoll', 'accept', 'sleep', '_wait_for_tstate_lock',
+                  'acquire', 'get', 'readinto', 'recv_into', 'serve_forever'}
+
+_profile_lock = threading.Lock()
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def sample(seconds, interval=0.005, include_idle=False):
+    """
+    Samples all thread stacks for a period of time
+
+    Args:
+        seconds (float): How long to sample
+        interval (float): Seconds between samples
+        include_idle (bool): Keep samples of threads blocked in waits/IO
+
+    Returns:
+        collections.Counter: Sample counts keyed by root-first stack tuples
+
+    Raises:
+        ProfilerBusyError: If another profile is already running
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise ProfilerBusyError("A profile is already running")
+    try:
+        counts = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if not include_idle and frame.f_code.co_name in IDLE_FUNCTIONS:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                counts[tuple(reversed(stack))] += 1
+            time.sleep(interval)
+        return counts
+    finally:
+        _profile_lock.release()
+
+
+def collapsed(counts):
+    """Formats sampled stacks as collapsed flame graph input"""
+    return "\n".join(f"{';'.join(stack)} {count}" for stack, count in counts.most_common()) + "\n"
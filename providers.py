@@ -0,0 +1,546 @@
+"""
+Model providers behind one streaming interface
+
+Every upstream vendor is wrapped in a Provider that turns a chat history into
+a stream of StreamEvents (content, reasoning, citations, usage, error, done)
+or a complete reply. /chat/stream relays the events as SSE frames without
+knowing where they came from, and deep research can fan candidates out to
+models of different providers, spreading load beyond one vendor's rate limit.
+
+Providers are picked by model id prefix; models without a matching prefix go
+to Venice. Each provider keeps one pooled client for the process, so calls
+reuse connections instead of paying a TLS handshake each time. Every call is
+bounded by the timeout policy of its model class, and streams that stall
+under the watchdog end with a 'timeout' ProviderError.
+"""
+
+import logging
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import json_codec
+import log_pipeline
+from cancellation import Cancelled, guarded
+from image_store import encode_json_body
+from upstream_timeouts import STALL_REASONS
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderError(Exception):
+    """
+    Raised when a provider rejects or fails a call
+
+    Args:
+        message (str): Error shown to the client
+        reason (str): UpstreamTimer failure reason (e.g. 'http_502', 'timeout')
+    """
+
+    def __init__(self, message, reason):
+        self.message = message
+        self.reason = reason
+        super().__init__(message)
+
+
+class StreamEvent:
+    """
+    One normalized event of a chat stream
+
+    Args:
+        kind (str): One of the kind constants below
+        value: Text for content/reasoning/error, a list for citations, a dict
+            for parameters/usage, None for done
+    """
+
+    CONTENT = 'content'
+    REASONING = 'reasoning'
+    CITATIONS = 'citations'
+    PARAMETERS = 'parameters'
+    USAGE = 'usage'
+    ERROR = 'error'
+    DONE = 'done'
+
+    __slots__ = ('kind', 'value')
+
+    def __init__(self, kind, value=None):
+        self.kind = kind
+        self.value = value
+
+    def frame(self):
+        """Returns the SSE frame sent to the client, or None for events that are not relayed (usage)"""
+        kind = self.kind
+        if kind == StreamEvent.CONTENT:
+            return f"data: {json_codec.dumps({'content': self.value})}\n\n"
+        if kind == StreamEvent.REASONING:
+            return f"data: {json_codec.dumps({'reasoning_content': self.value})}\n\n"
+        if kind == StreamEvent.CITATIONS:
+            chunk = {"venice_parameters": {"web_search_citations": self.value}}
+            return f"data: {json_codec.dumps(chunk)}\n\n"
+        if kind == StreamEvent.PARAMETERS:
+            return f"data: {json_codec.dumps({'venice_parameters': self.value})}\n\n"
+        if kind == StreamEvent.ERROR:
+            return f"data: {json_codec.dumps({'error': self.value})}\n\n"
+        if kind == StreamEvent.DONE:
+            return "data: [DONE]\n\n"
+        return None
+
+    def __repr__(self):
+        return f"StreamEvent({self.kind!r}, {self.value!r})"
+
+
+def clean_citations(citations):
+    """
+    Reduces web search citations to title and URL, dropping empty ones
+
+    Args:
+        citations (list): Citations as sent by the upstream
+
+    Returns:
+        list: Citations with 'title' and 'url'
+    """
+    cleaned = []
+    for citation in citations:
+        try:
+            cleaned_citation = {
+                "title": str(citation.get("title", "")).strip() or "Untitled",
+                "url": str(citation.get("url", "")).strip() or "#"
+            }
+        except Exception as e:
+            logger.warning(f"Error cleaning citation: {e}")
+            continue
+        # Only keep citations with at least a title or URL
+        if cleaned_citation["title"] != "Untitled" or cleaned_citation["url"] != "#":
+            cleaned.append(cleaned_citation)
+    return cleaned
+
+
+def _parameter_events(venice_parameters):
+    citations = venice_parameters.get('web_search_citations')
+    if isinstance(citations, list) and citations:
+        cleaned = clean_citations(citations)
+        if cleaned:
+            yield StreamEvent(StreamEvent.CITATIONS, cleaned)
+
+    # Other venice_parameters are passed on without the citations to avoid duplication
+    other_params = {k: v for k, v in venice_parameters.items() if k != 'web_search_citations'}
+    if other_params:
+        yield StreamEvent(StreamEvent.PARAMETERS, other_params)
+
+
+def venice_events(lines):
+    """
+    Parses upstream Venice SSE lines into StreamEvents
+
+    Args:
+        lines (iterable): Raw upstream lines (bytes) as from response.iter_lines()
+
+    Yields:
+        StreamEvent: Events in upstream order, ending with DONE if the upstream sent [DONE]
+    """
+    for line in lines:
+        # Parsed as bytes; the codec decodes UTF-8 itself
+        if not line.startswith(b'data: '):
+            continue
+
+        data = line[6:]
+        if data == b'[DONE]':
+            yield StreamEvent(StreamEvent.DONE)
+            break
+
+        try:
+            json_data = json_codec.loads(data)
+        except json_codec.JSONDecodeError as e:
+            logger.warning("JSON decode error: %s, data: %r...", e, data[:100], extra={'sample': 'decode_error'})
+            continue
+
+        if json_data.get('usage'):
+            yield StreamEvent(StreamEvent.USAGE, json_data['usage'])
+
+        if 'venice_parameters' in json_data:
+            yield from _parameter_events(json_data['venice_parameters'])
+
+        if 'content' in json_data:
+            yield StreamEvent(StreamEvent.CONTENT, json_data['content'])
+
+        if 'reasoning_content' in json_data:
+            yield StreamEvent(StreamEvent.REASONING, json_data['reasoning_content'])
+
+        choices = json_data.get('choices')
+        if choices and 'delta' in choices[0]:
+            delta = choices[0]['delta']
+            if delta.get('content'):
+                yield StreamEvent(StreamEvent.CONTENT, delta['content'])
+            if delta.get('reasoning_content'):
+                yield StreamEvent(StreamEvent.REASONING, delta['reasoning_content'])
+            if 'venice_parameters' in delta:
+                yield from _parameter_events(delta['venice_parameters'])
+
+
+def watched(watch, events):
+    """
+    Relays the events of an upstream call under the watchdog
+
+    Args:
+        watch (upstream_timeouts.Watch): Watch of the call; closed when the events end
+        events (iterable): StreamEvents read with watch.token as their cancel token
+
+    Yields:
+        StreamEvent: The events; a stall raises ProviderError with reason 'timeout'
+    """
+    try:
+        yield from watch.beats(events)
+    except Cancelled as e:
+        if e.reason in STALL_REASONS:
+            raise ProviderError(watch.describe(e.reason), 'timeout') from None
+        raise
+    finally:
+        watch.close()
+
+
+class Provider:
+    """
+    Base class of model providers
+
+    Subclasses set name, prefixes and capabilities and implement models(),
+    stream() and complete(). Options passed to stream() and complete() are:
+
+        temperature (float), max_completion_tokens (int),
+        web_search (bool), citations (bool), cancel (cancellation.CancelToken)
+
+    Options a provider has no capability for are ignored. Once the cancel
+    token is cancelled, the upstream call is aborted and Cancelled raised.
+    Timeouts come from the provider's upstream_timeouts.UpstreamTimeouts.
+    """
+
+    name = None
+    # Model id prefixes routed to this provider
+    prefixes = ()
+    capabilities = {
+        'streaming': True,
+        'vision': False,
+        'reasoning': False,
+        'web_search': False,
+        'citations': False,
+        # Streams can be raced by the hedger (open_stream() returns a requests.Response)
+        'hedging': False
+    }
+
+    def handles(self, model):
+        return (model or '').startswith(self.prefixes)
+
+    def models(self):
+        """Returns catalog entries in the shape of the Venice /models data"""
+        raise NotImplementedError
+
+    def stream(self, model, messages, options):
+        """
+        Starts a streaming chat completion
+
+        Returns:
+            iterator: StreamEvents, ending with DONE when the stream completed
+
+        Raises:
+            ProviderError: If the provider rejects or fails the call
+            Cancelled: If the cancel option was cancelled
+        """
+        raise NotImplementedError
+
+    def complete(self, model, messages, options, call, timer=None):
+        """
+        Returns a complete chat reply
+
+        Args:
+            model (str): Model id
+            messages (list): Chat history
+            options (dict): Generation options
+            call (str): Metrics label for the kind of call
+            timer (metrics.UpstreamTimer, optional): Receives the first byte
+
+        Returns:
+            dict: {'content': str, 'usage': dict}
+
+        Raises:
+            ProviderError: If the provider rejects or fails the call
+            Cancelled: If the cancel option was cancelled
+        """
+        raise NotImplementedError
+
+    def describe(self):
+        return {'name': self.name, 'prefixes': list(self.prefixes), 'capabilities': self.capabilities}
+
+
+class VeniceProvider(Provider):
+    """
+    The Venice API, paced by the upstream governor over a pooled session
+
+    Args:
+        base_url (str): API base URL
+        governor (upstream_governor.UpstreamGovernor): Paces and retries model calls
+        image_store (image_store.ImageStore): Resolves stored image references in bodies
+        timeouts (upstream_timeouts.UpstreamTimeouts): Timeout policies and stall watchdog
+        pool_size (int): Connections kept open to the API
+    """
+
+    name = 'venice'
+    capabilities = {
+        'streaming': True,
+        'vision': True,
+        'reasoning': True,
+        'web_search': True,
+        'citations': True,
+        'hedging': True
+    }
+
+    def __init__(self, base_url, governor, image_store, timeouts, pool_size=32):
+        self.base_url = base_url.rstrip('/')
+        self.governor = governor
+        self.image_store = image_store
+        self.timeouts = timeouts
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def headers(self):
+        return {
+            "Authorization": f"Bearer {os.getenv('VENICE_API_KEY')}",
+            "Content-Type": "application/json"
+        }
+
+    def get(self, path, **kwargs):
+        """Sends an unpaced GET (catalog lookups) to the API"""
+        return self.session.get(f"{self.base_url}{path}", headers=self.headers(), **kwargs)
+
+    def post(self, model, call, path, **kwargs):
+        """Sends a POST for a model through the governor; see UpstreamGovernor.post()"""
+        return self.governor.post(model, call, f"{self.base_url}{path}", session=self.session,
+                                  headers=self.headers(), **kwargs)
+
+    def handles(self, model):
+        return True
+
+    def models(self):
+        response = self.get('/models', timeout=30)
+        response.raise_for_status()
+        return response.json()['data']
+
+    def payload(self, model, messages, options, stream):
+        """Builds a /chat/completions body"""
+        venice_parameters = {
+            "include_venice_system_prompt": False
+        }
+        if options.get('web_search'):
+            venice_parameters["enable_web_search"] = "on"
+            venice_parameters["enable_web_citations"] = bool(options.get('citations'))
+            if stream and options.get('citations'):
+                venice_parameters["include_search_results_in_stream"] = True
+
+        return {
+            "model": model,
+            "messages": messages,
+            "venice_parameters": venice_parameters,
+            "max_completion_tokens": options.get('max_completion_tokens', 8000),
+            "temperature": options.get('temperature', 0.7),
+            "stream": stream
+        }
+
+    def open_stream(self, model, messages, options):
+        """
+        Sends a streaming completion request
+
+        Returns:
+            requests.Response: The response, body not yet read
+        """
+        if options.get('cancel') is not None:
+            options['cancel'].check()
+        payload = self.payload(model, messages, options, stream=True)
+        logger.debug("Sending streaming request to Venice for %s: %s", model, log_pipeline.Payload(payload))
+        return self.post(model, 'stream', '/chat/completions',
+                         data=encode_json_body(self.image_store, payload),
+                         timeout=self.timeouts.policy(model).requests_timeout, stream=True)
+
+    @staticmethod
+    def check(response):
+        """Raises ProviderError for an error response, closing it"""
+        if response.ok:
+            return
+        logger.error(f"Venice API error: Status {response.status_code}")
+        logger.error(f"Response content: {response.text}")
+        response.close()
+        raise ProviderError(f"API error: {response.status_code}", f"http_{response.status_code}")
+
+    def events(self, model, response, lines, cancel=None, call='stream'):
+        """
+        Parses the lines read from a streaming response under the watchdog
+
+        The response is closed when the lines end, on cancel, or when the
+        watchdog finds it stalled; its first-byte clock starts now.
+        """
+        watch = self.timeouts.watch(model, call, cancel=cancel)
+        return watched(watch, venice_events(guarded(watch.token, response, lines)))
+
+    def stream(self, model, messages, options):
+        # Connects before returning, so the caller can time the connect separately from the first token
+        response = self.open_stream(model, messages, options)
+        self.check(response)
+        return self.events(model, response, response.iter_lines(), options.get('cancel'))
+
+    def complete(self, model, messages, options, call, timer=None):
+        # Streamed and assembled here: a non-streaming reply only sends headers once it is fully generated,
+        # so there is no connection to close (and no generation to stop) while the model is still working
+        cancel = options.get('cancel')
+        if cancel is not None:
+            cancel.check()
+        payload = self.payload(model, messages, options, stream=True)
+        content = []
+        usage = {}
+        try:
+            response = self.post(model, call, '/chat/completions',
+                                 data=encode_json_body(self.image_store, payload),
+                                 timeout=self.timeouts.policy(model).requests_timeout,
+                                 stream=True)
+            with response:
+                if not response.ok:
+                    raise ProviderError(f"{response.status_code} - {response.text}",
+                                        f"http_{response.status_code}")
+                for event in self.events(model, response, response.iter_lines(), cancel, call):
+                    if timer:
+                        timer.first_byte()
+                    if event.kind == StreamEvent.CONTENT:
+                        content.append(event.value)
+                    elif event.kind == StreamEvent.USAGE:
+                        usage = event.value
+        except requests.exceptions.Timeout as e:
+            raise ProviderError(f"Timeout error for {model}", 'timeout') from e
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            raise ProviderError(str(e), 'connection') from e
+
+        if not content:
+            raise ProviderError(f"No response from {model}", 'empty')
+        return {'content': ''.join(content), 'usage': usage}
+
+
+class GoogleProvider(Provider):
+    """
+    Gemini models through GoogleAIHandler
+
+    Args:
+        handler (google_ai_handler.GoogleAIHandler): Holds the shared genai client
+        model_ids (list): Models offered in the catalog
+        timeouts (upstream_timeouts.UpstreamTimeouts): Timeout policies and stall watchdog
+    """
+
+    name = 'google'
+    prefixes = ('gemini-',)
+    capabilities = {
+        'streaming': True,
+        'vision': True,
+        'reasoning': True,
+        'web_search': False,
+        'citations': False,
+        'hedging': False
+    }
+
+    def __init__(self, handler, model_ids, timeouts):
+        self.handler = handler
+        self.model_ids = model_ids
+        self.timeouts = timeouts
+
+    @classmethod
+    def from_env(cls, image_store, timeouts):
+        """Builds the provider from GOOGLE_API_KEY and GOOGLE_MODELS, or returns None without a key"""
+        if not os.getenv('GOOGLE_API_KEY'):
+            return None
+        from google_ai_handler import GoogleAIHandler, DEFAULT_MODELS
+        model_ids = [m.strip() for m in os.getenv('GOOGLE_MODELS', DEFAULT_MODELS).split(',') if m.strip()]
+        # Gemini models all report reasoning, so their reads get the reasoning limit as a socket backstop
+        read_timeout = timeouts.policies['reasoning'].requests_timeout[1]
+        return cls(GoogleAIHandler(timeout=read_timeout, image_store=image_store), model_ids, timeouts)
+
+    def models(self):
+        return [{
+            'id': model,
+            'type': 'text',
+            'owned_by': 'google',
+            'model_spec': {
+                'name': model,
+                'provider': self.name,
+                'capabilities': {'supportsVision': True, 'supportsReasoning': True}
+            }
+        } for model in self.model_ids]
+
+    def _events(self, model, messages, options, cancel):
+        kinds = {'content': StreamEvent.CONTENT, 'reasoning_content': StreamEvent.REASONING,
+                 'usage': StreamEvent.USAGE, 'error': StreamEvent.ERROR}
+        chunks = self.handler.stream(messages, model, options.get('temperature', 0.7),
+                                     options.get('max_completion_tokens'))
+        try:
+            for chunk in chunks:
+                # The genai client owns its connection, so a cancel or stall takes effect between chunks
+                cancel.check()
+                for key, value in chunk.items():
+                    yield StreamEvent(kinds[key], value)
+        except Exception as e:
+            reason = self.handler.failure_reason(e)
+            if reason:
+                raise ProviderError(str(e), reason) from e
+            raise
+        finally:
+            chunks.close()
+        yield StreamEvent(StreamEvent.DONE)
+
+    def stream(self, model, messages, options, call='stream'):
+        watch = self.timeouts.watch(model, call, cancel=options.get('cancel'))
+        return watched(watch, self._events(model, messages, options, watch.token))
+
+    def complete(self, model, messages, options, call, timer=None):
+        content = []
+        usage = {}
+        for event in self.stream(model, messages, options, call):
+            if timer:
+                timer.first_byte()
+            if event.kind == StreamEvent.CONTENT:
+                content.append(event.value)
+            elif event.kind == StreamEvent.USAGE:
+                usage = event.value
+            elif event.kind == StreamEvent.ERROR:
+                raise ProviderError(event.value, 'error')
+        if not content:
+            raise ProviderError(f"No response from {model}", 'empty')
+        return {'content': ''.join(content), 'usage': usage}
+
+
+class ProviderRegistry:
+    """
+    Routes models to providers by id prefix
+
+    Args:
+        default (Provider): Provider for models no other provider claims
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self._providers = []
+
+    def register(self, provider):
+        if provider is not None:
+            self._providers.append(provider)
+        return provider
+
+    def for_model(self, model):
+        for provider in self._providers:
+            if provider.handles(model):
+                return provider
+        return self.default
+
+    def all(self):
+        return [self.default] + self._providers
+
+    def catalog(self):
+        """Returns the model catalog of every provider"""
+        models = []
+        for provider in self.all():
+            models.extend(provider.models())
+        return models
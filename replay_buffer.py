@@ -0,0 +1,276 @@
+"""
+Resumable SSE streams
+
+Each chat stream gets an id and every frame a sequence number, sent as the
+SSE ``id: <stream id>:<seq>`` field. The frames are produced by a background
+thread into a bounded per-stream ring buffer, so when the client's connection
+drops the answer keeps arriving from upstream for a grace period. A reconnect
+that sends the last id it saw as ``Last-Event-ID`` is served the missed frames
+from the buffer and then follows the live stream, instead of paying for the
+whole completion again.
+
+Streams live in the memory of the worker that started them; reconnects need
+to reach the same worker (sticky sessions) to resume.
+
+A stream nobody reads is not worth paying for: when no client has been
+attached for the cancel grace period, or the client stops the stream, its
+CancelToken is cancelled and the upstream request aborted. Idle readers get an
+SSE comment every few seconds, so a client that vanished while the upstream
+was silent is noticed at the next write rather than at the next token.
+"""
+
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Seconds without frames after which a reader is sent a keepalive comment
+KEEPALIVE_INTERVAL = 5.0
+
+
+class ResumeError(Exception):
+    """Raised when a stream cannot be resumed from the requested position"""
+
+    def __init__(self, message, status_code):
+        self.message = message
+        self.status_code = status_code
+        super().__init__(message)
+
+
+def parse_event_id(event_id):
+    """
+    Splits a Last-Event-ID value into stream id and sequence number
+
+    Returns:
+        tuple: (stream_id, seq)
+
+    Raises:
+        ResumeError: If the value is malformed
+    """
+    stream_id, _, seq = (event_id or '').strip().rpartition(':')
+    if not stream_id or not seq.isdigit():
+        raise ResumeError('Invalid Last-Event-ID', 400)
+    return stream_id, int(seq)
+
+
+class ReplayStream:
+    """
+    Frames of one stream, produced in the background and kept in a ring buffer
+
+    Args:
+        stream_id (str): Public id of the stream
+        frames (generator): SSE frames ("data: ...\\n\\n") to produce
+        capacity (int): Frames kept for replay
+        grace (float): Seconds production continues with no client attached
+        cancel (cancellation.CancelToken, optional): Token the frames' producer
+            watches; cancelled by cancel() and once no client has been
+            attached for cancel_grace seconds
+        cancel_grace (float, optional): Defaults to grace
+    """
+
+    def __init__(self, stream_id, frames, capacity, grace, cancel=None, cancel_grace=None):
+        self.id = stream_id
+        self.capacity = capacity
+        self.grace = grace
+        self.cancel_token = cancel
+        self.cancel_grace = grace if cancel_grace is None else cancel_grace
+        self.buffer = deque(maxlen=capacity)
+        self.next_seq = 1
+        self.finished_at = None
+        self.readers = 0
+        self.detached_at = time.monotonic()
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._produce, args=(frames,), name=f"stream-{stream_id[:8]}",
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    def _produce(self, frames):
+        try:
+            for frame in frames:
+                with self._cond:
+                    self.buffer.append((self.next_seq, frame))
+                    self.next_seq += 1
+                    self._cond.notify_all()
+                    if self.readers == 0 and time.monotonic() - self.detached_at > self.grace:
+                        logger.info(f"Stream {self.id} abandoned, no client for {self.grace:.0f}s")
+                        break
+        except Exception as e:
+            logger.exception(f"Stream {self.id} producer failed: {str(e)}")
+        finally:
+            frames.close()
+            with self._cond:
+                self.finished_at = time.monotonic()
+                self._cond.notify_all()
+
+    def cancel(self, reason):
+        """
+        Stops the stream's upstream work; readers get the frames produced so far
+
+        Returns:
+            bool: False if there was nothing left to cancel
+        """
+        if self.cancel_token is None or self.finished:
+            return False
+        logger.info(f"Stream {self.id} cancelled: {reason}")
+        return self.cancel_token.cancel(reason)
+
+    def _cancel_if_detached(self):
+        with self._cond:
+            detached = self.readers == 0 and not self.finished and \
+                time.monotonic() - self.detached_at >= self.cancel_grace
+        if detached:
+            self.cancel('client_gone')
+
+    def first_seq(self):
+        """Sequence number of the oldest frame still buffered"""
+        return self.buffer[0][0] if self.buffer else self.next_seq
+
+    def can_resume(self, last_seq):
+        """Returns True if every frame after last_seq is still available"""
+        with self._cond:
+            return last_seq + 1 >= self.first_seq() and last_seq < self.next_seq
+
+    def expired(self, now):
+        with self._cond:
+            return self.readers == 0 and self.finished and now - self.finished_at > self.grace
+
+    def sse(self, last_seq=0):
+        """
+        Yields the frames after last_seq as SSE events with ids, following the live stream
+
+        Frames that are already buffered when the reader catches up are
+        yielded together as one chunk, so a burst costs one write (and one
+        compression flush) instead of one per token. A reader that waited
+        KEEPALIVE_INTERVAL seconds for a frame is sent an SSE comment, which
+        the client ignores and a dead connection fails to take.
+
+        Args:
+            last_seq (int): Last sequence number the client has seen (0 for all)
+        """
+        with self._cond:
+            self.readers += 1
+        seq = last_seq
+        try:
+            while True:
+                with self._cond:
+                    if not self.finished and (not self.buffer or self.buffer[-1][0] <= seq):
+                        self._cond.wait(timeout=KEEPALIVE_INTERVAL)
+                    if seq + 1 < self.first_seq():
+                        # The client fell further behind than the buffer reaches
+                        logger.warning(f"Stream {self.id} reader lost frames {seq + 1}-{self.first_seq() - 1}")
+                        return
+                    pending = [(s, frame) for s, frame in self.buffer if s > seq]
+                    if not pending and self.finished:
+                        return
+                if pending:
+                    yield ''.join(f"id: {self.id}:{s}\n{frame}" for s, frame in pending)
+                    seq = pending[-1][0]
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            with self._cond:
+                self.readers -= 1
+                detached = self.readers == 0 and not self.finished
+                if detached:
+                    self.detached_at = time.monotonic()
+            if detached and self.cancel_token is not None:
+                timer = threading.Timer(self.cancel_grace, self._cancel_if_detached)
+                timer.daemon = True
+                timer.start()
+
+
+class StreamRegistry:
+    """
+    Live and recently finished streams of this process
+
+    Args:
+        capacity (int): Frames buffered per stream
+        grace (float): Seconds a stream keeps producing without a client, and
+            is kept for reconnects after it finished
+        cancel_grace (float, optional): Seconds without a client after which
+            the upstream work of a stream opened with a cancel token is
+            cancelled (default: grace)
+    """
+
+    def __init__(self, capacity=4096, grace=60.0, cancel_grace=None):
+        self.capacity = capacity
+        self.grace = grace
+        self.cancel_grace = grace if cancel_grace is None else cancel_grace
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def open(self, frames, cancel=None):
+        """
+        Starts producing a stream in the background
+
+        Args:
+            frames (generator): SSE frames of the response
+            cancel (cancellation.CancelToken, optional): Token that stops the
+                frames' upstream work
+
+        Returns:
+            ReplayStream: The new stream; serve it with stream.sse()
+        """
+        self.cleanup()
+        stream = ReplayStream(secrets.token_urlsafe(16), frames, self.capacity, self.grace, cancel,
+                              self.cancel_grace)
+        with self._lock:
+            self._streams[stream.id] = stream
+        return stream.start()
+
+    def resume(self, event_id):
+        """
+        Looks up a stream for a reconnect
+
+        Args:
+            event_id (str): The Last-Event-ID sent by the client
+
+        Returns:
+            tuple: (ReplayStream, last seq seen by the client)
+
+        Raises:
+            ResumeError: 404 if the stream is unknown or expired, 410 if the
+                missed frames are no longer buffered
+        """
+        stream_id, seq = parse_event_id(event_id)
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None or stream.expired(time.monotonic()):
+            raise ResumeError('Stream not found or expired', 404)
+        if not stream.can_resume(seq):
+            raise ResumeError('Stream can no longer be resumed from this point', 410)
+        return stream, seq
+
+    def cancel(self, stream_id, reason='stopped'):
+        """
+        Cancels a live stream's upstream work
+
+        Raises:
+            ResumeError: 404 if the stream is unknown or expired
+        """
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None or stream.expired(time.monotonic()):
+            raise ResumeError('Stream not found or expired', 404)
+        return stream.cancel(reason)
+
+    def cleanup(self):
+        """Drops finished streams whose grace period has passed"""
+        now = time.monotonic()
+        with self._lock:
+            for stream_id in [sid for sid, stream in self._streams.items() if stream.expired(now)]:
+                del self._streams[stream_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._streams)
@@ -0,0 +1,133 @@
+"""
+Production entry point for WugaBot
+
+Runs the Flask app under gunicorn with preforked workers that share the app
+loaded once in the master (preload_app). Configuration comes from the
+environment:
+
+    PORT              Port to bind (default: 5000)
+    WORKER_CLASS      'gthread' (threaded, default) or 'gevent' (cooperative,
+                      for many concurrent SSE streams)
+    WEB_CONCURRENCY   Worker processes (default: one per CPU core, at least 2)
+    WORKER_THREADS    Threads per gthread worker (default: 16)
+    WORKER_CONNECTIONS  Concurrent connections per gevent worker (default: 500)
+    GRACEFUL_TIMEOUT  Seconds in-flight requests get to finish on shutdown (default: 360)
+
+On SIGTERM each worker stops accepting connections, /chat/stream and
+/chat/expert start answering 503, and streams already running are allowed to
+finish within GRACEFUL_TIMEOUT.
+
+Usage:
+    python serve.py
+"""
+
+import os
+import shutil
+import signal
+import logging
+import tempfile
+
+WORKER_CLASS = os.getenv('WORKER_CLASS', 'gthread')
+
+if WORKER_CLASS == 'gevent':
+    # Patch before requests/urllib3 are imported by the preloaded app
+    from gevent import monkey
+    monkey.patch_all()
+
+# Must exist before prometheus_client is imported so every worker writes shared metric files;
+# files left over from a previous run are cleared (only when starting the server, not when the
+# extraction pool's forkserver re-imports this module as __mp_main__)
+METRICS_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'wugabot-metrics'))
+if __name__ == '__main__':
+    shutil.rmtree(METRICS_DIR, ignore_errors=True)
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+from gunicorn.app.base import BaseApplication
+from prometheus_client import multiprocess
+
+import lazy_imports
+import lifecycle
+
+logger = logging.getLogger(__name__)
+
+
+def default_workers():
+    """Returns one worker per available core, at least two"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    return max(2, cores)
+
+
+def post_worker_init(worker):
+    """Starts draining the app as soon as the worker receives SIGTERM"""
+    handle_exit = worker.handle_exit
+
+    def drain_then_exit(sig, frame):
+        lifecycle.begin_drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain_then_exit)
+
+
+def worker_exit(server, worker):
+    remaining = lifecycle.active_requests()
+    if remaining:
+        logger.warning(f"Worker {worker.pid} exiting with {remaining} request(s) still in flight")
+    else:
+        logger.info(f"Worker {worker.pid} drained cleanly")
+
+
+def child_exit(server, worker):
+    """Drops the live gauges of a worker that has exited"""
+    multiprocess.mark_process_dead(worker.pid)
+
+
+class WugaBotApplication(BaseApplication):
+    """gunicorn application serving the preloaded Flask app"""
+
+    def __init__(self, options=None):
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        # Import heavy dependencies in the master before forking so every worker shares them
+        prewarm = os.getenv('PREWARM_IMPORTS', '1') == '1'
+        os.environ['PREWARM_IMPORTS'] = '0'
+        from main import app
+        if prewarm:
+            lazy_imports.prewarm()
+        return app
+
+
+def build_options():
+    """Builds gunicorn settings from the environment"""
+    options = {
+        'bind': f"0.0.0.0:{os.getenv('PORT', '5000')}",
+        'workers': int(os.getenv('WEB_CONCURRENCY', default_workers())),
+        'worker_class': WORKER_CLASS,
+        'preload_app': True,
+        'graceful_timeout': int(os.getenv('GRACEFUL_TIMEOUT', '360')),
+        # Workers heartbeat from their main loop, so this only catches hung workers, not slow streams
+        'timeout': int(os.getenv('WORKER_TIMEOUT', '60')),
+        'keepalive': 5,
+        'accesslog': '-',
+        'post_worker_init': post_worker_init,
+        'worker_exit': worker_exit,
+        'child_exit': child_exit,
+    }
+    if WORKER_CLASS == 'gevent':
+        options['worker_connections'] = int(os.getenv('WORKER_CONNECTIONS', '500'))
+    else:
+        options['threads'] = int(os.getenv('WORKER_THREADS', '16'))
+    return options
+
+
+if __name__ == '__main__':
+    WugaBotApplication(build_options()).run()
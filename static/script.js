@@ -20,6 +20,24 @@ let botContentBuffer = "";
 /** @type {Array|null} - Stores citations from the latest response with web search */
 let lastCitations = null;
 
+/** @type {string|null} - Id of the server-side conversation the chat is stored in */
+let conversationId = localStorage.getItem('conversationId');
+
+/** @type {string|null} - Cursor of the page before the oldest loaded message, null once all are loaded */
+let olderMessagesCursor = null;
+
+/** @type {boolean} - Whether an older page of history is being fetched */
+let loadingOlderMessages = false;
+
+/** @type {Promise} - Serializes conversation writes so messages are stored in order */
+let persistQueue = Promise.resolve();
+
+/** @type {number} - Messages fetched per page of conversation history */
+const HISTORY_PAGE_SIZE = 50;
+
+/** @type {Object|null} - Last uploaded document that was digested ({id, name, pages}), for /pages */
+let lastDocument = JSON.parse(localStorage.getItem('lastDocument') || 'null');
+
 /**
  * Fetches available AI models from the server
  * Populates dropdown menus with the retrieved models
@@ -137,27 +155,8 @@ window.addEventListener('load', () => {
         document.body.style.transform = 'translateZ(0)';
     }
 
-    // Load chat history from localStorage if available
-    try {
-        const savedChatHistory = localStorage.getItem('chatHistory');
-        if (savedChatHistory) {
-            const parsedHistory = JSON.parse(savedChatHistory);
-            if (Array.isArray(parsedHistory)) {
-                chatHistory.length = 0; // Clear existing history
-                parsedHistory.forEach(msg => chatHistory.push(msg));
-                console.log("📂 Loaded chat history from localStorage with", chatHistory.length, "messages");
-
-                // Restore chat display from history
-                chatHistory.forEach(msg => {
-                    if (msg.role === 'user' || msg.role === 'assistant') {
-                        appendMessage(msg.content, msg.role);
-                    }
-                });
-            }
-        }
-    } catch (e) {
-        console.warn("Could not load chat history from localStorage:", e);
-    }
+    // Load the most recent page of the stored conversation; older pages load on scroll
+    loadConversation();
 
     // Load saved settings
     const savedPrompt = localStorage.getItem('systemPrompt');
@@ -464,56 +463,167 @@ function initEventListeners() {
     }
 }
 
-async function handleFileUpload(event) {
-    const file = event.target.files[0];
-    if (!file) return;
+/**
+ * Uploads one file for text extraction
+ *
+ * @async
+ * @param {File} file - The file to extract
+ * @returns {Promise<Object>} {name, text, document} as returned by /process_file
+ */
+async function uploadFile(file) {
+    const formData = new FormData();
+    formData.append('file', file);
 
-    if (file.size > 2 * 1024 * 1024) {
-        alert('File too large. Maximum size is 2MB');
-        return;
+    const response = await fetch('/process_file', {
+        method: 'POST',
+        body: formData,
+        headers: {
+            'Accept': 'application/json'
+        }
+    });
+
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    const data = await response.json();
+    if (data.error) {
+        throw new Error(data.error);
     }
+    return { name: file.name, text: data.text, document: data.document };
+}
 
+/**
+ * Uploads several files or ZIP archives at once; the server extracts them in
+ * parallel and reports each file as soon as it is done
+ *
+ * @async
+ * @param {File[]} files - Files and archives to extract
+ * @param {function(string)} showStatus - Shows upload progress
+ * @returns {Promise<{documents: Object[], notes: string[]}>} Extracted files
+ *   ({name, text, document}) in upload order, and notes on skipped, duplicate and failed files
+ */
+async function uploadFileBatch(files, showStatus) {
     const formData = new FormData();
-    formData.append('file', file);
+    files.forEach(file => formData.append('files', file));
 
-    try {
-        const response = await fetch('/process_file', {
-            method: 'POST',
-            body: formData,
-            headers: {
-                'Accept': 'application/json'
+    showStatus(`Uploading ${files.length} files...`);
+    const response = await fetch('/process_files', { method: 'POST', body: formData });
+    if (!response.ok) {
+        let message = `HTTP error! status: ${response.status}`;
+        try {
+            message = (await response.json()).error || message;
+        } catch (e) {
+            // Not a JSON error body
+        }
+        throw new Error(message);
+    }
+
+    const results = [];
+    const notes = [];
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let pendingLine = '';
+    let done = 0;
+
+    while (true) {
+        const { value, done: finished } = await reader.read();
+        if (finished) break;
+        const lines = (pendingLine + decoder.decode(value, { stream: true })).split('\n');
+        pendingLine = lines.pop();
+
+        for (const line of lines) {
+            if (!line.startsWith('data: {')) continue;
+            const event = JSON.parse(line.slice(6));
+            if (event.summary) {
+                console.log('Batch upload summary:', event.summary);
+                continue;
             }
-        });
-
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+            const file = event.file;
+            done++;
+            if (file.status === 'extracted' || file.status === 'cached') {
+                results[file.index] = { name: file.name, text: file.text, document: file.document };
+            } else if (file.status === 'duplicate') {
+                notes.push(`${file.name} is the same file as ${file.duplicate_of}`);
+            } else {
+                notes.push(`${file.name}: ${file.error}`);
+            }
+            showStatus(`Extracted ${done} files: ${file.name}`);
         }
+    }
+    return { documents: results.filter(Boolean), notes };
+}
 
-        const data = await response.json();
-        if (data.error) {
-            alert(data.error);
-            return;
-        }
+async function handleFileUpload(event) {
+    const files = Array.from(event.target.files);
+    if (!files.length) return;
 
-        // Add success notification
-        const imagePreview = document.getElementById('imagePreview');
+    // Several files or an archive go to the batch endpoint, which extracts them in parallel
+    const batch = files.length > 1 || files[0].name.toLowerCase().endsWith('.zip');
+    if (!batch && files[0].size > 2 * 1024 * 1024) {
+        alert('File too large. Maximum size is 2MB');
+        return;
+    }
+
+    const imagePreview = document.getElementById('imagePreview');
+    const showFileStatus = (text) => {
         imagePreview.innerHTML = `
             <div style="display: flex; align-items: center; gap: 8px;">
                 <i class="fas fa-file-check" style="font-size: 24px; color: #4CAF50;"></i>
-                <span style="color: #4CAF50;">File uploaded successfully</span>
+                <span style="color: #4CAF50;">${text}</span>
             </div>
         `;
+    };
+
+    try {
+        const { documents, notes } = batch ? await uploadFileBatch(files, showFileStatus)
+            : { documents: [await uploadFile(files[0])], notes: [] };
+        if (!documents.length) {
+            alert(`No text could be extracted:\n${notes.join('\n')}`);
+            return;
+        }
+
+        // Add success notification
+        showFileStatus(documents.length > 1 ? `${documents.length} files uploaded successfully` : 'File uploaded successfully');
 
         // Update messages with the extracted text
         const userMessage = document.getElementById('userInput').value;
-        const fileMessage = `📎 File: ${file.name}`;
+        const fileLabels = [];
+        let fileContent = '';
+
+        for (const data of documents) {
+            let label = data.name;
+            let content = `\n\nFile contents${documents.length > 1 ? ` (${data.name})` : ''}:\n` + data.text;
+
+            // Documents too large for the context window are sent as a digest; pages can be pulled in with /pages
+            if (data.document && data.document.digest_recommended) {
+                showFileStatus(`Digesting ${data.name} (${data.document.pages} pages)...`);
+                const model = document.getElementById('modelSelect').value;
+                const digest = await runJob('document_digest', { document: data.document.id, model },
+                    `/documents/${data.document.id}/digest`, (progress) => {
+                        const step = progress.phase === 'map' ? 'Summarizing' : `Merging summaries (level ${progress.level})`;
+                        showFileStatus(`${data.name} - ${step}: ${progress.completed}/${progress.total}`);
+                    });
+                lastDocument = { id: data.document.id, name: data.name, pages: data.document.pages };
+                localStorage.setItem('lastDocument', JSON.stringify(lastDocument));
+                label += ` (digest of ${data.document.pages} pages; use /pages 3-5 to add full pages)`;
+                content = `\n\nFile contents${documents.length > 1 ? ` (${data.name})` : ''} ` +
+                    `(digest of ${data.document.pages} pages, with page references):\n` + digest.digest;
+                showFileStatus('File digested');
+            }
+            fileLabels.push(label);
+            fileContent += content;
+        }
 
-        chatHistory.push({
-            role: 'user',
-            content: userMessage + '\n\nFile contents:\n' + data.text
-        });
+        recordMessage('user', userMessage + fileContent, documents.map(data => ({
+            kind: 'file', ref: data.document ? data.document.id : data.name, name: data.name
+        })));
 
         // Show the user message and file info in the chat
+        let fileMessage = fileLabels.length > 1 ? `📎 Files:\n${fileLabels.join('\n')}` : `📎 File: ${fileLabels[0]}`;
+        if (notes.length) {
+            fileMessage += `\nNot included:\n${notes.join('\n')}`;
+        }
         appendMessage(userMessage, 'user');
         appendMessage(fileMessage, 'user-file');
 
@@ -522,19 +632,7 @@ async function handleFileUpload(event) {
 
     } catch (error) {
         console.error('Error processing file:', error);
-        console.error('Error details:', error.message);
-        console.error('Response:', error.response);
-
-        let errorMessage = error.message;
-        try {
-            const responseText = await error.response.text();
-            console.error('Response text:', responseText);
-            errorMessage = `Server error: ${responseText}`;
-        } catch (e) {
-            console.error('Could not read response text:', e);
-        }
-
-        alert(`Error processing file: ${errorMessage}`);
+        alert(`Error processing file: ${error.message}`);
     }
 
     // Clear the file input
@@ -729,13 +827,59 @@ function populateModelDropdown(models) {
     updateUI(modelSelect.value);
 }
 
+/**
+ * Reads a blob as a base64 data URL
+ *
+ * @param {Blob} blob - The blob to read
+ * @returns {Promise<string>} - A promise that resolves with the data URL
+ */
+function readAsDataURL(blob) {
+    return new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = (event) => resolve(event.target.result);
+        reader.onerror = (e) => reject(e);
+        reader.readAsDataURL(blob);
+    });
+}
+
+/**
+ * Prepares an image attachment for a chat message
+ * Uploads the original file to the server image store, which normalizes and
+ * deduplicates it, so messages only carry a short reference. Falls back to
+ * inlining a browser-resized data URL if the upload fails.
+ *
+ * @param {File} file - The image file selected by the user
+ * @returns {Promise<{url: string, src: string}>} - Reference for the API and URL for display
+ */
+async function prepareImage(file) {
+    try {
+        const formData = new FormData();
+        formData.append('file', file);
+        const response = await fetch('/image/upload', {
+            method: 'POST',
+            body: formData
+        });
+        const data = await response.json();
+        if (!response.ok || data.error) {
+            throw new Error(data.error || `Upload failed: ${response.status}`);
+        }
+        return { url: data.ref, src: data.url };
+    } catch (error) {
+        console.error('Image upload failed, inlining image instead:', error);
+        const isCameraPhoto = file.name === 'image.jpg'; // heuristic for camera photos
+        // Resize if it's a camera photo or if the file is larger than 2MB
+        const blob = (isCameraPhoto || file.size > 2 * 1024 * 1024) ? await resizeImage(file, 800, 600) : file;
+        const dataUrl = await readAsDataURL(blob);
+        return { url: dataUrl, src: dataUrl };
+    }
+}
+
 // Start streaming data to the chat
 async function startStream() {
     const userInput = document.getElementById('userInput');
-    const message = userInput.value.trim();
+    let message = userInput.value.trim();
     const galleryInput = document.getElementById('galleryInput');
     const cameraInput = document.getElementById('cameraInput');
-    let base64Image = "";
 
     // Log current chat history state before processing
     console.log("Current chat history BEFORE starting stream:", JSON.stringify(chatHistory.map(m => ({
@@ -747,6 +891,11 @@ async function startStream() {
         return;
     }
 
+    if (message.startsWith('/pages')) {
+        message = await expandPagesCommand(message);
+        if (message === null) return;
+    }
+
     // Check if expert mode is enabled
     const expertModeEnabled = document.getElementById('expertModeEnabled').checked;
     const candidateModels = JSON.parse(localStorage.getItem('candidateModels') || '[]');
@@ -755,55 +904,20 @@ async function startStream() {
 
     // Image processing function
     const processImage = async (file) => {
-        const isCameraPhoto = file.name === 'image.jpg'; // heuristic for camera photos
-        // Resize if it's a camera photo or if the file is larger than 2MB
-        if (isCameraPhoto || file.size > 2 * 1024 * 1024) {
-            const resizedBlob = await resizeImage(file, 800, 600);
-            const resizedReader = new FileReader();
-            resizedReader.onload = (event) => {
-                base64Image = event.target.result;
-                if (expertModeEnabled) {
-                    // Display user message first for expert mode
-                    if (message) {
-                        appendMessage(message, 'user');
-                        // Add to chat history
-                        chatHistory.push({
-                            role: 'user',
-                            content: message
-                        });
-                    }
-                    if (base64Image) {
-                        appendMessage(`<img src="${base64Image}" alt="User Uploaded Image" style="max-width: 80%; height: auto;" />`, 'user');
-                    }
-                    fetchExpertResponse(buildMessages(message, base64Image), appendMessage('', 'assistant', true));
-                } else {
-                    submitChat(message, base64Image);
-                }
-            };
-            resizedReader.readAsDataURL(resizedBlob);
+        const image = await prepareImage(file);
+        if (expertModeEnabled) {
+            // Display user message first for expert mode
+            if (message) {
+                appendMessage(message, 'user');
+            }
+            if (image) {
+                appendMessage(`<img src="${image.src}" alt="User Uploaded Image" style="max-width: 80%; height: auto;" />`, 'user');
+            }
+            // Add to chat history
+            recordMessage('user', message, imageAttachments(image));
+            fetchExpertResponse(buildMessages(message, image), appendMessage('', 'assistant', true));
         } else {
-            const reader = new FileReader();
-            reader.onload = (event) => {
-                base64Image = event.target.result;
-                if (expertModeEnabled) {
-                    // Display user message first for expert mode
-                    if (message) {
-                        appendMessage(message, 'user');
-                        // Add to chat history
-                        chatHistory.push({
-                            role: 'user',
-                            content: message
-                        });
-                    }
-                    if (base64Image) {
-                        appendMessage(`<img src="${base64Image}" alt="User Uploaded Image" style="max-width: 80%; height: auto;" />`, 'user');
-                    }
-                    fetchExpertResponse(buildMessages(message, base64Image), appendMessage('', 'assistant', true));
-                } else {
-                    submitChat(message, base64Image);
-                }
-            };
-            reader.readAsDataURL(file);
+            submitChat(message, image);
         }
     };
 
@@ -823,10 +937,7 @@ async function startStream() {
             if (message) {
                 appendMessage(message, 'user');
                 // Add to chat history
-                chatHistory.push({
-                    role: 'user',
-                    content: message
-                });
+                recordMessage('user', message);
             }
             fetchExpertResponse(buildMessages(message, null), appendMessage('', 'assistant', true));
         } else {
@@ -836,14 +947,46 @@ async function startStream() {
     userInput.value = ''; // Clear input after sending
 }
 
+/**
+ * Replaces a "/pages 3-5,9 [question]" command with the full text of those pages
+ * of the last digested document, followed by the question
+ *
+ * @async
+ * @param {string} message - The message starting with /pages
+ * @returns {Promise<string|null>} The expanded message, or null if the pages could not be fetched
+ */
+async function expandPagesCommand(message) {
+    const match = message.match(/^\/pages\s+([\d\s,-]+)([\s\S]*)$/);
+    if (!match || !lastDocument) {
+        appendMessage(lastDocument ? 'Usage: /pages 3-5,9 followed by your question'
+            : 'Upload a large document first; /pages adds full pages of its digest to your message.', 'error');
+        return null;
+    }
+    const spec = match[1].replace(/\s+/g, '');
+    try {
+        const response = await fetch(`/documents/${lastDocument.id}/pages?pages=${encodeURIComponent(spec)}`);
+        const data = await response.json();
+        if (!response.ok || data.error) {
+            throw new Error(data.error || `HTTP error! status: ${response.status}`);
+        }
+        const pages = data.pages.map(page => `--- ${page.label} ---\n${page.text}`).join('\n\n');
+        const question = match[2].trim();
+        return `Full text of ${spec.includes(',') || spec.includes('-') ? 'pages' : 'page'} ${spec} of ${data.name}:\n\n${pages}` +
+            (question ? `\n\n${question}` : '');
+    } catch (error) {
+        appendMessage(`Could not load pages ${spec}: ${error.message}`, 'error');
+        return null;
+    }
+}
+
 /**
  * Builds the message array for the API, including system prompt and chat history.
  *
  * @param {string} message - The user's current message.
- * @param {string|null} base64Image - The base64 encoded image, if any.
+ * @param {{url: string, src: string}|null} image - The prepared image attachment, if any.
  * @returns {Array<Object>} The formatted message array for the API.
  */
-function buildMessages(message, base64Image) {
+function buildMessages(message, image) {
     const systemPrompt = document.getElementById('systemPrompt').value.trim();
     const messages = [];
 
@@ -874,8 +1017,8 @@ function buildMessages(message, base64Image) {
     if (message) {
         userMessageContent.push({ type: 'text', text: message });
     }
-    if (base64Image) {
-        userMessageContent.push({ type: 'image_url', image_url: { url: base64Image } });
+    if (image) {
+        userMessageContent.push({ type: 'image_url', image_url: { url: image.url } });
     }
     if (userMessageContent.length > 0) {
         messages.push({ role: 'user', content: userMessageContent });
@@ -890,24 +1033,20 @@ function buildMessages(message, base64Image) {
  * 
  * @async
  * @param {string} message - The user's text message
- * @param {string} [base64Image] - Optional base64-encoded image data
+ * @param {{url: string, src: string}} [image] - Optional prepared image attachment
  * @returns {Promise<void>}
  */
-async function submitChat(message, base64Image) {
-    if (!message && !base64Image) return;
+async function submitChat(message, image) {
+    if (!message && !image) return;
     const systemPrompt = document.getElementById('systemPrompt').value.trim();
     // Clear lastCitations at the start of each new message
     lastCitations = null;
 
     console.log("BEFORE - Chat history contains:", chatHistory.length, "messages");
 
-    // Store message without image in chat history
+    // Store message in chat history; the image is only kept as a reference to the image store
+    recordMessage('user', message, imageAttachments(image));
     if (message) {
-        // Ensure consistent format for user messages
-        chatHistory.push({
-            role: 'user',
-            content: message
-        });
         console.log("Added user message to chat history");
     }
 
@@ -998,17 +1137,17 @@ async function submitChat(message, base64Image) {
     }
 
     // If image present, add it to the API request but NOT to chatHistory
-    if (base64Image) {
+    if (image) {
         messages.push({
             role: 'user',
-            content: [{ type: 'image_url', image_url: { url: base64Image } }]
+            content: [{ type: 'image_url', image_url: { url: image.url } }]
         });
     }
 
     // Display in UI
     appendMessage(message, 'user');
-    if (base64Image) {
-        appendMessage(`<img src="${base64Image}" alt="User Uploaded Image" style="max-width: 80%; height: auto;" />`, 'user');
+    if (image) {
+        appendMessage(`<img src="${image.src}" alt="User Uploaded Image" style="max-width: 80%; height: auto;" />`, 'user');
     }
 
     document.getElementById('imagePreview').innerHTML = '';
@@ -1128,26 +1267,26 @@ async function fetchExpertResponse(messages, botMessage) {
 
         addLogEntry('Sending research queries to models...');
 
-        const response = await fetch('/chat/expert', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(requestBody)
+        // Runs in the background on the server; candidates are logged as they finish
+        let progressShown = false;
+        const result = await runJob('deep_research', requestBody, '/chat/expert', (event) => {
+            progressShown = true;
+            if (event.phase === 'candidates') {
+                addLogEntry(`Received response from ${event.model}: success=${event.success ? 'True' : 'False'} (${event.completed}/${event.total})`);
+            } else if (event.phase === 'synthesis') {
+                addLogEntry(`Starting synthesis with model: ${event.model}`);
+            }
         });
 
-        if (!response.ok) {
-            const errorText = await response.text();
-            throw new Error(`Expert mode failed: ${response.status} - ${errorText}`);
-        }
-
-        const result = await response.json();
-
-        if (result.error) {
-            throw new Error(result.error);
-        }
+        // Models the server swapped for a healthy fallback
+        const substitutions = result.model_substitutions || {};
+        Object.entries(substitutions).forEach(([requested, used]) => {
+            addLogEntry(`${requested} is unavailable right now, using ${used} instead`);
+        });
 
-        // Log the actual results
-        if (result.candidates) {
-            const completedModels = result.candidates.map(c => c.model);
+        // Log the actual results, unless they were already logged as they happened
+        if (result.candidates && !progressShown) {
+            const completedModels = result.candidates.map(c => c.requested_model || c.model);
             const failedModels = candidateModels.filter(m => !completedModels.includes(m));
             
             completedModels.forEach(model => {
@@ -1159,7 +1298,9 @@ async function fetchExpertResponse(messages, botMessage) {
             });
         }
 
-        addLogEntry(`Starting synthesis with model: ${synthesisModel}`);
+        if (!progressShown) {
+            addLogEntry(`Starting synthesis with model: ${result.synthesis_model || synthesisModel}`);
+        }
         
         // Check if synthesis succeeded or failed
         if (result.synthesized_response && !result.synthesized_response.includes('Synthesis failed') && !result.synthesized_response.includes('Synthesis error')) {
@@ -1211,18 +1352,8 @@ async function fetchExpertResponse(messages, botMessage) {
 
         // Add to chat history (cleaned version for better context in future conversations)
         if (cleanedResponse && cleanedResponse.trim() !== '') {
-            chatHistory.push({
-                role: 'assistant',
-                content: cleanedResponse
-            });
-
-            // Save chat history
-            try {
-                localStorage.setItem('chatHistory', JSON.stringify(chatHistory));
-                console.log("✅ Deep research response saved to chat history");
-            } catch (e) {
-                console.warn("Could not save chat history to localStorage:", e);
-            }
+            recordMessage('assistant', cleanedResponse);
+            console.log("✅ Deep research response saved to chat history");
         }
 
         showLoading(false);
@@ -1235,6 +1366,162 @@ async function fetchExpertResponse(messages, botMessage) {
     }
 }
 
+// Server-side work this page is waiting for, cancelled when the user stops it or leaves the page
+const activeWork = { streamId: null, jobId: null, controller: null };
+
+/**
+ * Cancels the chat stream or background job in progress, so the server stops the upstream model
+ * Requests sent with keepalive still go out while the page is being unloaded.
+ *
+ * @param {boolean} [leaving=false] - Whether the page is being unloaded
+ * @returns {void}
+ */
+function stopActiveWork(leaving = false) {
+    if (activeWork.streamId) {
+        fetch(`/chat/stream/${encodeURIComponent(activeWork.streamId)}`, { method: 'DELETE', keepalive: leaving })
+            .catch(() => {});
+        activeWork.streamId = null;
+    }
+    if (activeWork.jobId) {
+        fetch(`/jobs/${encodeURIComponent(activeWork.jobId)}`, { method: 'DELETE', keepalive: leaving })
+            .catch(() => {});
+        activeWork.jobId = null;
+    }
+    if (activeWork.controller && !leaving) {
+        activeWork.controller.abort();
+    }
+}
+
+window.addEventListener('pagehide', () => stopActiveWork(true));
+document.addEventListener('keydown', (e) => {
+    if (e.key === 'Escape' && (activeWork.streamId || activeWork.jobId)) {
+        stopActiveWork();
+    }
+});
+
+/**
+ * Reconnects to a chat stream whose connection dropped
+ * The server replays the frames after lastEventId and continues the live stream
+ *
+ * @async
+ * @param {string} lastEventId - Last "<stream id>:<seq>" id received
+ * @returns {Promise<Response|null>} The resumed response, or null if the stream cannot be resumed
+ */
+async function resumeStream(lastEventId) {
+    const streamId = lastEventId.slice(0, lastEventId.lastIndexOf(':'));
+    for (let attempt = 0; attempt < 8; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, Math.min(500 * 2 ** attempt, 4000)));
+        try {
+            const response = await fetch(`/chat/stream/${encodeURIComponent(streamId)}`, {
+                headers: { 'Last-Event-ID': lastEventId }
+            });
+            if (response.ok) {
+                console.log('Resumed stream after', lastEventId);
+                return response;
+            }
+            if ([400, 404, 410].includes(response.status)) {
+                console.warn('Stream cannot be resumed:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.warn(`Resume attempt ${attempt + 1} failed:`, error);
+        }
+    }
+    return null;
+}
+
+/**
+ * Runs a long request as a background job on the server and resolves with its result
+ * Progress arrives over server-sent events. EventSource reconnects by itself with
+ * Last-Event-ID while the job keeps running on the server, so a dropped connection
+ * or a proxy timeout does not lose the work. Calls the endpoint directly when the
+ * server has background jobs disabled.
+ *
+ * @async
+ * @param {string} kind - Job kind ('deep_research' or 'image')
+ * @param {Object} params - Request body the direct endpoint takes
+ * @param {string} directUrl - Endpoint to call when background jobs are disabled
+ * @param {Function} [onProgress] - Called with each progress event
+ * @returns {Promise<Object>} The result, as the direct endpoint would return it
+ */
+async function runJob(kind, params, directUrl, onProgress = () => {}) {
+    const postJSON = (url, body) => fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+
+    const response = await postJSON('/jobs', { kind, params });
+    if (response.status === 404) {
+        const direct = await postJSON(directUrl, params);
+        const data = await direct.json();
+        if (!direct.ok || data.error) {
+            throw new Error(data.error || `Request failed: ${direct.status}`);
+        }
+        return data;
+    }
+    const submitted = await response.json();
+    if (!response.ok) {
+        throw new Error(submitted.error || `Job submission failed: ${response.status}`);
+    }
+
+    activeWork.jobId = submitted.id;
+    const job = await new Promise(resolve => {
+        const source = new EventSource(`/jobs/${encodeURIComponent(submitted.id)}/events`);
+        source.onmessage = (event) => {
+            if (event.data === '[DONE]') return;
+            const data = JSON.parse(event.data);
+            if (data.progress) {
+                onProgress(data.progress);
+            }
+            if (data.job) {
+                source.close();
+                resolve(data.job);
+            }
+        };
+        source.onerror = () => {
+            // EventSource retries dropped connections itself; it only gives up when the server refuses one
+            if (source.readyState === EventSource.CLOSED) {
+                resolve(pollJob(submitted.id));
+            }
+        };
+    });
+    if (activeWork.jobId === submitted.id) {
+        activeWork.jobId = null;
+    }
+    if (job.status !== 'succeeded') {
+        throw new Error(job.error || `Job ${job.status}`);
+    }
+    return job.result;
+}
+
+/**
+ * Polls a background job until it has finished
+ *
+ * @async
+ * @param {string} jobId - Job id
+ * @returns {Promise<Object>} The finished job
+ */
+async function pollJob(jobId) {
+    for (;;) {
+        try {
+            const response = await fetch(`/jobs/${encodeURIComponent(jobId)}`);
+            if (response.status === 404) {
+                return { status: 'failed', error: 'The job expired or was lost' };
+            }
+            if (response.ok) {
+                const job = await response.json();
+                if (['succeeded', 'failed', 'cancelled'].includes(job.status)) {
+                    return job;
+                }
+            }
+        } catch (error) {
+            console.warn('Job status check failed, retrying:', error);
+        }
+        await new Promise(resolve => setTimeout(resolve, 2000));
+    }
+}
+
 /**
  * Fetches a response from the chat API based on the provided messages
  * Handles streaming, error handling, and updating the chat history
@@ -1246,6 +1533,9 @@ async function fetchExpertResponse(messages, botMessage) {
  */
 async function fetchChatResponse(messages, botMessage) {
     showLoading(true);
+    let renderer = null;
+    const controller = new AbortController();
+    activeWork.controller = controller;
     try {
         // Store the current model for debugging purposes
         const currentModel = document.getElementById('modelSelect').value;
@@ -1286,7 +1576,8 @@ async function fetchChatResponse(messages, botMessage) {
         const response = await fetch('/chat/stream', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify(requestBody)
+            body: JSON.stringify(requestBody),
+            signal: controller.signal
         });
 
         console.log('Response status:', response.status);
@@ -1296,37 +1587,70 @@ async function fetchChatResponse(messages, botMessage) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
 
+        // Lets the stream be stopped on the server, which also ends the upstream request
+        activeWork.streamId = response.headers.get('X-Stream-Id');
+
         // Clear the buffer at the start of streaming
         botContentBuffer = "";
+        renderer = createStreamRenderer(botMessage);
 
         // Process streaming response
-        const reader = response.body.getReader();
-        const decoder = new TextDecoder();
+        let reader = response.body.getReader();
+        let decoder = new TextDecoder();
         let reasoningContent = null;
+        let pendingLine = '';
+        let lastEventId = null;
+        let resumedFrom = null;
 
         while (true) {
-            const { value, done } = await reader.read();
-            if (done) break;
+            let result;
+            try {
+                result = await reader.read();
+            } catch (readError) {
+                result = { done: true, readError };
+            }
+
+            if (result.done) {
+                // The stream ended without [DONE]: the connection dropped, so pick up where it left off
+                // (only if frames arrived since the last resume, otherwise the server has nothing more)
+                const stopped = controller.signal.aborted;
+                const canResume = !stopped && lastEventId && lastEventId !== resumedFrom;
+                resumedFrom = lastEventId;
+                const resumed = canResume ? await resumeStream(lastEventId) : null;
+                if (!resumed) {
+                    if (result.readError && !stopped) throw result.readError;
+                    break;
+                }
+                reader = resumed.body.getReader();
+                decoder = new TextDecoder();
+                pendingLine = '';
+                continue;
+            }
 
-            const chunk = decoder.decode(value);
-            const lines = chunk.split('\n');
+            // Keep a partial last line until the rest of it arrives
+            const lines = (pendingLine + decoder.decode(result.value, { stream: true })).split('\n');
+            pendingLine = lines.pop();
 
             for (const line of lines) {
+                if (line.startsWith('id: ')) {
+                    lastEventId = line.slice(4).trim();
+                    continue;
+                }
                 if (!line.startsWith('data: ')) continue;
 
                 const data = line.slice(5).trim();
                 if (!data) continue;
 
                 if (data === '[DONE]') {
-                    // Format final content (keeping REF tags for citation references)
-                    let finalContent = formatContent(botContentBuffer);
+                    // Commit the last block (keeping REF tags for citation references)
+                    let footer = '';
 
                     // Add citations if available
                     if (lastCitations && Array.isArray(lastCitations) && lastCitations.length > 0) {
                         console.log('Formatting and appending citations to final content');
                         const citationsHtml = formatCitations(lastCitations);
                         if (citationsHtml && citationsHtml.trim() !== '') {
-                            finalContent += citationsHtml;
+                            footer = citationsHtml;
                             console.log('Citations successfully added to final content');
                         } else {
                             console.error('Citations HTML is empty despite having citations data');
@@ -1337,7 +1661,8 @@ async function fetchChatResponse(messages, botMessage) {
 
                     // Update DOM
                     try {
-                        botMessage.innerHTML = finalContent;
+                        renderer.setFooter(footer);
+                        renderer.finish();
                         console.log('Successfully updated bot message with final content');
                     } catch (e) {
                         console.error('Error updating bot message:', e);
@@ -1350,18 +1675,7 @@ async function fetchChatResponse(messages, botMessage) {
                         console.log("💬 Adding assistant message to history:", botContentBuffer.substring(0, 30) + "...");
 
                         // Add assistant message to chat history - CRITICALLY IMPORTANT
-                        chatHistory.push({
-                            role: 'assistant',
-                            content: botContentBuffer
-                        });
-
-                        // Save the updated chat history to localStorage
-                        try {
-                            localStorage.setItem('chatHistory', JSON.stringify(chatHistory));
-                            console.log("✅ Chat history saved to localStorage with", chatHistory.length, "messages");
-                        } catch (e) {
-                            console.warn("Could not save chat history to localStorage:", e);
-                        }
+                        recordMessage('assistant', botContentBuffer);
 
                         console.log("✅ Assistant message added to chat history");
                         console.log("AFTER - Chat history updated, now contains:", chatHistory.length, "messages");
@@ -1372,7 +1686,6 @@ async function fetchChatResponse(messages, botMessage) {
                         console.log("Next API request will include:\n", nextContextSummary);
                     }
 
-                    Prism.highlightAll();
                     return;
                 }
 
@@ -1416,9 +1729,27 @@ async function fetchChatResponse(messages, botMessage) {
                         return;
                     }
 
+                    // The requested model is unhealthy and the server switched to a fallback
+                    if (parsed.model_substitution) {
+                        const { requested, model, reason } = parsed.model_substitution;
+                        const text = reason === 'hedged'
+                            ? `${requested} was slow to respond, this answer comes from ${model}.`
+                            : `${requested} is unavailable right now, this answer comes from ${model}.`;
+                        const notice = appendMessage(text, 'system', true);
+                        botMessage.parentNode.insertBefore(notice, botMessage);
+                        continue;
+                    }
+
+                    // Server-side phase timings, sent once before [DONE]
+                    if (parsed.server_timing) {
+                        console.debug('Server timing (ms):', parsed.server_timing);
+                        continue;
+                    }
+
                     // Handle content from different parts of the response
                     if (parsed.content) {
                         botContentBuffer += parsed.content;
+                        renderer.append(parsed.content);
                     }
 
                     // Handle delta if present (for streaming responses)
@@ -1428,6 +1759,7 @@ async function fetchChatResponse(messages, botMessage) {
                         // Append content from delta
                         if (delta.content) {
                             botContentBuffer += delta.content;
+                            renderer.append(delta.content);
                         }
 
                         // Check for reasoning content
@@ -1468,12 +1800,12 @@ async function fetchChatResponse(messages, botMessage) {
                                 if (processedCitations.length > 0) {
                                     lastCitations = processedCitations;
 
-                                    // Immediately append citations to current content and update display
+                                    // Immediately show citations after the current content
                                     try {
-                                        const currentContent = formatContent(botContentBuffer);
                                         const citationsHtml = formatCitations(lastCitations);
                                         if (citationsHtml) {
-                                            botMessage.innerHTML = currentContent + citationsHtml;
+                                            renderer.setFooter(citationsHtml);
+                                            renderer.flush();
                                         }
                                     } catch (displayError) {
                                         console.error('Error updating display with citations:', displayError);
@@ -1492,20 +1824,11 @@ async function fetchChatResponse(messages, botMessage) {
                         }
                     }
 
-                    // Update the message with all available content
-                    let updatedContent = formatContent(botContentBuffer);
-
                     // Add reasoning content if available and not already in the content
+                    // (citations will be added at the end); the renderer redraws on the next frame
                     if (reasoningContent && !botContentBuffer.includes(reasoningContent)) {
-                        updatedContent = updatedContent +
-                            `<div class="reasoning-content"><strong>Reasoning:</strong><br>${reasoningContent}</div>`;
+                        renderer.setFooter(`<div class="reasoning-content"><strong>Reasoning:</strong><br>${reasoningContent}</div>`);
                     }
-
-                    // Update display (citations will be added at the end)
-                    botMessage.innerHTML = updatedContent;
-
-                    Prism.highlightAll();
-                    scrollToBottom();
                 } catch (e) {
                     if (data !== '[DONE]') {
                         console.log('Skipping malformed JSON chunk:', e.message);
@@ -1577,18 +1900,23 @@ async function fetchChatResponse(messages, botMessage) {
         }
     } catch (error) {
         console.error('Stream error:', error);
-        appendMessage('Failed to connect to chat service. Please try again.', 'error');
+        if (!controller.signal.aborted) {
+            appendMessage('Failed to connect to chat service. Please try again.', 'error');
+        }
 
         // Even on error, add whatever assistant content we received
         if (botContentBuffer && botContentBuffer.trim() !== '') {
-            chatHistory.push({
-                role: 'assistant',
-                content: botContentBuffer
-            });
+            recordMessage('assistant', botContentBuffer);
             console.log("✅ Assistant message added during error recovery");
         }
     } finally {
         showLoading(false);
+        // Commit whatever part of the answer arrived if the stream ended without [DONE]
+        if (renderer) renderer.finish();
+        if (activeWork.controller === controller) {
+            activeWork.streamId = null;
+            activeWork.controller = null;
+        }
 
         // Log the final chat history state
         console.log("FINAL chat history contains:", chatHistory.length, "messages");
@@ -1759,13 +2087,126 @@ function scrollToCitation(citationNumber) {
 
 window.scrollToCitation = scrollToCitation;
 
+/** @type {RegExp} - A complete visualization request in a model reply */
+const VISUALIZATION_TAG_PATTERN = /<generate_visualization\s+type="([^"]+)"\s+data="(.*?)"\s*><\/generate_visualization>/g;
+
 /**
- * Formats the raw text content from the AI into properly formatted HTML
- * Handles markdown formatting, code blocks, reasoning content, and more
- * 
- * @param {string} content - Raw text content from the AI
- * @returns {string} HTML-formatted content ready for display
+ * Renders a streamed reply incrementally
+ *
+ * formatContent() works line by line, except for code fences and <think>
+ * blocks. Text is therefore committed in finished blocks (up to a blank line,
+ * a list item or heading line, a closing fence or </think>), each formatted
+ * once and appended to the message; only the open trailing block is formatted
+ * again as more text arrives. DOM updates are batched to animation frames, so
+ * a long reply costs the same per token as a short one.
+ *
+ * @param {HTMLElement} element - Message element the reply is rendered into
+ * @returns {{append: function(string), setFooter: function(string), flush: function(), finish: function()}}
+ *   append() adds streamed text, setFooter() sets HTML shown after the text
+ *   (reasoning, citations), flush() renders now, finish() commits everything
  */
+function createStreamRenderer(element) {
+    element.innerHTML = '';
+    const committedElement = document.createElement('div');
+    const tailElement = document.createElement('div');
+    const footerElement = document.createElement('div');
+    element.append(committedElement, tailElement, footerElement);
+
+    let text = '';
+    let committed = 0;  // Characters of text already formatted into committedElement
+    let scanned = 0;    // Start of the first line not yet scanned for block boundaries
+    let inFence = false;
+    let inThink = false;
+    let footer = '';
+    let renderedTail = null;
+    let renderedFooter = '';
+    let frame = null;
+
+    // Finds the end of the last finished block among the complete lines received so far
+    function scanBlocks() {
+        let boundary = committed;
+        let lineEnd;
+        while ((lineEnd = text.indexOf('\n', scanned)) !== -1) {
+            const line = text.slice(scanned, lineEnd).trim();
+            scanned = lineEnd + 1;
+            if (inFence) {
+                if (line.startsWith('```')) {
+                    inFence = false;
+                    boundary = scanned;
+                }
+                continue;
+            }
+            if (inThink) {
+                if (line.includes('</think>')) {
+                    inThink = false;
+                    boundary = scanned;
+                }
+                continue;
+            }
+            if (line.startsWith('```')) {
+                inFence = true;
+            } else if (line.includes('<think>') && !line.includes('</think>')) {
+                inThink = true;
+            } else if (!line || /^(- |\d+\. |#{1,3} )/.test(line)) {
+                boundary = scanned;
+            }
+        }
+        return boundary;
+    }
+
+    function commit(end) {
+        if (end <= committed) return;
+        committedElement.insertAdjacentHTML('beforeend', formatContent(text.slice(committed, end)));
+        committed = end;
+    }
+
+    function render() {
+        frame = null;
+        commit(scanBlocks());
+        // Visualizations are requested once their line is committed, not on every re-render of the tail
+        const tail = text.slice(committed).replace(VISUALIZATION_TAG_PATTERN, '');
+        if (tail !== renderedTail) {
+            tailElement.innerHTML = tail ? formatContent(tail) : '';
+            renderedTail = tail;
+        }
+        if (footer !== renderedFooter) {
+            footerElement.innerHTML = footer;
+            renderedFooter = footer;
+        }
+        scrollToBottom();
+    }
+
+    function schedule() {
+        if (frame === null) {
+            frame = requestAnimationFrame(render);
+        }
+    }
+
+    return {
+        append(chunk) {
+            text += chunk;
+            schedule();
+        },
+        setFooter(html) {
+            footer = html || '';
+            schedule();
+        },
+        flush() {
+            if (frame !== null) cancelAnimationFrame(frame);
+            render();
+        },
+        finish() {
+            if (frame !== null) cancelAnimationFrame(frame);
+            frame = null;
+            commit(text.length);
+            tailElement.innerHTML = '';
+            renderedTail = '';
+            footerElement.innerHTML = footer;
+            renderedFooter = footer;
+        }
+    };
+}
+
 /**
  * Formats the raw text content from the AI into properly formatted HTML
  * Handles markdown formatting, code blocks, reasoning content, visualizations and more
@@ -1794,7 +2235,7 @@ function formatContent(content) {
 
     // Check for visualization requests and process them
     // Improved regex pattern to more reliably detect visualization tags with JSON data
-    formatted = formatted.replace(/<generate_visualization\s+type="([^"]+)"\s+data="(.*?)"\s*><\/generate_visualization>/g,
+    formatted = formatted.replace(VISUALIZATION_TAG_PATTERN,
         (match, type, dataStr) => {
             try {
                 console.log("Visualization request detected:", type);
@@ -2178,6 +2619,22 @@ async function generateVisualization(type, data, placeholderId) {
  */
 function appendMessage(content, role, returnElement = false) {
     const chatBox = document.getElementById('chatBox');
+    const messageDiv = createMessageElement(content, role);
+    chatBox.appendChild(messageDiv);
+    if (returnElement) {
+        return messageDiv;
+    }
+    scrollToBottom();
+}
+
+/**
+ * Builds the DOM element for a chat message without inserting it
+ *
+ * @param {string} content - The message content
+ * @param {string} role - The role of the sender
+ * @returns {HTMLElement} The message element
+ */
+function createMessageElement(content, role) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${role}`;
     if (typeof content === 'string') {
@@ -2190,11 +2647,7 @@ function appendMessage(content, role, returnElement = false) {
         }
     }
     messageDiv.innerHTML = content;
-    chatBox.appendChild(messageDiv);
-    if (returnElement) {
-        return messageDiv;
-    }
-    scrollToBottom();
+    return messageDiv;
 }
 
 /**
@@ -2230,13 +2683,222 @@ function initSettingsPanel() {
 function clearChatHistory() {
     chatHistory.length = 0; // Clear the chat history
     document.getElementById('chatBox').innerHTML = ''; // Clear chat display
+    olderMessagesCursor = null;
+
+    // Delete the stored conversation; the next message starts a new one
+    const clearedId = conversationId;
+    conversationId = null;
+    localStorage.removeItem('conversationId');
+    if (clearedId) {
+        persistQueue = persistQueue
+            .then(() => fetch(`/conversations/${encodeURIComponent(clearedId)}`, { method: 'DELETE' }))
+            .then(() => console.log("🧹 Stored conversation deleted"))
+            .catch(e => console.warn("Could not delete stored conversation:", e));
+    }
+}
+
+/**
+ * Returns the attachment references to store with a message for a prepared image
+ * Only image store references are kept; inlined data URLs would bloat the history
+ *
+ * @param {{url: string, src: string}|null} image - The prepared image attachment, if any
+ * @returns {Array<Object>} Attachment references for the conversation store
+ */
+function imageAttachments(image) {
+    return image && image.url.startsWith('image-store://') ? [{ kind: 'image', ref: image.url }] : [];
+}
+
+/**
+ * Adds a message to the chat history and stores it in the server-side conversation
+ *
+ * @param {string} role - 'user' or 'assistant'
+ * @param {string} content - The message text
+ * @param {Array<Object>} [attachments=[]] - Image and file references sent with the message
+ * @returns {void}
+ */
+function recordMessage(role, content, attachments = []) {
+    if (!content && !attachments.length) return;
+    if (content) {
+        chatHistory.push({ role, content });
+    }
+    persistMessages([{ role, content: content || '', attachments }]);
+}
+
+/**
+ * Appends messages to the stored conversation, starting a new one if there is none
+ * Writes are queued so messages are stored in the order they were sent; a failed
+ * write is logged and only costs persistence, never the chat itself
+ *
+ * @param {Array<Object>} messages - Messages with role, content and attachments
+ * @returns {Promise<void>} Resolves when this and all earlier writes are done
+ */
+function persistMessages(messages) {
+    const postJSON = (url, body) => fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+    });
+
+    persistQueue = persistQueue.then(async () => {
+        if (conversationId) {
+            const response = await postJSON(`/conversations/${encodeURIComponent(conversationId)}/messages`, { messages });
+            if (response.ok) return;
+            if (response.status !== 404) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            // The conversation was deleted from another tab; continue in a new one
+        }
+        const response = await postJSON('/conversations', { messages });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        conversationId = (await response.json()).id;
+        localStorage.setItem('conversationId', conversationId);
+    }).catch(error => console.warn('Could not store chat messages:', error));
+    return persistQueue;
+}
+
+/**
+ * Returns the text of stored message content (a string or a list of parts)
+ *
+ * @param {string|Array<Object>} content - Stored message content
+ * @returns {string} The text parts joined
+ */
+function messageText(content) {
+    if (typeof content === 'string') return content;
+    return content.filter(part => part.type === 'text').map(part => part.text).join('\n');
+}
+
+/**
+ * Converts a page of stored messages to chat history entries
+ *
+ * @param {Array<Object>} messages - Messages as returned by the conversation store
+ * @returns {Array<Object>} Entries with role and text content
+ */
+function historyEntries(messages) {
+    return messages
+        .filter(msg => msg.role === 'user' || msg.role === 'assistant')
+        .map(msg => ({ role: msg.role, content: messageText(msg.content) }))
+        .filter(msg => msg.content);
+}
+
+/**
+ * Renders a page of stored messages the way they looked when they were sent
+ *
+ * @param {Array<Object>} messages - Messages as returned by the conversation store
+ * @returns {DocumentFragment} The message elements, ready to insert in one go
+ */
+function historyElements(messages) {
+    const fragment = document.createDocumentFragment();
+    messages.forEach(msg => {
+        if (msg.role !== 'user' && msg.role !== 'assistant') return;
+        const files = msg.attachments.filter(attachment => attachment.kind === 'file');
+        let text = messageText(msg.content);
+        if (files.length) {
+            // File messages carry the extracted text; show the typed message and the file name instead
+            text = text.split('\n\nFile contents:\n')[0];
+        }
+        if (text) {
+            fragment.appendChild(createMessageElement(text, msg.role));
+        }
+        files.forEach(attachment => {
+            fragment.appendChild(createMessageElement(`📎 File: ${attachment.name || attachment.ref}`, 'user-file'));
+        });
+        msg.attachments.forEach(attachment => {
+            const imageId = attachment.kind === 'image' && attachment.ref.replace('image-store://', '');
+            if (imageId && /^[0-9a-f]{32}$/.test(imageId)) {
+                fragment.appendChild(createMessageElement(
+                    `<img src="/image/stored/${imageId}" alt="User Uploaded Image" style="max-width: 80%; height: auto;" />`, 'user'));
+            }
+        });
+    });
+    return fragment;
+}
+
+/**
+ * Opens the stored conversation with its most recent page of messages
+ * Older pages are fetched when the user scrolls to the top of the chat. A chat
+ * saved in localStorage by earlier versions is moved to the server once.
+ *
+ * @async
+ * @returns {Promise<void>}
+ */
+async function loadConversation() {
+    const chatBox = document.getElementById('chatBox');
+    chatBox.addEventListener('scroll', () => {
+        if (chatBox.scrollTop < 200) {
+            loadOlderMessages();
+        }
+    }, { passive: true });
 
-    // Also clear chat history from localStorage
     try {
-        localStorage.removeItem('chatHistory');
-        console.log("🧹 Chat history cleared from localStorage");
+        const legacyHistory = JSON.parse(localStorage.getItem('chatHistory') || 'null');
+        if (!conversationId && Array.isArray(legacyHistory) && legacyHistory.length) {
+            await persistMessages(historyEntries(legacyHistory));
+        }
+        if (conversationId) {
+            localStorage.removeItem('chatHistory');
+        }
     } catch (e) {
-        console.warn("Could not clear chat history from localStorage:", e);
+        console.warn("Could not migrate chat history from localStorage:", e);
+    }
+
+    if (!conversationId) return;
+    try {
+        const response = await fetch(
+            `/conversations/${encodeURIComponent(conversationId)}/messages?limit=${HISTORY_PAGE_SIZE}`);
+        if (response.status === 404) {
+            conversationId = null;
+            localStorage.removeItem('conversationId');
+            return;
+        }
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const page = await response.json();
+        // Messages sent while the page was loading are already in the history and stay after it
+        chatHistory.unshift(...historyEntries(page.messages));
+        chatBox.prepend(historyElements(page.messages));
+        olderMessagesCursor = page.next_cursor;
+        scrollToBottom();
+        console.log("📂 Loaded", page.messages.length, "recent messages of the stored conversation");
+
+        // A first page too short to scroll could never trigger the next one
+        if (chatBox.scrollHeight <= chatBox.clientHeight) {
+            loadOlderMessages();
+        }
+    } catch (e) {
+        console.warn("Could not load the stored conversation:", e);
+    }
+}
+
+/**
+ * Prepends the page of messages before the oldest loaded one
+ * Keeps the scroll position so the messages the user was reading stay in place
+ *
+ * @async
+ * @returns {Promise<void>}
+ */
+async function loadOlderMessages() {
+    if (!olderMessagesCursor || loadingOlderMessages || !conversationId) return;
+    loadingOlderMessages = true;
+    const chatBox = document.getElementById('chatBox');
+    try {
+        const response = await fetch(`/conversations/${encodeURIComponent(conversationId)}/messages` +
+            `?limit=${HISTORY_PAGE_SIZE}&before=${encodeURIComponent(olderMessagesCursor)}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const page = await response.json();
+        const previousHeight = chatBox.scrollHeight;
+        chatHistory.unshift(...historyEntries(page.messages));
+        chatBox.prepend(historyElements(page.messages));
+        chatBox.scrollTop += chatBox.scrollHeight - previousHeight;
+        olderMessagesCursor = page.next_cursor;
+    } catch (e) {
+        console.warn("Could not load older messages:", e);
+    } finally {
+        loadingOlderMessages = false;
     }
 }
 
@@ -2375,6 +3037,9 @@ function showChatContext() {
     if (chatHistory.length <= 1 && !systemPrompt) {
         contextInfo += "No conversation history found. Try sending a few messages first.";
     }
+    if (olderMessagesCursor) {
+        contextInfo += "Older messages of this conversation are not loaded; scroll up to include them.\n";
+    }
 
     // Add role count summary with the system prompt included
     contextInfo += `\n--- Summary ---\n`;
@@ -2485,6 +3150,9 @@ function displayFullChatHistory() {
 
         historyText += `[${index}] ${msg.role.toUpperCase()}:\n${content}\n\n---\n\n`;
     });
+    if (olderMessagesCursor) {
+        historyText += "(Older messages are stored but not loaded; scroll up to load them.)\n";
+    }
 
     // Add to chat as system message
     appendMessage(historyText, 'system');
@@ -2769,24 +3437,11 @@ async function generateImage() {
             payload.enable_web_search = webSearchToggle.checked;
         }
         
-        const response = await fetch('/image/generate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify(payload)
-        });
-        
-        const data = await response.json();
+        // Runs in the background on the server, so a slow model cannot outlast the connection
+        const data = await runJob('image', payload, '/image/generate');
         
         chatBox.removeChild(loadingDiv);
         
-        if (!response.ok || data.error) {
-            const errorMessage = data.error || 'Image generation failed';
-            appendMessage(`Error: ${errorMessage}`, 'error');
-            return;
-        }
-        
         if (data.images && data.images.length > 0) {
             data.images.forEach((image, index) => {
                 const imageMessageDiv = document.createElement('div');
@@ -0,0 +1,250 @@
+"""
+Text extraction from uploaded documents, in-process or on a process pool
+
+extract_text_from_file() dispatches on the file extension (txt, pdf,
+doc/docx, xls/xlsx) and runs in the calling thread, as /process_file does.
+Batch uploads extract many files at once; parsing PDFs and spreadsheets is
+CPU-bound and holds the GIL, so ExtractionPool runs the same dispatch on a
+bounded pool of worker processes instead, leaving the web worker's threads
+free to serve other requests.
+
+Pool processes are started from a forkserver (spawn where there is none)
+rather than forked from a threaded web worker. The forkserver imports this
+module and the parsing libraries once and forks every pool process from
+there; like any multiprocessing helper it also re-imports the __main__
+module (as __mp_main__), so entry points keep their side effects under
+``if __name__ == '__main__'``.
+"""
+
+import concurrent.futures
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+from lazy_imports import PyPDF2, docx, pandas as pd, fitz
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_TYPES = ('txt', 'pdf', 'doc', 'docx', 'xls', 'xlsx')
+
+
+def extract_text(file_data, file_type):
+    """
+    Extracts text content from various file formats
+
+    Supports txt, pdf, doc/docx, and xls/xlsx files
+
+    Args:
+        file_data (bytes): Binary file data
+        file_type (str): File extension indicating the type
+
+    Returns:
+        tuple: (extracted text or None if extraction fails, number of pages or sheets)
+    """
+    pages = 1
+    try:
+        logger.info(f"Extracting text from {file_type} file")
+        text = ""
+        if file_type == 'txt':
+            text = file_data.decode('utf-8')
+            logger.debug("Text file decoded successfully")
+        elif file_type == 'pdf':
+            try:
+                # Try using PyMuPDF first
+                pdf_file = io.BytesIO(file_data)
+                pdf_document = fitz.open(stream=pdf_file, filetype="pdf")
+
+                logger.debug(f"PDF file loaded, pages: {len(pdf_document)}")
+                pages = len(pdf_document)
+
+                # Process each page
+                for page_num in range(len(pdf_document)):
+                    page = pdf_document[page_num]
+
+                    # Extract text with better formatting preservation
+                    page_text = page.get_text("text")
+
+                    # Safer table extraction
+                    try:
+                        tables = page.find_tables()
+                        if tables and hasattr(tables, 'tables') and tables.tables:
+                            for table in tables.tables:
+                                rows = []
+                                for cells in table.rows:
+                                    row_text = " | ".join([page.get_text("text", clip=cell.rect) for cell in cells])
+                                    rows.append(row_text)
+                                table_text = "\n".join(rows)
+                                page_text += f"\n\n--- Table ---\n{table_text}\n--- End Table ---\n"
+                    except Exception as table_err:
+                        logger.warning(f"Table extraction error: {str(table_err)}")
+
+                    text += f"\n--- Page {page_num + 1} ---\n{page_text}"
+
+                pdf_document.close()
+            except Exception as fitz_err:
+                # Fallback to PyPDF2 if PyMuPDF fails
+                logger.warning(f"PyMuPDF failed: {str(fitz_err)}, falling back to PyPDF2")
+                pdf_file = io.BytesIO(file_data)
+                pdf_reader = PyPDF2.PdfReader(pdf_file)
+                pages = len(pdf_reader.pages)
+
+                for page_num in range(len(pdf_reader.pages)):
+                    page = pdf_reader.pages[page_num]
+                    page_text = page.extract_text() or "No text extracted"
+                    text += f"\n--- Page {page_num + 1} ---\n{page_text}"
+        elif file_type in ['doc', 'docx']:
+            doc_file = io.BytesIO(file_data)
+            doc = docx.Document(doc_file)
+            logger.debug(f"DOC file loaded, paragraphs: {len(doc.paragraphs)}")
+            text = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
+        elif file_type in ['xls', 'xlsx']:
+            excel_file = io.BytesIO(file_data)
+            # Read all sheets
+            excel_data = pd.read_excel(excel_file, sheet_name=None)
+            pages = len(excel_data)
+
+            # Process each sheet
+            tables = []
+            for sheet_name, df in excel_data.items():
+                # Convert DataFrame to string representation with proper formatting
+                table_text = f"\n--- Sheet: {sheet_name} ---\n"
+                table_text += df.to_string(index=False)
+                tables.append(table_text)
+
+            text = "\n\n".join(tables)
+            logger.debug(f"Excel file processed, found {len(excel_data)} sheets")
+
+        if not text:
+            logger.warning("Warning: Extracted text is empty")
+            return None, pages
+
+        logger.info(f"Successfully extracted {len(text)} characters")
+        return text.strip(), pages
+    except Exception as e:
+        logger.exception(f"Error extracting text: {str(e)}")
+        return None, pages
+
+
+def extract_text_from_file(file_data, file_type):
+    """
+    Extracts text content from various file formats in the calling thread
+
+    Args:
+        file_data (bytes): Binary file data
+        file_type (str): File extension indicating the type
+
+    Returns:
+        str: Extracted text content or None if extraction fails
+    """
+    start = time.perf_counter()
+    text, pages = extract_text(file_data, file_type)
+    metrics.FILE_EXTRACTION.labels(file_type, metrics.page_bucket(pages)).observe(time.perf_counter() - start)
+    return text
+
+
+def _timed_extract(file_data, file_type):
+    # Runs in a pool process; the duration is reported back so the web worker records the metric
+    start = time.perf_counter()
+    text, pages = extract_text(file_data, file_type)
+    return text, pages, time.perf_counter() - start
+
+
+class ExtractionPool:
+    """
+    Bounded process pool running extract_text() off the web worker
+
+    The executor is created lazily and per process, so a pool created before
+    gunicorn forks is not shared by the workers. A pool whose process died
+    (e.g. a parser crash) is replaced on the next submission.
+
+    Args:
+        workers (int): Extraction processes per web worker
+        max_tasks_per_child (int): Files a process extracts before it is replaced,
+            bounding memory growth from the parsing libraries
+    """
+
+    def __init__(self, workers=2, max_tasks_per_child=100):
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Builds the pool from EXTRACTION_WORKERS (default: up to 4, one per core)"""
+        default = min(4, os.cpu_count() or 1)
+        return cls(int(os.getenv('EXTRACTION_WORKERS', str(default))))
+
+    def _get_executor(self):
+        if self._pid == os.getpid() and self._executor is not None:
+            return self._executor
+        with self._lock:
+            if self._pid != os.getpid() or self._executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                if context.get_start_method() == 'forkserver':
+                    # Children fork from a server that has the parsers imported already; missing ones are skipped
+                    context.set_forkserver_preload([__name__, 'fitz', 'PyPDF2', 'docx', 'pandas'])
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=context, max_tasks_per_child=self.max_tasks_per_child)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def extract_many(self, files):
+        """
+        Extracts files concurrently, yielding each result as soon as it is ready
+
+        Closing the generator early (e.g. when the client disconnects) cancels
+        the extractions that have not started.
+
+        Args:
+            files (list): (key, file_data, file_type) tuples
+
+        Yields:
+            tuple: (key, extracted text or None if extraction failed), in
+                order of completion
+        """
+        executor = self._get_executor()
+        futures = {}
+        try:
+            for key, file_data, file_type in files:
+                try:
+                    future = executor.submit(_timed_extract, file_data, file_type)
+                except BrokenProcessPool:
+                    self._discard(executor)
+                    executor = self._get_executor()
+                    future = executor.submit(_timed_extract, file_data, file_type)
+                futures[future] = (key, file_type)
+
+            for future in concurrent.futures.as_completed(futures):
+                key, file_type = futures[future]
+                try:
+                    text, pages, seconds = future.result()
+                except BrokenProcessPool:
+                    logger.error(f"Extraction process died while extracting {key}")
+                    self._discard(executor)
+                    yield key, None
+                    continue
+                metrics.FILE_EXTRACTION.labels(file_type, metrics.page_bucket(pages)).observe(seconds)
+                yield key, text
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        """Stops the pool's processes, cancelling queued extractions"""
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,143 @@
+"""
+Lightweight per-request timing spans
+
+Every request gets a RequestTrace on flask.g. Handlers record phases either as
+spans (``with trace.span('extract'):``) or as marks (``trace.mark('parse')``
+closes the phase that started at the previous mark). Regular responses carry
+the result in a Server-Timing header. Streams are timed by traced_stream(),
+which adds the time spent relaying chunks and waiting on the client, and sends
+the breakdown as a final ``server_timing`` SSE event before [DONE].
+"""
+
+import time
+from contextlib import contextmanager
+
+from flask import g
+
+import json_codec
+
+# Spans recorded inside a stream generator that are waits on the upstream, not relay work
+UPSTREAM_SPANS = ('upstream_connect', 'upstream_first_byte', 'upstream_read')
+
+DONE_FRAME = "data: [DONE]\n\n"
+
+
+class RequestTrace:
+    """Accumulates named phase durations for one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._last = self.start
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def mark(self, name):
+        """Records the time since the previous mark (or request start) as ``name``"""
+        now = time.perf_counter()
+        self.add(name, now - self._last)
+        self._last = now
+
+    @contextmanager
+    def span(self, name):
+        """Times the enclosed block as ``name``"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.add(name, end - start)
+            self._last = end
+
+    def timed_iter(self, iterable, name, first_name=None):
+        """
+        Yields from an iterable, timing how long each item took to arrive
+
+        Args:
+            iterable: Source iterable (e.g. response.iter_lines())
+            name (str): Span the wait for each item is added to
+            first_name (str, optional): Separate span for the wait on the first item
+        """
+        iterator = iter(iterable)
+        span_name = first_name or name
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(span_name, time.perf_counter() - start)
+                return
+            self.add(span_name, time.perf_counter() - start)
+            span_name = name
+            yield item
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        """Returns the spans and the total in milliseconds"""
+        timings = {name: round(seconds * 1000, 1) for name, seconds in self.spans.items()}
+        timings['total'] = round(self.total() * 1000, 1)
+        return timings
+
+    def header(self):
+        """Formats the spans as a Server-Timing header value"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.as_dict().items())
+
+
+def current_trace():
+    """Returns the trace of the current request"""
+    trace = g.get('trace')
+    if trace is None:
+        trace = g.trace = RequestTrace()
+    return trace
+
+
+def traced_stream(trace, generator):
+    """
+    Wraps an SSE generator to time relay work and client writes
+
+    Time spent inside the generator beyond its upstream spans is recorded as
+    'relay'; time spent suspended at a yield (the server writing the frame to
+    the client) as 'client'. The breakdown is sent as a server_timing event
+    just before [DONE].
+    """
+    relay = client = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                frame = next(generator)
+            except StopIteration:
+                return
+            resumed = time.perf_counter()
+            relay += resumed - start
+
+            if frame == DONE_FRAME:
+                upstream = sum(trace.spans.get(name, 0.0) for name in UPSTREAM_SPANS)
+                trace.add('relay', max(0.0, relay - upstream))
+                trace.add('client', client)
+                yield f"data: {json_codec.dumps({'server_timing': trace.as_dict()})}\n\n"
+
+            yield frame
+            client += time.perf_counter() - resumed
+    finally:
+        generator.close()
+
+
+def init_app(app):
+    """Starts a trace for every request and adds the Server-Timing header"""
+
+    @app.before_request
+    def _start_trace():
+        g.trace = RequestTrace()
+
+    @app.after_request
+    def _add_server_timing(response):
+        trace = g.get('trace')
+        if trace is not None:
+            if not response.is_streamed:
+                trace.mark('respond')
+            response.headers['Server-Timing'] = trace.header()
+        return response
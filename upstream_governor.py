@@ -0,0 +1,271 @@
+"""
+Rate-limit governor for Venice API calls
+
+Venice limits requests per model per minute and reports the current window in
+x-ratelimit-* response headers. The governor keeps a token bucket per model,
+sized from VENICE_RATE_LIMITS or learned from those headers, and paces calls
+so bursts queue briefly instead of turning into a storm of 429s.
+
+When the upstream still answers 429 or 503, the call is retried with jittered
+exponential backoff that honors Retry-After, as long as the total wait stays
+within the queue budget. Retries only ever happen on the status line: once a
+response is handed back to the caller and it starts reading the body (e.g.
+relaying a stream), it is never retried.
+
+Limits are tracked per process. Under gunicorn each worker paces itself, and
+the shared upstream headers keep the workers from overshooting together.
+"""
+
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 503)
+
+
+class UpstreamBusyError(Exception):
+    """Raised when no request slot frees up for a model within the queue budget"""
+
+    def __init__(self, model, retry_after):
+        self.model = model
+        self.retry_after = retry_after
+        super().__init__(f"{model} is rate limited right now, please retry in {int(retry_after) + 1}s")
+
+
+def parse_rate_limits(value):
+    """
+    Parses a VENICE_RATE_LIMITS value
+
+    Args:
+        value (str): Comma-separated model=requests_per_minute pairs; '*' sets the default
+
+    Returns:
+        dict: Requests per minute keyed by model id (and '*')
+    """
+    limits = {}
+    for item in (value or '').split(','):
+        if '=' not in item:
+            continue
+        model, per_minute = item.split('=', 1)
+        try:
+            limits[model.strip()] = float(per_minute)
+        except ValueError:
+            logger.warning(f"Ignoring invalid rate limit entry: {item}")
+    return limits
+
+
+def parse_retry_after(value):
+    """Returns the seconds a Retry-After header asks for, or None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Request slots for one model, refilled continuously at the per-minute rate"""
+
+    def __init__(self, per_minute, burst):
+        self.per_minute = per_minute
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def set_limit(self, per_minute, burst):
+        if per_minute != self.per_minute:
+            self.per_minute = per_minute
+            self.capacity = burst
+            self.tokens = min(self.tokens, burst)
+
+    def refill(self, now):
+        if self.per_minute:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a slot is available (0 if one is available now)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if not self.per_minute or self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * 60 / self.per_minute
+
+
+class UpstreamGovernor:
+    """
+    Paces and retries upstream calls per model
+
+    Args:
+        limits (dict): Requests per minute by model id; '*' is the default for
+            other models. Models without a limit are only paced once the
+            upstream headers report one.
+        burst_fraction (float): Share of the per-minute limit that may be sent
+            back to back before pacing starts (1.0 matches the upstream window)
+        max_wait (float): Longest a call may spend queued and backing off
+        max_retries (int): Retries after a 429/503
+        base_backoff (float): First backoff step in seconds
+        max_backoff (float): Cap on a single backoff step
+    """
+
+    def __init__(self, limits=None, burst_fraction=1.0, max_wait=10.0, max_retries=3,
+                 base_backoff=0.5, max_backoff=8.0):
+        self.limits = limits or {}
+        self.burst_fraction = burst_fraction
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Builds a governor from VENICE_RATE_LIMITS, VENICE_MAX_QUEUE_WAIT and VENICE_MAX_RETRIES"""
+        return cls(
+            limits=parse_rate_limits(os.getenv('VENICE_RATE_LIMITS', '')),
+            burst_fraction=float(os.getenv('VENICE_RATE_BURST', '1.0')),
+            max_wait=float(os.getenv('VENICE_MAX_QUEUE_WAIT', '10')),
+            max_retries=int(os.getenv('VENICE_MAX_RETRIES', '3'))
+        )
+
+    def _burst(self, per_minute):
+        return max(1.0, per_minute * self.burst_fraction) if per_minute else 1.0
+
+    def _bucket(self, model):
+        # Unknown model ids share one bucket, so ids sent by clients do not grow the table
+        model = metrics.model_label(model)
+        bucket = self._buckets.get(model)
+        if bucket is None:
+            per_minute = self.limits.get(model, self.limits.get('*', 0))
+            bucket = self._buckets[model] = TokenBucket(per_minute, self._burst(per_minute))
+        return bucket
+
+    def acquire(self, model, deadline):
+        """
+        Waits for a request slot for a model
+
+        Args:
+            model (str): Model id the call is for
+            deadline (float): time.monotonic() value after which to give up
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            UpstreamBusyError: If no slot frees up before the deadline
+        """
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                bucket = self._bucket(model)
+                bucket.refill(now)
+                wait = bucket.wait_time(now)
+                if wait <= 0:
+                    if bucket.per_minute:
+                        bucket.tokens -= 1
+                    return now - start
+            if now + wait > deadline:
+                raise UpstreamBusyError(model, wait)
+            # Wake up a little early and re-check; other threads may have taken the slot
+            time.sleep(min(wait, 0.25) + random.uniform(0, 0.01))
+
+    def observe(self, model, response):
+        """Updates a model's bucket from the rate limit headers of a response"""
+        headers = response.headers
+        with self._lock:
+            bucket = self._bucket(model)
+            now = time.monotonic()
+            try:
+                limit = headers.get('x-ratelimit-limit-requests')
+                if limit and model not in self.limits:
+                    per_minute = float(limit)
+                    bucket.set_limit(per_minute, self._burst(per_minute))
+                remaining = headers.get('x-ratelimit-remaining-requests')
+                if remaining is not None:
+                    # The upstream's count is authoritative; it also covers other workers and clients
+                    bucket.refill(now)
+                    bucket.tokens = min(bucket.capacity, float(remaining))
+                    reset = headers.get('x-ratelimit-reset-requests')
+                    if float(remaining) <= 0 and reset:
+                        bucket.blocked_until = max(bucket.blocked_until, now + max(0.0, float(reset) - time.time()))
+            except ValueError:
+                logger.debug(f"Unparseable rate limit headers for {model}")
+
+            if response.status_code in RETRY_STATUSES:
+                retry_after = parse_retry_after(headers.get('Retry-After'))
+                if retry_after is not None:
+                    bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+
+    def backoff(self, attempt, response):
+        """Returns the delay before the next retry: Retry-After if given, else full-jitter exponential"""
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            # Spread the herd that got the same Retry-After
+            return retry_after + random.uniform(0, self.base_backoff)
+        return random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+
+    def post(self, model, call, url, session=None, **kwargs):
+        """
+        Sends a POST to the upstream under the model's rate limit
+
+        A 429/503 is retried while the queue budget allows; the last response
+        is returned as-is when it does not. Request bodies must be re-sendable
+        (bytes, str or a re-iterable body).
+
+        Args:
+            model (str): Model id, used to pick the rate limit bucket
+            call (str): Metrics label for the kind of call
+            url (str): Upstream URL
+            session (requests.Session, optional): Pooled session to send through
+            **kwargs: Passed to requests.post()
+
+        Returns:
+            requests.Response: The upstream response, body not yet consumed
+
+        Raises:
+            UpstreamBusyError: If no request slot frees up within the queue budget
+        """
+        deadline = time.monotonic() + self.max_wait
+        waited = 0.0
+        attempt = 0
+        sender = session or requests
+        try:
+            while True:
+                waited += self.acquire(model, deadline)
+                response = sender.post(url, **kwargs)
+                self.observe(model, response)
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+
+                delay = self.backoff(attempt, response)
+                if time.monotonic() + delay > deadline:
+                    return response
+                logger.warning(f"Upstream {response.status_code} for {model} ({call}), "
+                               f"retry {attempt + 1} in {delay:.1f}s")
+                metrics.UPSTREAM_RETRIES.labels(call, str(response.status_code)).inc()
+                response.close()
+                time.sleep(delay)
+                waited += delay
+                attempt += 1
+        except UpstreamBusyError:
+            metrics.UPSTREAM_THROTTLED.labels(call).inc()
+            raise
+        finally:
+            metrics.UPSTREAM_QUEUE_WAIT.labels(call).observe(waited)
@@ -0,0 +1,207 @@
+"""
+Per-phase timeouts for upstream calls and a watchdog for stalled streams
+
+An upstream call can hang in three places: connecting, waiting for the first
+byte of the answer and waiting for the next chunk once it is streaming. Each
+model class has its own limit for each phase; reasoning models may think for
+minutes before their first token, so their first-byte limit is longer.
+
+Connect and socket reads are bounded by the requests (connect, read) timeout.
+A socket timeout alone cannot tell a model that is thinking from one that has
+stalled mid-answer, and it never fires while the upstream trickles keepalive
+bytes, so a watchdog thread also checks every watched stream against its
+phase deadline. A stream that misses it has its call token cancelled, which
+aborts the response and wakes the thread reading it; the provider reports
+the stall as a timeout, which /chat/stream sends to the client as an error
+event.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+from cancellation import CancelToken
+
+logger = logging.getLogger(__name__)
+
+FIRST_BYTE_TIMEOUT = 'first_byte_timeout'
+IDLE_TIMEOUT = 'idle_timeout'
+STALL_REASONS = (FIRST_BYTE_TIMEOUT, IDLE_TIMEOUT)
+
+
+class TimeoutPolicy:
+    """
+    Limits for the phases of one upstream call
+
+    Args:
+        connect (float): Seconds to establish the connection
+        first_byte (float): Seconds from sending the request to the first chunk
+        idle (float): Seconds allowed between chunks once the answer streams
+    """
+
+    __slots__ = ('connect', 'first_byte', 'idle')
+
+    def __init__(self, connect, first_byte, idle):
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle = idle
+
+    @property
+    def requests_timeout(self):
+        """The (connect, read) timeout for requests; reads are bounded by the longer phase"""
+        return self.connect, max(self.first_byte, self.idle)
+
+    def __repr__(self):
+        return f"TimeoutPolicy(connect={self.connect}, first_byte={self.first_byte}, idle={self.idle})"
+
+
+class Watch:
+    """
+    One upstream call under the watchdog
+
+    Created by UpstreamTimeouts.watch(); wrap the call's events in beats() and
+    close() the watch when the call is over.
+
+    Attributes:
+        token (CancelToken): Cancelled with a STALL_REASONS reason when a deadline passes
+    """
+
+    __slots__ = ('model', 'call', 'policy', 'token', 'started', 'last', '_owner')
+
+    def __init__(self, owner, model, call, policy, token):
+        self._owner = owner
+        self.model = model
+        self.call = call
+        self.policy = policy
+        self.token = token
+        self.started = time.monotonic()
+        self.last = None
+
+    def beats(self, items):
+        """Passes items through, recording each as a sign of life"""
+        for item in items:
+            self.last = time.monotonic()
+            yield item
+
+    def deadline(self):
+        if self.last is None:
+            return self.started + self.policy.first_byte
+        return self.last + self.policy.idle
+
+    def describe(self, reason):
+        """Returns the error shown to the client for a call stalled with reason"""
+        if reason == FIRST_BYTE_TIMEOUT:
+            return f"{self.model} did not start answering within {self.policy.first_byte:g}s"
+        return f"{self.model} stopped responding for {self.policy.idle:g}s"
+
+    def close(self):
+        self._owner._unwatch(self)
+
+    def _fire(self, now):
+        reason = FIRST_BYTE_TIMEOUT if self.last is None else IDLE_TIMEOUT
+        # A token the request already cancelled is not a stall
+        if self.token.cancel(reason):
+            since = now - (self.started if self.last is None else self.last)
+            logger.warning(f"Upstream {self.call} for {self.model} stalled: {reason} after {since:.1f}s")
+            metrics.UPSTREAM_STALLS.labels(metrics.model_label(self.model), self.call, reason).inc()
+
+
+class UpstreamTimeouts:
+    """
+    Timeout policies by model class, and the watchdog that enforces them on streams
+
+    Model classes are 'text', 'reasoning' (models whose catalog entry has
+    supportsReasoning) and 'image'.
+
+    Args:
+        policies (dict): TimeoutPolicy by model class; 'text' is the default
+        interval (float): Seconds between watchdog checks
+    """
+
+    def __init__(self, policies, interval=0.5):
+        self.policies = policies
+        self.interval = interval
+        # capabilities(model) -> dict of catalog capabilities; set by the app once the model registry exists
+        self.capabilities = None
+        self._watches = set()
+        self._lock = threading.Lock()
+        self._thread_pid = None
+
+    @classmethod
+    def from_env(cls):
+        """Builds the policies from the UPSTREAM_*_TIMEOUT variables"""
+        connect = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '10'))
+        idle = float(os.getenv('UPSTREAM_IDLE_TIMEOUT', '30'))
+        return cls({
+            'text': TimeoutPolicy(connect, float(os.getenv('UPSTREAM_FIRST_BYTE_TIMEOUT', '60')), idle),
+            'reasoning': TimeoutPolicy(connect, float(os.getenv('UPSTREAM_REASONING_FIRST_BYTE_TIMEOUT', '180')),
+                                       idle),
+            # Images arrive in one piece once generated, so the first byte is the whole generation
+            'image': TimeoutPolicy(connect, float(os.getenv('UPSTREAM_IMAGE_TIMEOUT', '120')), idle)
+        })
+
+    def model_class(self, model):
+        capabilities = self.capabilities(model) if self.capabilities is not None else {}
+        return 'reasoning' if capabilities.get('supportsReasoning') else 'text'
+
+    def policy(self, model, model_class=None):
+        """
+        Returns the policy for a model
+
+        Args:
+            model (str): Model id
+            model_class (str, optional): Overrides the class looked up from the catalog (e.g. 'image')
+        """
+        return self.policies.get(model_class or self.model_class(model), self.policies['text'])
+
+    def watch(self, model, call, policy=None, cancel=None):
+        """
+        Puts an upstream call under the watchdog; its first-byte clock starts now
+
+        Args:
+            model (str): Model id
+            call (str): Metrics label for the kind of call
+            policy (TimeoutPolicy, optional): Defaults to the model's policy
+            cancel (CancelToken, optional): Token of the request; the watch's
+                token is a child of it, so a stall cancels only this call
+
+        Returns:
+            Watch: Pass watch.token to the code reading the response
+        """
+        self._ensure_thread()
+        token = cancel.child() if cancel is not None else CancelToken()
+        watch = Watch(self, model, call, policy or self.policy(model), token)
+        with self._lock:
+            self._watches.add(watch)
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            self._watches.discard(watch)
+
+    def _ensure_thread(self):
+        # Started lazily and per process: a thread started before gunicorn forks does not exist in the workers
+        if self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._watches = set()
+            self._thread_pid = os.getpid()
+            threading.Thread(target=self._run, name='upstream-watchdog', daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._thread_pid == pid:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            with self._lock:
+                expired = [watch for watch in self._watches if now > watch.deadline()]
+                self._watches.difference_update(expired)
+            for watch in expired:
+                try:
+                    watch._fire(now)
+                except Exception as e:
+                    logger.error(f"Watchdog failed to stop {watch.model}: {str(e)}")
@@ -0,0 +1,233 @@
+"""
+Usage ledger: tokens and timings of every upstream call in SQLite
+
+Each finished or failed model call (stream, expert candidate, synthesis,
+image) is appended to a bounded in-memory queue; a background thread writes
+the queue to a local SQLite database in batches, so the request path never
+touches the disk. When the queue is full, records are dropped and counted
+rather than slowing requests down.
+
+Every worker process runs its own writer against the same database file;
+WAL mode lets them write and the query endpoint read concurrently.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    ts REAL NOT NULL,
+    model TEXT NOT NULL,
+    call TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    reason TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    ttfb REAL,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS usage_ts ON usage (ts);
+CREATE INDEX IF NOT EXISTS usage_model_ts ON usage (model, ts);
+"""
+
+BUCKETS = {'hour': 3600, 'day': 86400}
+
+_STOP = object()
+
+
+def connect(path):
+    """Opens the ledger database in WAL mode, creating the schema if needed"""
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class UsageLedger:
+    """
+    Batched writer and aggregate queries for upstream call records
+
+    Args:
+        path (str): SQLite database file
+        batch_size (int): Records written per transaction at most
+        flush_interval (float): Seconds a record may wait before its batch is written
+        max_queue (int): Records buffered before new ones are dropped
+        retention_days (float): Records older than this are deleted (0 keeps all)
+    """
+
+    def __init__(self, path, batch_size=500, flush_interval=2.0, max_queue=20000, retention_days=90):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention_days = retention_days
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._writer = None
+        self._writer_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, data_dir):
+        """Builds the ledger from USAGE_LEDGER_* variables, or returns None if it is disabled"""
+        if os.getenv('USAGE_LEDGER', '1') != '1':
+            return None
+        os.makedirs(data_dir, exist_ok=True)
+        return cls(
+            os.getenv('USAGE_LEDGER_PATH', os.path.join(data_dir, 'usage.sqlite3')),
+            flush_interval=float(os.getenv('USAGE_LEDGER_FLUSH_INTERVAL', '2')),
+            retention_days=float(os.getenv('USAGE_LEDGER_RETENTION_DAYS', '90'))
+        )
+
+    def record(self, model, call, ok, reason=None, prompt_tokens=None, completion_tokens=None, ttfb=None,
+               duration=None):
+        """
+        Queues one call record; never blocks
+
+        Args:
+            model (str): Model id
+            call (str): Kind of call ('stream', 'candidate', 'synthesis', 'image')
+            ok (bool): Whether the call succeeded
+            reason (str, optional): Failure reason
+            prompt_tokens (int, optional): Prompt tokens reported by the upstream
+            completion_tokens (int, optional): Completion tokens reported by the upstream
+            ttfb (float, optional): Seconds to the first byte
+            duration (float, optional): Seconds the whole call took
+        """
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait((time.time(), model, call, int(ok), reason, prompt_tokens, completion_tokens,
+                                    ttfb, duration))
+        except queue.Full:
+            metrics.USAGE_LEDGER_DROPPED.inc()
+
+    def _ensure_writer(self):
+        # Started lazily and per process: a thread started before gunicorn forks does not exist in the workers
+        if self._writer_pid == os.getpid():
+            return
+        with self._lock:
+            if self._writer_pid == os.getpid():
+                return
+            self._writer = threading.Thread(target=self._run, name='usage-ledger-writer', daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        conn = connect(self.path)
+        last_prune = 0.0
+        stopping = False
+        while not stopping:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            # Whatever else has queued up meanwhile goes into the same transaction
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [row for row in batch if row is not _STOP]
+            if batch:
+                self._write(conn, batch)
+            if self.retention_days and time.time() - last_prune > 3600:
+                last_prune = time.time()
+                self._prune(conn)
+        conn.close()
+
+    def _write(self, conn, batch):
+        try:
+            with conn:
+                conn.executemany('INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            metrics.USAGE_LEDGER_WRITES.inc(len(batch))
+        except sqlite3.Error as e:
+            metrics.USAGE_LEDGER_DROPPED.inc(len(batch))
+            logger.error(f"Usage ledger write of {len(batch)} records failed: {str(e)}")
+
+    def _prune(self, conn):
+        try:
+            with conn:
+                conn.execute('DELETE FROM usage WHERE ts < ?', (time.time() - self.retention_days * 86400,))
+        except sqlite3.Error as e:
+            logger.warning(f"Usage ledger pruning failed: {str(e)}")
+
+    def close(self, timeout=5.0):
+        """Writes out queued records and stops the writer"""
+        if self._writer is None or self._writer_pid != os.getpid() or not self._writer.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            logger.warning("Usage ledger queue full at shutdown, records lost")
+            return
+        self._writer.join(timeout)
+
+    def query(self, since, until=None, bucket='hour', model=None, call=None):
+        """
+        Aggregates calls per model, kind of call and time bucket
+
+        Args:
+            since (float): Start as a Unix timestamp
+            until (float, optional): End as a Unix timestamp (default: now)
+            bucket (str): 'hour' or 'day'
+            model (str, optional): Only this model
+            call (str, optional): Only this kind of call
+
+        Returns:
+            list: One dict per (bucket, model, call) with call and error counts,
+                token sums, average/max TTFB, average duration and the
+                generation rate in tokens per second
+        """
+        size = BUCKETS[bucket]
+        where = ['ts >= ?', 'ts < ?']
+        params = [since, until or time.time()]
+        if model:
+            where.append('model = ?')
+            params.append(model)
+        if call:
+            where.append('call = ?')
+            params.append(call)
+
+        sql = f"""
+            SELECT CAST(ts / {size} AS INTEGER) * {size} AS bucket, model, call,
+                   COUNT(*), SUM(1 - ok), SUM(prompt_tokens), SUM(completion_tokens),
+                   AVG(ttfb), MAX(ttfb), AVG(duration),
+                   SUM(CASE WHEN ok AND completion_tokens AND duration > ttfb THEN completion_tokens END),
+                   SUM(CASE WHEN ok AND completion_tokens AND duration > ttfb THEN duration - ttfb END)
+            FROM usage WHERE {' AND '.join(where)}
+            GROUP BY bucket, model, call ORDER BY bucket, model, call
+        """
+        conn = connect(self.path)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+        def rounded(value, digits=3):
+            return round(value, digits) if value is not None else None
+
+        return [{
+            'bucket': bucket_start,
+            'model': row_model,
+            'call': row_call,
+            'calls': calls,
+            'errors': errors,
+            'prompt_tokens': prompt_tokens or 0,
+            'completion_tokens': completion_tokens or 0,
+            'ttfb_avg': rounded(ttfb_avg),
+            'ttfb_max': rounded(ttfb_max),
+            'duration_avg': rounded(duration_avg),
+            'tokens_per_second': rounded(rate_tokens / rate_seconds, 1) if rate_seconds else None
+        } for (bucket_start, row_model, row_call, calls, errors, prompt_tokens, completion_tokens, ttfb_avg,
+               ttfb_max, duration_avg, rate_tokens, rate_seconds) in rows]